@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from mockopenai import MockBackend, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ベンチマークするクライアント（ディレクトリ名 → MCPOpenAIClient のあるモジュール）
+CLIENTS = {"openaimcp": "client", "giminimcp": "client", "gradiomcp": "mcpclient"}
+
+
+def load_queries(n: int) -> List[str]:
+    """KBの質問とツールを呼ぶ質問を混ぜて、n個のクエリを作る."""
+    with open(os.path.join(ROOT, "openaimcp", "data", "kb.json"), encoding="utf-8") as f:
+        questions = [entry["question"] for entry in json.load(f)]
+    questions += ["barrow を計算してください", "こんにちは"]
+    return [questions[i % len(questions)] for i in range(n)]
+
+
+def summarize(latencies: List[float], percentile: Any) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+async def run_worker(
+    name: str,
+    queries: List[str],
+    concurrency: int,
+    stream: bool,
+    pool_size: int,
+    deadline: Optional[float] = None,
+    hedge_quantile: Optional[float] = None,
+) -> Dict[str, Any]:
+    """1つのクライアントを実際のMCPサーバー（stdio）につなぎ、クエリを流して計測する."""
+    client_dir = os.path.join(ROOT, name)
+    os.chdir(client_dir)
+    sys.path.insert(0, client_dir)
+    module = importlib.import_module(CLIENTS[name])
+    from mcpcommon.deadline import Hedger
+    from mcpcommon.tracing import percentile
+
+    hedger = Hedger(quantile=hedge_quantile) if hedge_quantile else None
+    client = module.MCPOpenAIClient(deadline=deadline, hedger=hedger)
+    await client.connect_to_server("server.py", pool_size=pool_size)
+    # 接続直後の初回の遅れ（ツール一覧の取得など）を計測から外す（持ち時間は十分にとる）
+    await client.process_query(queries[0], deadline=60.0)
+
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    errors = 0
+    start = time.perf_counter()
+    if stream:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(query: str) -> None:
+            nonlocal errors
+            async with semaphore:
+                begin = time.perf_counter()
+                first = None
+                try:
+                    async for _ in client.process_query_stream(query):
+                        if first is None:
+                            first = time.perf_counter() - begin
+                except Exception:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - begin)
+                first_tokens.append(first or 0.0)
+
+        await asyncio.gather(*(run(query) for query in queries))
+    else:
+        async for result in client.process_queries(queries, concurrency=concurrency):
+            if result["error"] is not None:
+                errors += 1
+            else:
+                latencies.append(result["seconds"])
+    wall = time.perf_counter() - start
+    await client.cleanup()
+
+    report = {
+        "client": name,
+        "mode": "stream" if stream else "batch",
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        **summarize(latencies, percentile),
+    }
+    if stream:
+        report["ttft_p50"] = percentile(sorted(first_tokens), 0.5)
+    if hedger is not None:
+        report["hedge"] = hedger.stats()
+    return report
+
+
+def run_client(name: str, args: argparse.Namespace, env: Dict[str, str], stream: bool) -> Dict[str, Any]:
+    """クライアントごとに別のプロセスで計測する（各ディレクトリのモジュール名が重なるため）."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as out:
+        out_path = out.name
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", name,
+        "-n", str(args.n), "--concurrency", str(args.concurrency),
+        "--pool-size", str(args.pool_size), "--out", out_path,
+    ]
+    if args.deadline:
+        command += ["--deadline", str(args.deadline)]
+    if args.hedge_quantile:
+        command += ["--hedge-quantile", str(args.hedge_quantile)]
+    if stream:
+        command.append("--stream")
+    # クライアントは標準出力に接続のログなどを書くため、結果はファイルで受け取る
+    proc = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        if proc.returncode != 0:
+            raise RuntimeError(f"{name} のベンチマークが失敗しました:\n{proc.stderr[-2000:]}")
+        with open(out_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(out_path)
+
+
+def print_table(reports: List[Dict[str, Any]]) -> None:
+    header = f"{'client':<10} {'mode':<6} {'n':>5} {'conc':>4} {'err':>4} {'q/s':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        ttft = f"{r['ttft_p50'] * 1000:>6.1f}ms" if "ttft_p50" in r else f"{'-':>8}"
+        print(
+            f"{r['client']:<10} {r['mode']:<6} {r['queries']:>5} {r['concurrency']:>4} {r['errors']:>4} "
+            f"{r['throughput']:>8.2f} {r['mean'] * 1000:>7.1f}ms {r['p50'] * 1000:>6.1f}ms "
+            f"{r['p95'] * 1000:>6.1f}ms {r['p99'] * 1000:>6.1f}ms {ttft}"
+        )
+
+
+def main():
+    """ベンチマークのメイン・エントリー・ポイント."""
+    parser = argparse.ArgumentParser(
+        description="モックのOpenAI互換サーバーと実際のMCPサーバーで、クライアントのスループットと遅延を計測する"
+    )
+    parser.add_argument("--clients", nargs="+", default=list(CLIENTS), choices=list(CLIENTS))
+    parser.add_argument("-n", type=int, default=100, help="クライアントごとのクエリ数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=1, help="MCPサーバーのプロセス数")
+    parser.add_argument("--latency", type=float, default=0.05, help="モックの応答までの秒数")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="モックが500エラーを返す割合")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="モックの応答が遅くなる割合")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="遅い応答に足す秒数")
+    parser.add_argument("--deadline", type=float, help="クエリごとの持ち時間の秒数")
+    parser.add_argument("--hedge-quantile", type=float, help="ヘッジを送る応答時間の分位数（例: 0.95）")
+    parser.add_argument("--modes", nargs="+", default=["batch", "stream"], choices=["batch", "stream"])
+    parser.add_argument("--json", help="結果をJSONで保存するファイル（回帰の比較用）")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--stream", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        report = asyncio.run(
+            run_worker(
+                args.worker,
+                load_queries(args.n),
+                args.concurrency,
+                args.stream,
+                args.pool_size,
+                args.deadline,
+                args.hedge_quantile,
+            )
+        )
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        return
+
+    backend = MockBackend(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+    )
+    server = start_server(backend)
+    env = dict(os.environ)
+    env.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        OPENAI_API_KEY="mock",
+    )
+
+    reports = [
+        run_client(name, args, env, mode == "stream")
+        for name in args.clients
+        for mode in args.modes
+    ]
+    server.shutdown()
+
+    print_table(reports)
+    for r in reports:
+        if "hedge" in r:
+            hedge = r["hedge"]
+            print(
+                f"{r['client']} {r['mode']}: hedge_rate={hedge['hedge_rate']:.1%} "
+                f"wins={hedge['hedge_wins']} completion p50/p95/p99="
+                f"{hedge['latency_p50'] * 1000:.0f}/{hedge['latency_p95'] * 1000:.0f}/"
+                f"{hedge['latency_p99'] * 1000:.0f}ms"
+            )
+    print(f"\nmock: {backend.stats}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
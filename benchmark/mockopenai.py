@@ -0,0 +1,327 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# 既定のシナリオ: 質問に応じてツールを1つ呼び、ツールの結果を受けたら回答する
+DEFAULT_SCRIPT: Dict[str, Any] = {
+    "rules": [
+        {"match": "barrow", "tool": "barrow", "arguments": {"a": "sit", "b": "2024"}},
+        {"match": "こんにちは|hello", "content": "こんにちは！ご用件をどうぞ。"},
+        {"match": ".", "tool": "search_knowledge_base", "arguments": {"query": "{query}"}},
+    ],
+    "final": "ツールの結果に基づく回答です: {tool_results}",
+    "default": "わかりません。",
+}
+
+# ストリーミングで1つのチャンクに入れる文字数
+_CHUNK_CHARS = 8
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _fill(value: Any, query: str) -> Any:
+    """引数のテンプレートの {query} をユーザーの質問で置き換える."""
+    if isinstance(value, str):
+        return value.replace("{query}", query)
+    if isinstance(value, dict):
+        return {k: _fill(v, query) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, query) for v in value]
+    return value
+
+
+class MockBackend:
+    """Chat Completions APIの応答を、シナリオに沿って決める.
+
+    シナリオの rules は上から順に、最後のユーザー・メッセージに match（正規表現）が
+    見つかった最初のものを使う. tool を持つルールは、リクエストにそのツールがあり
+    tool_choice が "none" でなければツールを呼ぶ. 最後のメッセージがツールの結果なら
+    final の {tool_results} に結果を入れて回答する.
+    """
+
+    def __init__(
+        self,
+        script: Optional[Dict[str, Any]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        token_delay: float = 0.0,
+        error_rate: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 1.0,
+    ):
+        """バックエンドを初期化する.
+
+        Args:
+            script: シナリオ（Noneの場合は DEFAULT_SCRIPT）.
+            latency: 応答（ストリーミングでは最初のチャンク）までの秒数.
+            jitter: latency に加える一様乱数の幅の秒数.
+            token_delay: ストリーミングのチャンクの間隔の秒数.
+            error_rate: 500エラーを返すリクエストの割合.
+            tail_rate: 応答が遅くなる（tail_latency 秒を足す）リクエストの割合.
+            tail_latency: 遅いリクエストに足す秒数.
+        """
+        self.script = script or DEFAULT_SCRIPT
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0, "tool_calls": 0, "errors": 0, "slow": 0}
+
+    def delay(self) -> None:
+        """設定した遅延だけ待つ."""
+        wait = self.latency + random.uniform(0, self.jitter)
+        if random.random() < self.tail_rate:
+            with self._lock:
+                self.stats["slow"] += 1
+            wait += self.tail_latency
+        if wait > 0:
+            time.sleep(wait)
+
+    def fail(self) -> bool:
+        """このリクエストに500エラーを返すかどうかを決める."""
+        if random.random() >= self.error_rate:
+            return False
+        with self._lock:
+            self.stats["errors"] += 1
+        return True
+
+    def reply(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """リクエストに対するアシスタントのメッセージを決める.
+
+        Returns:
+            "content" または "tool_calls" を持つメッセージ.
+        """
+        messages: List[Dict[str, Any]] = request.get("messages", [])
+        last = messages[-1] if messages else {}
+
+        if last.get("role") == "tool":
+            results = []
+            for message in reversed(messages):
+                if message.get("role") != "tool":
+                    break
+                results.insert(0, str(message.get("content", ""))[:200])
+            return {
+                "role": "assistant",
+                "content": self.script["final"].replace("{tool_results}", " / ".join(results)),
+            }
+
+        query = next(
+            (str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"),
+            "",
+        )
+        tools = {t["function"]["name"] for t in request.get("tools") or []}
+        for rule in self.script["rules"]:
+            if not re.search(rule["match"], query):
+                continue
+            if "tool" in rule:
+                if rule["tool"] not in tools or request.get("tool_choice") == "none":
+                    continue
+                with self._lock:
+                    self.stats["tool_calls"] += 1
+                arguments = _fill(rule.get("arguments", {}), query)
+                return {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{uuid.uuid4().hex[:12]}",
+                            "type": "function",
+                            "function": {
+                                "name": rule["tool"],
+                                "arguments": json.dumps(arguments, ensure_ascii=False),
+                            },
+                        }
+                    ],
+                }
+            return {"role": "assistant", "content": rule["content"]}
+        return {"role": "assistant", "content": self.script["default"]}
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """ストリーミングしない応答（chat.completion）を作る."""
+        with self._lock:
+            self.stats["requests"] += 1
+        message = self.reply(request)
+        prompt_tokens = _estimate_tokens(json.dumps(request.get("messages", []), ensure_ascii=False))
+        completion_tokens = _estimate_tokens(json.dumps(message, ensure_ascii=False))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def chunks(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """ストリーミングの応答（chat.completion.chunk の列）を作る."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["streams"] += 1
+        message = self.reply(request)
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        for index, call in enumerate(message.get("tool_calls") or []):
+            # 名前とIDを先に送り、引数は断片に分けて送る
+            chunks.append(
+                chunk(
+                    {
+                        "tool_calls": [
+                            {
+                                "index": index,
+                                "id": call["id"],
+                                "type": "function",
+                                "function": {"name": call["function"]["name"], "arguments": ""},
+                            }
+                        ]
+                    }
+                )
+            )
+            arguments = call["function"]["arguments"]
+            for i in range(0, len(arguments), _CHUNK_CHARS):
+                chunks.append(
+                    chunk(
+                        {
+                            "tool_calls": [
+                                {
+                                    "index": index,
+                                    "function": {"arguments": arguments[i : i + _CHUNK_CHARS]},
+                                }
+                            ]
+                        }
+                    )
+                )
+        content = message.get("content") or ""
+        for i in range(0, len(content), _CHUNK_CHARS):
+            chunks.append(chunk({"content": content[i : i + _CHUNK_CHARS]}))
+        chunks.append(chunk({}, "tool_calls" if message.get("tool_calls") else "stop"))
+        return chunks
+
+
+def make_server(backend: MockBackend, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """OpenAI互換の /v1/chat/completions を返すHTTPサーバーを作る（port=0なら空いているポート）."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            backend.delay()
+            if backend.fail():
+                body = json.dumps({"error": {"message": "mock error", "type": "server_error"}}).encode("utf-8")
+                self.send_response(500)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            if not request.get("stream"):
+                body = json.dumps(backend.completion(request), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, chunk in enumerate(backend.chunks(request)):
+                if i and backend.token_delay:
+                    time.sleep(backend.token_delay)
+                data = json.dumps(chunk, ensure_ascii=False)
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(backend: MockBackend, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """モック・サーバーを別スレッドで起動する.
+
+    Returns:
+        起動したサーバー（server.server_address でポートがわかる）.
+    """
+    server = make_server(backend, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main():
+    """モック・サーバーを起動するコマンドのメイン・エントリー・ポイント."""
+    parser = argparse.ArgumentParser(description="OpenAI互換のモック・サーバーを起動する")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--script", help="シナリオのJSONファイル（省略時は既定のシナリオ）")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答までの秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に加える乱数の幅の秒数")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="ストリーミングのチャンクの間隔の秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返すリクエストの割合")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="応答が遅くなるリクエストの割合")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="遅いリクエストに足す秒数")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+    backend = MockBackend(
+        script,
+        args.latency,
+        args.jitter,
+        args.token_delay,
+        args.error_rate,
+        args.tail_rate,
+        args.tail_latency,
+    )
+    server = make_server(backend, port=args.port)
+    print(f"OPENAI_BASE_URL=http://127.0.0.1:{server.server_address[1]}/v1 で接続できます")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
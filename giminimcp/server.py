@@ -1,6 +1,20 @@
 import os
 import json
+import sys
 from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
+
+from mcpcommon.kbpage import count_tokens_batch, paginate
+from mcpcommon.kbsearch import BM25Index
+from mcpcommon.kbstore import (
+    KB_HEADER,
+    EntryBlocks,
+    KnowledgeBaseStore,
+    entry_token_counts,
+    format_entry,
+)
+from mcpcommon.kbvector import HashingEmbedder, OpenAIEmbedder, VectorIndex
+from mcpcommon.tracing import Tracer, instrument_server
 
 # Create an MCP server
 mcp = FastMCP(
@@ -9,36 +23,61 @@ mcp = FastMCP(
     port=8050,  # only used for SSE transport (set this to any port)
 )
 
-@mcp.tool()
-def get_knowledge_base() -> str:
+# ツールの実行時間を記録し、リクエストの _meta の traceparent でクライアントのトレースにつなげる
+instrument_server(mcp, Tracer("kb-server", jsonl_path=os.getenv("MCP_TRACE_FILE")))
+
+# ナレッジ・ベースは一度だけ読み込み、ファイルが変更された時だけ読み直す
+# （KB_FILE=kb.kbin の場合は kbbinary.py で作ったバイナリ形式をmmapで開く）
+kb_store = KnowledgeBaseStore(
+    os.path.join(os.path.dirname(__file__), "data", os.getenv("KB_FILE", "kb.json"))
+)
+
+
+def _build_vector_index(entries):
+    """LanceDBのベクトル・インデックスを開き、追加・変更されたエントリだけを埋め込む."""
+    if os.getenv("KB_EMBEDDER") == "openai":
+        embedder = OpenAIEmbedder()
+    else:
+        embedder = HashingEmbedder()
+    index = VectorIndex(os.path.join(os.path.dirname(__file__), "data", "lancedb"), embedder)
+    index.sync(entries)
+    return index
+
+
+def _build_pages(entries):
+    """各Q&Aペアのトークン数だけを数える（ブロックの文字列はページを返す時に作る）."""
+    return EntryBlocks(entries), entry_token_counts(entries)
+
+
+def _render_page(header, blocks, max_tokens, cursor, block_tokens=None):
+    """ブロックをトークン予算に収まるページにまとめる（max_tokensが0なら残り全部）."""
+    if max_tokens <= 0 and not cursor:
+        return header + "".join(blocks)
+
+    if block_tokens is None:
+        block_tokens = count_tokens_batch(blocks)
+    budget = max_tokens if max_tokens > 0 else sys.maxsize
+    text, _ = paginate(header, blocks, block_tokens, budget, cursor, kb_store.version)
+    return text
+
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+def get_knowledge_base(max_tokens: int = 0, cursor: str = "") -> str:
     """Retrieve the entire knowledge base as a formatted string.
 
+    Args:
+        max_tokens: The token budget for the returned string (0 means unlimited).
+        cursor: The next_cursor value at the end of a previous result, to get the next page.
+
     Returns:
         A formatted string containing all Q&A pairs from the knowledge base.
     """
     try:
-        kb_path = os.path.join(os.path.dirname(__file__), "data", "kb.json")
-        with open(kb_path, "r") as f:
-            kb_data = json.load(f)
-
-        # Format the knowledge base as a string
-        kb_text = "Here is the retrieved knowledge base:\n\n"
-
-        if isinstance(kb_data, list):
-            for i, item in enumerate(kb_data, 1):
-                if isinstance(item, dict):
-                    question = item.get("question", "Unknown question")
-                    answer = item.get("answer", "Unknown answer")
-                else:
-                    question = f"Item {i}"
-                    answer = str(item)
-
-                kb_text += f"Q{i}: {question}\n"
-                kb_text += f"A{i}: {answer}\n\n"
-        else:
-            kb_text += f"Knowledge base content: {json.dumps(kb_data, indent=2)}\n\n"
-
-        return kb_text
+        if max_tokens <= 0 and not cursor:
+            return kb_store.text()
+
+        blocks, block_tokens = kb_store.derived("pages", _build_pages)
+        return _render_page(KB_HEADER, blocks, max_tokens, cursor, block_tokens)
     except FileNotFoundError:
         return "Error: 知識ベースファイルが見つかりません"
     except json.JSONDecodeError:
@@ -47,6 +86,77 @@ def get_knowledge_base() -> str:
         return f"Error: {str(e)}"
 
 
+# どの質問にも使うため、クライアントがツールを絞り込む時にも常に送らせる
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True, pinned=True))
+def search_knowledge_base(query: str, k: int = 3, max_tokens: int = 0, cursor: str = "") -> str:
+    """Search the knowledge base for the Q&A pairs most relevant to a query (BM25).
+
+    Args:
+        query: The question or keywords to search for.
+        k: The maximum number of Q&A pairs to return.
+        max_tokens: The token budget for the returned string (0 means unlimited).
+        cursor: The next_cursor value at the end of a previous result, to get the next page.
+
+    Returns:
+        A formatted string containing the matching Q&A pairs, best match first.
+    """
+    try:
+        index = kb_store.derived("bm25", BM25Index)
+        hits = index.search(query, k)
+        if not hits:
+            return "該当するQ&Aペアが見つかりません"
+
+        blocks = [format_entry(doc_id + 1, index.entries[doc_id]) for doc_id, _ in hits]
+        return _render_page(
+            "Here are the most relevant knowledge base entries:\n\n", blocks, max_tokens, cursor
+        )
+    except FileNotFoundError:
+        return "Error: 知識ベースファイルが見つかりません"
+    except json.JSONDecodeError:
+        return "Error: ナレッジ・ベース・ファイルのJSONが無効"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+def semantic_search(query: str, k: int = 3, max_tokens: int = 0, cursor: str = "") -> str:
+    """Search the knowledge base for Q&A pairs semantically similar to a query.
+
+    Args:
+        query: The question to search for.
+        k: The maximum number of Q&A pairs to return.
+        max_tokens: The token budget for the returned string (0 means unlimited).
+        cursor: The next_cursor value at the end of a previous result, to get the next page.
+
+    Returns:
+        A formatted string containing the matching Q&A pairs, most similar first.
+    """
+    try:
+        index = kb_store.derived("vector", _build_vector_index)
+        rows = index.search(query, k)
+        if not rows:
+            return "該当するQ&Aペアが見つかりません"
+
+        blocks = [format_entry(i, row) for i, row in enumerate(rows, 1)]
+        return _render_page(
+            "Here are the most similar knowledge base entries:\n\n", blocks, max_tokens, cursor
+        )
+    except ImportError:
+        return "Error: lancedb がインストールされていません"
+    except FileNotFoundError:
+        return "Error: 知識ベースファイルが見つかりません"
+    except json.JSONDecodeError:
+        return "Error: ナレッジ・ベース・ファイルのJSONが無効"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+@mcp.resource("kb://stats")
+def get_kb_stats() -> str:
+    """ナレッジ・ベース・キャッシュのヒット/ミス/再読込の回数をJSONで返す."""
+    return json.dumps(kb_store.stats())
+
+
 # Run the server
 if __name__ == "__main__":
     mcp.run(transport="stdio")
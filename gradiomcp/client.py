@@ -1,38 +1,57 @@
-import asyncio
+import os
 import gradio as gr
-import nest_asyncio
+from connection import MCPConnectionManager
+from mcpcommon.memory import ConversationMemory
 from mcpclient import MCPOpenAIClient
 
-# nest_asyncioを適用してネストされたイベントループを許可する（Jupyter/IPythonで必要）
-nest_asyncio.apply()
-
-client = MCPOpenAIClient()
-
-async def chat(user_input, history):
-        
-    reply = await client.process_query(user_input)
-
-    history.append({"role": "assistant", "content": reply})
-
-    # 履歴を Markdown 形式で整形
-    chat_log = ""
-    for msg in history:
-        if msg["role"] == "user":
-            chat_log += f"**🧑 ユーザー:** {msg['content']}\n\n"
-        elif msg["role"] == "assistant":
-            chat_log += f"**🤖 アシスタント:** {msg['content']}\n\n"
-
-
-    return "", reply, history, chat_log
-
-
-async def respond(user_input, history):
-    _, bot_msg, updated_history, chat_log = await chat(user_input, history)
-    return "", bot_msg, updated_history, chat_log
-
-async def main():
-    await client.connect_to_server("server.py") #ok
-
+# Gradioのセッションで共有する、MCPサーバーへの長寿命の接続（最初の質問の時に作る）
+# 複数のユーザーのツール呼び出しを並行に処理できるよう、サーバー・プロセスをプールする
+connection = MCPConnectionManager(
+    lambda: MCPOpenAIClient(
+        faq_kb_path=os.path.join(os.path.dirname(__file__), "data", "kb.json")
+    ),
+    servers=["server.py"],
+    pool_size=2,
+    max_pool_size=os.cpu_count(),
+)
+
+def format_message(msg):
+    """1つのメッセージを Markdown 形式で整形する."""
+    if msg["role"] == "user":
+        return f"**🧑 ユーザー:** {msg['content']}\n\n"
+    elif msg["role"] == "assistant":
+        return f"**🤖 アシスタント:** {msg['content']}\n\n"
+    return ""
+
+
+def format_history(history):
+    """履歴を Markdown 形式で整形する."""
+    return "".join(format_message(msg) for msg in history)
+
+
+async def respond(user_input, history, memory, chat_log):
+    # セッションごとの会話の記憶（直近の会話と、それより前の会話の要約）を最初の入力で作る
+    if memory is None:
+        memory = ConversationMemory()
+
+    # 履歴の表示は毎回作り直さず、この往復の分だけを書き足す
+    user_msg = {"role": "user", "content": user_input}
+    history.append(user_msg)
+    chat_log = (chat_log or "") + format_message(user_msg)
+
+    # 回答のトークンが届くたびに途中までの応答を表示する
+    reply = ""
+    async for delta in connection.astream(
+        lambda client: client.process_query_stream(user_input, memory)
+    ):
+        reply += delta
+        yield "", reply, history, memory, chat_log
+
+    assistant_msg = {"role": "assistant", "content": reply}
+    history.append(assistant_msg)
+    yield "", reply, history, memory, chat_log + format_message(assistant_msg)
+
+def main():
     #gradio
     with gr.Blocks() as demo:
         gr.Markdown("## 💬 私のOpenAI チャット")
@@ -45,15 +64,20 @@ async def main():
 
         chat_history_display = gr.Markdown()
         state = gr.State([])
+        memory_state = gr.State(None)
 
-        user_text.submit(respond, [user_text, state], [user_text, bot_response, state,chat_history_display])
+        user_text.submit(
+            respond,
+            [user_text, state, memory_state, chat_history_display],
+            [user_text, bot_response, state, memory_state, chat_history_display],
+        )
 
         demo.launch(share=True)
 
-    await client.cleanup()
+    connection.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
 
 
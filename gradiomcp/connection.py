@@ -0,0 +1,223 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from mcp.shared.exceptions import McpError
+
+from mcpclient import MCPOpenAIClient
+
+# 接続が切れた（作り直せば直る見込みがある）ことを表す例外
+_CONNECTION_ERRORS = (McpError, OSError, RuntimeError)
+
+
+class MCPConnectionManager:
+    """MCPOpenAIClient の長寿命の接続を1つだけ持ち、Gradioの各エントリー・ポイントで共有する.
+
+    Gradioは呼び出しごとに別のスレッドやイベント・ループで関数を実行するため、
+    接続は専用のスレッドで動かし続けるイベント・ループの上に置き、各呼び出しをそこへ渡す.
+    接続は最初に使われた時に作り、切れていたら指数バックオフで再接続する.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], MCPOpenAIClient] = MCPOpenAIClient,
+        servers: Optional[List[str]] = None,
+        pool_size: int = 1,
+        max_pool_size: Optional[int] = None,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_attempts: int = 5,
+    ):
+        """マネージャーを初期化する（この時点では接続しない）.
+
+        Args:
+            client_factory: クライアントを作る関数.
+            servers: 接続するサーバースクリプトのパスまたはSSEのURLのリスト.
+            pool_size: サーバーごとに常に起動しておくプロセスの数.
+            max_pool_size: サーバーごとのプロセス数の上限.
+            backoff: 再接続の最初の待ち時間の秒数（失敗するたびに倍にする）.
+            max_backoff: 再接続の待ち時間の上限の秒数.
+            max_attempts: 1回の接続で試みる最大回数.
+        """
+        self.client_factory = client_factory
+        self.servers = servers or ["server.py"]
+        self.pool_size = pool_size
+        self.max_pool_size = max_pool_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        self.client: Optional[MCPOpenAIClient] = None
+        self.state = "disconnected"
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._connected_since: Optional[float] = None
+        self._stats = {"connects": 0, "reconnects": 0, "failed_attempts": 0, "last_error": None}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="mcp-connection", daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _alive(self) -> bool:
+        return self.client is not None and all(
+            pool.alive for pool in self.client.sessions.values()
+        )
+
+    async def _connect(self) -> MCPOpenAIClient:
+        """接続が無いか切れていれば、バックオフしながら接続し直す（マネージャーのループで動く）."""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._alive():
+                return self.client
+
+            reconnecting = self.client is not None
+            if reconnecting:
+                await self._disconnect()
+            self.state = "reconnecting" if reconnecting else "connecting"
+
+            delay = self.backoff
+            for attempt in range(1, self.max_attempts + 1):
+                client = None
+                try:
+                    client = self.client_factory()
+                    await client.connect_to_servers(
+                        self.servers, self.pool_size, self.max_pool_size
+                    )
+                except Exception as e:
+                    self._stats["failed_attempts"] += 1
+                    self._stats["last_error"] = f"{type(e).__name__}: {e}"
+                    if client is not None:
+                        await client.cleanup()
+                    if attempt == self.max_attempts:
+                        self.state = "failed"
+                        raise
+                    # 複数のプロセスが同時に再接続しないよう、待ち時間をばらつかせる
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                    delay = min(delay * 2, self.max_backoff)
+                    continue
+
+                self.client = client
+                self.state = "connected"
+                self._connected_since = time.monotonic()
+                self._stats["connects"] += 1
+                if reconnecting:
+                    self._stats["reconnects"] += 1
+                return client
+
+    async def _disconnect(self) -> None:
+        client, self.client = self.client, None
+        self._connected_since = None
+        self.state = "disconnected"
+        if client is not None:
+            try:
+                await client.cleanup()
+            except Exception:
+                pass
+
+    async def _run(self, fn: Callable[[MCPOpenAIClient], Awaitable[Any]]) -> Any:
+        client = await self._connect()
+        try:
+            return await fn(client)
+        except _CONNECTION_ERRORS:
+            if self._alive():
+                raise
+            # 接続が切れていたので、つなぎ直して一度だけやり直す
+            client = await self._connect()
+            return await fn(client)
+
+    def call(self, fn: Callable[[MCPOpenAIClient], Awaitable[Any]]) -> Any:
+        """同期関数から、接続済みのクライアントを使うコルーチンを実行する.
+
+        Args:
+            fn: クライアントを受け取ってコルーチンを返す関数.
+
+        Returns:
+            コルーチンの結果.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._run(fn), self._ensure_loop())
+        return future.result()
+
+    async def acall(self, fn: Callable[[MCPOpenAIClient], Awaitable[Any]]) -> Any:
+        """call の非同期版. 呼び出し元のイベント・ループをブロックしない."""
+        future = asyncio.run_coroutine_threadsafe(self._run(fn), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    async def astream(
+        self, fn: Callable[[MCPOpenAIClient], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        """接続済みのクライアントを使う非同期イテレータを、呼び出し元のループで読む.
+
+        Args:
+            fn: クライアントを受け取って非同期イテレータを返す関数.
+
+        Yields:
+            イテレータの各要素.
+        """
+        caller_loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def pump() -> None:
+            started = False
+            try:
+                client = await self._connect()
+                try:
+                    async for item in fn(client):
+                        started = True
+                        caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+                except _CONNECTION_ERRORS:
+                    # 何も返していなければ、_run と同じくつなぎ直して一度だけやり直す
+                    if started or self._alive():
+                        raise
+                    client = await self._connect()
+                    async for item in fn(client):
+                        caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+            except BaseException as e:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, e)
+            else:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """接続の状態と再接続の回数などを返す.
+
+        Returns:
+            状態（disconnected、connecting、connected、reconnecting、failed）、
+            接続・再接続・失敗の回数、最後のエラー、接続してからの秒数.
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["state"] = self.state
+        stats["uptime"] = (
+            time.monotonic() - self._connected_since if self._connected_since else 0.0
+        )
+        return stats
+
+    def close(self) -> None:
+        """接続を閉じ、イベント・ループのスレッドを止める."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._disconnect(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
@@ -1,10 +1,11 @@
-import asyncio
 import gradio as gr
 from dotenv import load_dotenv
+from connection import MCPConnectionManager
 from mcpclient import MCPOpenAIClient
 load_dotenv("../.env")
 
-client = MCPOpenAIClient()
+# Gradioのエントリー・ポイントで共有する、MCPサーバーへの長寿命の接続
+connection = MCPConnectionManager(MCPOpenAIClient, servers=["server.py"])
 
 
 """
@@ -51,25 +52,12 @@ with gr.Blocks() as demo:
     demo.launch(share=True)
 """
 
-async def ask_mcp_async(prompt):  
-    ## Connect to the MCP server
-    await client.connect_to_server("server.py")
-    print("Connected to MCP server.")
-      
-    return await client.process_query(prompt)
+async def ask_mcp_async(prompt):
+    # 接続は最初の質問の時に一度だけ作り、以降は使い回す（切れていれば再接続する）
+    return await connection.acall(lambda client: client.process_query(prompt))
 
 def ask_mcp_sync(prompt):
-    try:
-        loop = asyncio.get_event_loop()
-        print(f"##############################Current event loop: {loop}")
-        if loop.is_running():
-            # Create a new task and wait for it
-            future = asyncio.ensure_future(ask_mcp_async(prompt))
-            return asyncio.get_event_loop().run_until_complete(future)
-        else:
-            return loop.run_until_complete(ask_mcp_async(prompt))
-    except RuntimeError:
-        return asyncio.run(ask_mcp_async(prompt))
+    return connection.call(lambda client: client.process_query(prompt))
 
 
 print("Starting Gradio UI...")
@@ -79,4 +67,6 @@ gr.Interface(
     outputs="text",
     title="MCP Chatbot UI",
     description="Talk with an MCP-connected model via Gradio",
-).launch()
\ No newline at end of file
+).launch()
+
+connection.close()
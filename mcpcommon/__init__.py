@@ -0,0 +1,7 @@
+"""openaimcp・giminimcp・gradiomcp・simplemcp のクライアントとサーバーが共有するモジュール.
+
+ナレッジ・ベースの読み込みと検索（kbstore, kbstream, kbbinary, kbsearch, kbvector, kbpage, faq）、
+MCPセッションとツール（sessionpool, puretool, toolindex, speculate）、LLM呼び出しの制御
+（ratelimit, deadline, llmrouter, llmcache, memory）、トレース（tracing）と、それらを使う
+MCPクライアント（client）をまとめる.
+"""
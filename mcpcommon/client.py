@@ -0,0 +1,904 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import AsyncExitStack, aclosing
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+from mcp import StdioServerParameters, types
+from mcp.shared.exceptions import McpError
+from openai.types.chat import ChatCompletionMessageToolCall
+
+from .deadline import Deadline, DeadlineExceeded, Hedger, backoff_delay
+from .faq import FaqMatcher
+from .llmcache import CompletionCache
+from .llmrouter import LLMRouter, OpenAIProvider
+from .memory import ConversationMemory
+from .puretool import ToolResultCache
+from .ratelimit import RateLimiter, estimate_tokens, retry_after_seconds
+from .sessionpool import MCPSessionPool, resolve_server
+from .speculate import Prefetch, ToolPredictor
+from .toolindex import ToolIndex
+from .tracing import Span, Tracer
+
+# クエリの持ち時間のうち、各フェーズに割り当てる割合（そのフェーズを始める時の残りに対する比）.
+# 最初の応答はツールを呼ばずにそのまま回答になることがあるので、残りをすべて使える.
+# ツールの呼び出しと最終応答は、最初の応答の後に残った時間を分け合う
+PHASE_SHARES = {"completion.first": 1.0, "call_tools": 0.5, "completion.final": 1.0}
+
+
+class MCPOpenAIClient:
+    """MCPツールを使ってLLMと対話するためのクライアント.
+
+    会話はOpenAIのChat Completionsの形式で持ち、リクエストは router のプロバイダー
+    （OpenAI、Geminiなど）のうち、健全で最も速いものに送る.
+    """
+
+    def __init__(
+        self,
+        model: str = "gpt-4.1-nano",
+        faq_kb_path: Optional[str] = None,
+        tool_concurrency: int = 4,
+        tool_timeout: Optional[float] = 30.0,
+        completion_cache: Optional[CompletionCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        tracer: Optional[Tracer] = None,
+        deadline: Optional[float] = None,
+        max_retries: int = 2,
+        hedger: Optional[Hedger] = None,
+        max_tools: Optional[int] = 8,
+        pinned_tools: Iterable[str] = (),
+        predictor: Optional[ToolPredictor] = None,
+        router: Optional[LLMRouter] = None,
+        label_answers: bool = False,
+    ):
+        """MCPクライアントを初期化する.
+
+        Args:
+            model: 使用するOpenAIモデル（router を指定した場合は、各プロバイダーのモデルを使う）.
+            faq_kb_path: FAQ高速パスに使う kb.json へのパス（Noneの場合は使わない）.
+            tool_concurrency: 1つの応答内のツール呼び出しを同時に実行する最大数.
+            tool_timeout: ツール呼び出し1回あたりのタイムアウト秒数（Noneは無制限）.
+            completion_cache: LLMの応答を保存するキャッシュ（Noneの場合は使わない）.
+            rate_limiter: RPMとTPMの上限を守るスケジューラ（Noneの場合は制限しない）.
+            tracer: フェーズごとの処理時間を記録するトレーサー（Noneの場合は環境変数
+                MCP_TRACE_FILE と MCP_METRICS_PORT の出力先で作る）.
+            deadline: 1つのクエリの持ち時間の秒数（Noneは無制限）. 各フェーズに
+                PHASE_SHARES の割合で割り当てる.
+            max_retries: 429・5xx・接続の失敗をやり直す最大回数（rate_limiter があれば
+                そちらの max_retries）.
+            hedger: 応答が遅いリクエストの複製を送るヘッジ（Noneの場合は送らない）.
+            max_tools: クエリごとに送る、関連するツールの数（固定のツールは別. Noneはすべて）.
+            pinned_tools: クエリに関係なく常に送るツール名.
+            predictor: KBの質問らしいクエリで、モデルが呼びそうなツールを最初の応答と
+                並行に先に実行する予測器（Noneの場合は先に実行しない）.
+            router: リクエストを送るプロバイダー（OpenAI、Geminiなど）を選ぶルーター
+                （Noneの場合は model のOpenAIだけを使う）.
+            label_answers: 回答の先頭に、FAQの回答なら "(FAQ) "、ツールを使った回答なら
+                "(MCP) " を付けるかどうか.
+        """
+        # セッションとクライアントのオブジェクトを初期化する
+        # ラベル → サーバーごとのセッション・プール（接続した順）
+        self.sessions: Dict[str, MCPSessionPool] = {}
+        # OpenAIに見せるツール名 → (担当するセッション・プール, サーバー上のツール名)
+        self._routes: Dict[str, Tuple[MCPSessionPool, str]] = {}
+        self.exit_stack = AsyncExitStack()
+        self.model = model
+        self.router = router or LLMRouter([OpenAIProvider(model)])
+        self.label_answers = label_answers
+        self.faq = FaqMatcher(faq_kb_path) if faq_kb_path else None
+        # OpenAI形式に変換済みのツール一覧（list_changed通知か再接続で無効にする）
+        self._tools_cache: Optional[List[Dict[str, Any]]] = None
+        self.tool_concurrency = tool_concurrency
+        self.tool_timeout = tool_timeout
+        self.completion_cache = completion_cache
+        self.rate_limiter = rate_limiter
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.hedger = hedger
+        self.max_tools = max_tools
+        # ツールの名前と説明の索引（クエリごとに関連するツールだけを送る）
+        self.tool_index = ToolIndex(pinned_tools)
+        self.predictor = predictor
+        # 副作用が無い（readOnlyHint の）ツール名. 先に実行してよいのはこれらだけ
+        self._read_only: set = set()
+        self.tracer = tracer or Tracer(
+            "client",
+            jsonl_path=os.getenv("MCP_TRACE_FILE"),
+            metrics_port=int(os.getenv("MCP_METRICS_PORT", "0")) or None,
+        )
+        # サーバーが pure と宣言したツールの結果（同じ引数ならサーバーを呼ばない）
+        self.tool_results = ToolResultCache()
+
+    async def connect_to_server(
+        self,
+        server_script_path: str = "server.py",
+        pool_size: int = 1,
+        max_pool_size: Optional[int] = None,
+    ):
+        """MCPサーバーに接続する.
+
+        Args:
+            server_script_path: サーバースクリプトへのパス.
+            pool_size: 常に起動しておくサーバー・プロセスの数.
+            max_pool_size: 負荷に応じて増やすサーバー・プロセスの上限（Noneの場合は pool_size で固定）.
+        """
+        await self.connect_to_servers([server_script_path], pool_size, max_pool_size)
+
+    async def connect_to_servers(
+        self,
+        servers: List[Union[str, StdioServerParameters]],
+        pool_size: int = 1,
+        max_pool_size: Optional[int] = None,
+    ):
+        """複数のMCPサーバーに並行に接続し、それらのツールをまとめて使えるようにする.
+
+        同じ名前のツールが複数のサーバーにある場合は、リストで先に指定したサーバーの
+        ツールがその名前を使い、後のサーバーのツールは "<ラベル>__<ツール名>" という
+        名前で公開する（ラベルはサーバースクリプトのディレクトリ名など）.
+
+        Args:
+            servers: サーバースクリプトのパス、SSEサーバーのURL、またはStdioServerParametersのリスト.
+            pool_size: サーバーごとに常に起動しておくプロセスの数.
+            max_pool_size: サーバーごとに負荷に応じて増やすプロセスの上限（Noneの場合は pool_size で固定）.
+        """
+        sessions: Dict[str, MCPSessionPool] = {}
+        for spec in servers:
+            label, server = resolve_server(spec)
+            if label in sessions:
+                label = f"{label}{len(sessions) + 1}"
+            # ツール呼び出しごとにセッションを貸し出すプールを作る
+            pool = MCPSessionPool(
+                server,
+                min_size=pool_size,
+                max_size=max_pool_size,
+                message_handler=self._handle_message,
+            )
+            self.exit_stack.push_async_callback(pool.close)
+            sessions[label] = pool
+
+        # すべてのサーバーに並行に接続する
+        await asyncio.gather(*(pool.start() for pool in sessions.values()))
+        self.sessions = sessions
+        self._tools_cache = None
+        self.tool_results.clear()
+
+        # 使用可能なツールのリスト
+        tools = await self.get_mcp_tools()
+        print("\nConnected to server with tools:")
+        for tool in tools:
+            print(f"  - {tool['function']['name']}: {tool['function']['description']}")
+
+    async def _handle_message(self, message: Any) -> None:
+        """サーバーからのメッセージを処理する.
+
+        Args:
+            message: サーバーからのリクエスト、通知、または例外.
+        """
+        if isinstance(message, types.ServerNotification) and isinstance(
+            message.root, types.ToolListChangedNotification
+        ):
+            # ツール一覧が変わったので、次の get_mcp_tools で取り直す
+            self._tools_cache = None
+
+    async def get_mcp_tools(self) -> List[Dict[str, Any]]:
+        """MCPサーバーから利用可能なツールをOpenAIフォーマットで取得する.
+
+        一度取得した一覧はキャッシュし、サーバーからツール一覧の変更通知が来るか
+        再接続するまで使い回す.
+
+        接続したすべてのサーバーのツールを1つのリストにまとめ、ツール名から
+        担当するサーバーへのルーティング表を作り直す.
+
+        Returns:
+            OpenAI形式のツールリスト.
+        """
+        if self._tools_cache is None:
+            results = await asyncio.gather(
+                *(pool.list_tools() for pool in self.sessions.values())
+            )
+            tools = []
+            routes: Dict[str, Tuple[MCPSessionPool, str]] = {}
+            for (label, pool), tools_result in zip(self.sessions.items(), results):
+                for tool in tools_result.tools:
+                    name = tool.name
+                    if name in routes:
+                        # 先に指定したサーバーが元の名前を使う
+                        name = f"{label}__{tool.name}"
+                    routes[name] = (pool, tool.name)
+                    tools.append(tool.model_copy(update={"name": name}))
+            self._routes = routes
+            self.tool_results.update_policies(tools)
+            self._read_only = {
+                tool.name for tool in tools if tool.annotations and tool.annotations.readOnlyHint
+            }
+            self._tools_cache = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": tool.name,
+                        "description": tool.description,
+                        "parameters": tool.inputSchema,
+                    },
+                }
+                for tool in tools
+            ]
+            self.tool_index.update(
+                self._tools_cache,
+                pinned=[
+                    tool.name
+                    for tool in tools
+                    if tool.annotations and (tool.annotations.model_extra or {}).get("pinned")
+                ],
+            )
+        return self._tools_cache
+
+    async def select_tools(self, query: str) -> List[Dict[str, Any]]:
+        """クエリに関連する max_tools 個のツールと、固定のツールをOpenAI形式で返す.
+
+        Args:
+            query: ユーザークエリ.
+
+        Returns:
+            OpenAI形式のツールリスト（ツールが少なければすべて）.
+        """
+        await self.get_mcp_tools()
+        return self.tool_index.select(query, self.max_tools)
+
+    async def _call_tool(
+        self, tool_call: Any, semaphore: asyncio.Semaphore, deadline: Optional[Deadline] = None
+    ) -> str:
+        """1つのツール呼び出しを実行し、結果のテキストを返す.
+
+        Args:
+            tool_call: アシスタントの応答に含まれるツール呼び出し.
+            semaphore: 同時実行数を制限するセマフォ.
+            deadline: ツール呼び出しの期限（tool_timeout より早ければこちらで打ち切る）.
+
+        Returns:
+            ツールの結果. タイムアウトやエラーの場合はエラーメッセージ.
+        """
+        name = tool_call.function.name
+        if name not in self._routes:
+            return f"Error: ツール {name} はどのサーバーにもありません"
+        self.tool_index.record_use(name)
+        arguments = json.loads(tool_call.function.arguments)
+        with self.tracer.span("call_tool", tool=name) as span:
+            cached = self.tool_results.get(name, arguments)
+            if cached is not None:
+                span.attributes["cached"] = True
+                return cached
+
+            # サーバー側のスパンをこのスパンの子にする
+            text, ok = await self._execute_tool(
+                name, arguments, semaphore, deadline, {"traceparent": span.traceparent()}
+            )
+            if ok:
+                self.tool_results.put(name, arguments, text)
+            else:
+                span.status = "error"
+            return text
+
+    async def _execute_tool(
+        self,
+        name: str,
+        arguments: Dict[str, Any],
+        semaphore: asyncio.Semaphore,
+        deadline: Optional[Deadline] = None,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[str, bool]:
+        """ツールをサーバーで実行する. 呼び出した回数、スパン、結果のキャッシュは記録しない.
+
+        Args:
+            name: OpenAIに見せているツール名.
+            arguments: ツールの引数.
+            semaphore: 同時実行数を制限するセマフォ.
+            deadline: ツール呼び出しの期限（tool_timeout より早ければこちらで打ち切る）.
+            meta: リクエストの _meta に載せる値.
+
+        Returns:
+            (ツールの結果かエラーメッセージ, 成功したかどうか).
+        """
+        pool, tool_name = self._routes[name]
+        timeout = self.tool_timeout or None
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        timeout = timedelta(seconds=timeout) if timeout is not None else None
+        async with semaphore:
+            try:
+                result = await pool.call_tool(
+                    tool_name, arguments=arguments, read_timeout_seconds=timeout, meta=meta
+                )
+            except McpError as e:
+                return f"Error: ツール {name} の呼び出しに失敗しました: {e.error.message}", False
+        return result.content[0].text, not result.isError
+
+    async def _use_prefetch(self, prefetch: Prefetch) -> str:
+        """モデルの呼び出しと一致した先読みの結果を使い、ここで初めて呼び出しを記録する."""
+        name, arguments = prefetch.prediction
+        self.tool_index.record_use(name)
+        with self.tracer.span("call_tool", tool=name) as span:
+            span.attributes["prefetched"] = True
+            text, ok = await prefetch.task
+            if ok:
+                self.tool_results.put(name, arguments, text)
+            else:
+                span.status = "error"
+            return text
+
+    async def call_tools(
+        self,
+        tool_calls: List[Any],
+        deadline: Optional[Deadline] = None,
+        prefetch: Optional[Prefetch] = None,
+    ) -> List[Dict[str, Any]]:
+        """アシスタントの1つの応答に含まれるツール呼び出しを並行に実行する.
+
+        Args:
+            tool_calls: アシスタントの応答に含まれるツール呼び出しのリスト.
+            deadline: ツール呼び出しの期限（Noneは tool_timeout だけ）.
+            prefetch: 先に実行したツール呼び出し（同じ呼び出しにはその結果を使う）.
+
+        Returns:
+            元のツール呼び出しと同じ順序の、会話に追加するツール・メッセージのリスト.
+            失敗した呼び出し（引数のJSONが無効、セッションが閉じているなど）の内容は
+            エラーメッセージになる.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.tool_concurrency))
+
+        async def run(tool_call: Any) -> str:
+            name = tool_call.function.name
+            # 1つのツールの失敗は、そのツールの結果としてモデルに返し、他のツールと回答は続ける
+            try:
+                if prefetch is not None and prefetch.claim(
+                    name, json.loads(tool_call.function.arguments)
+                ):
+                    return await self._use_prefetch(prefetch)
+                return await self._call_tool(tool_call, semaphore, deadline)
+            except json.JSONDecodeError as e:
+                return f"Error: ツール {name} の引数のJSONが無効です: {e}"
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"ツール {name} の呼び出しに失敗しました: {e!r}", file=sys.stderr)
+                return f"Error: ツール {name} の呼び出しに失敗しました: {e}"
+
+        try:
+            results = await asyncio.gather(*(run(tool_call) for tool_call in tool_calls))
+        finally:
+            # どの呼び出しにも使われなかった先読みは止める
+            if prefetch is not None:
+                await prefetch.discard()
+        return [
+            {"role": "tool", "tool_call_id": tool_call.id, "content": content}
+            for tool_call, content in zip(tool_calls, results)
+        ]
+
+    def _start_prefetch(
+        self, query: str, tools: List[Dict[str, Any]], deadline: Optional[Deadline] = None
+    ) -> Optional[Prefetch]:
+        """predictor が予測したツール呼び出しを、バックグラウンドで先に実行する.
+
+        予測が外れた場合に備えて、ツールの使用回数やスパンはモデルの呼び出しと
+        一致した時（_use_prefetch）まで記録しない.
+
+        Args:
+            query: ユーザークエリ.
+            tools: 今回のリクエストに含めるツール.
+            deadline: クエリの期限.
+
+        Returns:
+            先に実行したツール呼び出し. 予測が無ければNone.
+        """
+        if self.predictor is None:
+            return None
+        allowed = {tool["function"]["name"] for tool in tools} & self._read_only
+        prediction = self.predictor.predict(query, allowed)
+        if prediction is None:
+            return None
+        name, arguments = prediction
+        task = asyncio.create_task(
+            self._execute_tool(name, arguments, asyncio.Semaphore(1), deadline)
+        )
+        return Prefetch(prediction, task)
+
+    async def _settle_prefetch(
+        self, query: str, prefetch: Optional[Prefetch], tool_calls: Optional[List[Any]]
+    ) -> None:
+        """モデルが実際に呼んだツールを predictor に記録し、外れた先読みの結果を捨てる."""
+        if self.predictor is None:
+            return
+        calls = []
+        for tool_call in tool_calls or []:
+            try:
+                calls.append((tool_call.function.name, json.loads(tool_call.function.arguments)))
+            except ValueError:
+                continue
+        hit = self.predictor.record(query, prefetch.prediction if prefetch else None, calls)
+        if prefetch is not None and not hit:
+            await prefetch.discard()
+
+    async def _create_completion(self, deadline: Optional[Deadline] = None, **request: Any) -> Any:
+        """キャッシュを通してChat Completions APIを呼ぶ.
+
+        Args:
+            deadline: 応答の期限（Noneは無制限）.
+            request: chat.completions.create に渡す引数.
+
+        Returns:
+            LLMからの応答（キャッシュにあればその応答）.
+        """
+        if self.completion_cache is None:
+            return await self._request_completion(request, deadline)
+
+        key = self.completion_cache.make_key(request)
+        cached = self.completion_cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        response = await self._request_completion(request, deadline)
+        self.completion_cache.put(key, response, time.perf_counter() - start)
+        return response
+
+    async def _request_completion(
+        self, request: Dict[str, Any], deadline: Optional[Deadline] = None, stream: bool = False
+    ) -> Any:
+        """rate_limiter の枠を取ってから router に送り、一時的なエラーはやり直す.
+
+        Args:
+            request: chat.completions.create に渡す引数.
+            deadline: 応答の期限（Noneは無制限）. 期限までにやり直せない場合は諦める.
+            stream: ストリーミングで送るかどうか（最初の断片が届くまでをやり直しと期限の対象にする）.
+
+        Returns:
+            LLMからの応答（stream の場合は、最初の断片から読める断片のイテレータ）.
+
+        Raises:
+            DeadlineExceeded: 期限までに応答が得られなかった場合.
+        """
+        deadline = deadline or Deadline()
+        limiter = self.rate_limiter
+        max_retries = limiter.max_retries if limiter is not None else self.max_retries
+        estimated = estimate_tokens(request, limiter.completion_tokens) if limiter is not None else 0
+        # すべてのプロバイダーが一時的なエラーで失敗したら、ジッターつきのバックオフ
+        # （429はスケジューラ）でやり直す
+        for attempt in range(max_retries + 1):
+            if limiter is not None:
+                await deadline.wait(limiter.acquire(estimated))
+            try:
+                response = await self._send_completion(request, deadline, stream)
+            except Exception as e:
+                if not self.router.is_retryable(e) or attempt == max_retries:
+                    raise
+                rate_limited = self.router.is_rate_limited(e)
+                if rate_limited and limiter is not None:
+                    # すべてのリクエストを止め、次の acquire で待つ
+                    limiter.on_rate_limited(retry_after_seconds(e), attempt)
+                    continue
+                delay = retry_after_seconds(e) if rate_limited else None
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded("やり直す前にクエリの持ち時間を使い切ります") from e
+                await asyncio.sleep(delay)
+                continue
+            if limiter is not None:
+                # ストリーミングでは使ったトークン数が返らないので、見積もりどおりとする
+                usage = None if stream else response.usage
+                limiter.settle(estimated, usage.total_tokens if usage else estimated)
+            return response
+
+    async def _send_completion(
+        self, request: Dict[str, Any], deadline: Deadline, stream: bool = False
+    ) -> Any:
+        """リクエストを router で1回送る（hedger があれば遅い時に複製を送る）."""
+
+        async def send() -> Any:
+            if stream:
+                return await self.router.stream(request)
+            return await self.router.complete(request)
+
+        return await deadline.wait(self.hedger.run(send) if self.hedger is not None else send())
+
+    async def _stream_completion(
+        self, request: Dict[str, Any], deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Any]:
+        """ストリーミングで router に送り、応答の断片を期限まで読む.
+
+        最初の断片が届くまでは _request_completion のやり直し、ヘッジと期限を通し、
+        その後は断片ごとに期限を確かめる.
+
+        Args:
+            request: chat.completions.create に渡す引数（stream は除く）.
+            deadline: 応答の期限（Noneは無制限）.
+
+        Yields:
+            応答の断片.
+
+        Raises:
+            DeadlineExceeded: 期限までに応答を読み終えなかった場合.
+        """
+        deadline = deadline or Deadline()
+        stream = await self._request_completion(request, deadline, stream=True)
+        try:
+            while True:
+                async with deadline.limit():
+                    chunk = await anext(stream, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def process_query(
+        self,
+        query: str,
+        memory: Optional[ConversationMemory] = None,
+        deadline: Optional[float] = None,
+    ) -> str:
+        """LLMと利用可能なMCPツールを使用してクエリを処理する.
+
+        Args:
+            query: ユーザークエリ.
+            memory: 会話の記憶（指定した場合は、要約と直近の会話をクエリの前に置き、
+                この往復を記憶に加える）.
+            deadline: このクエリの持ち時間の秒数（Noneの場合はクライアントの deadline）.
+
+        Returns:
+            LLMからの回答.
+
+        Raises:
+            DeadlineExceeded: 持ち時間のうちに回答が得られなかった場合.
+        """
+        budget = Deadline(deadline if deadline is not None else self.deadline)
+        history = await memory.messages() if memory is not None else []
+        with self.tracer.span("process_query"):
+            answer = await self._answer_query(query, history, budget)
+        if memory is not None:
+            memory.add_turn(query, answer, self._summarize)
+        return answer
+
+    async def _summarize(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """会話の要約に、直近の会話から押し出された会話の要点を書き足す.
+
+        Args:
+            summary: これまでの要約.
+            messages: 新しく押し出された会話.
+
+        Returns:
+            更新した要約.
+        """
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        response = await self._create_completion(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "あなたは会話の要約を更新します。これまでの要約に新しい会話の要点"
+                    "（ユーザーの目的、わかった事実、決まったこと）を書き足し、簡潔な要約だけを返してください。",
+                },
+                {
+                    "role": "user",
+                    "content": f"これまでの要約:\n{summary or '（なし）'}\n\n新しい会話:\n{conversation}",
+                },
+            ],
+        )
+        return response.choices[0].message.content or summary
+
+    async def _answer_query(
+        self, query: str, history: List[Dict[str, Any]], deadline: Optional[Deadline] = None
+    ) -> str:
+        """ツールを使ってクエリに答える（process_query の本体）.
+
+        Args:
+            query: ユーザークエリ.
+            history: クエリの前に置く会話（要約と直近の会話）.
+            deadline: クエリの期限（各フェーズに残りの一部を割り当てる）.
+
+        Returns:
+            LLMからの回答.
+        """
+        deadline = deadline or Deadline()
+        # KBの質問とほぼ同じクエリには、LLMを呼ばずに保存済みの回答を返す
+        if self.faq is not None:
+            answer = self.faq.match(query)
+            if answer is not None:
+                return self._label("(FAQ) ") + answer
+
+        # 利用可能なツールを入手する
+        with self.tracer.span("list_tools") as span:
+            tools = await self.select_tools(query)
+            span.attributes["tools"] = len(tools)
+
+        # KBの質問らしいクエリでは、モデルが呼びそうなツールを最初の応答と並行に実行する
+        prefetch = self._start_prefetch(query, tools, deadline)
+
+        # LLMのAPIコール
+        try:
+            with self.tracer.span("completion.first"):
+                response = await self._create_completion(
+                    deadline=deadline.phase(PHASE_SHARES["completion.first"]),
+                    model=self.model,
+                    messages=[*history, {"role": "user", "content": query}],
+                    tools=tools,
+                    tool_choice="auto",
+                )
+        except BaseException:
+            if prefetch is not None:
+                await prefetch.discard()
+            raise
+
+        # アシスタントの返答を得る
+        assistant_message = response.choices[0].message
+        await self._settle_prefetch(query, prefetch, assistant_message.tool_calls)
+
+        # ユーザーからの問い合わせとアシスタントの応答による会話の初期化
+        messages = [
+            *history,
+            {"role": "user", "content": query},
+            assistant_message,
+        ]
+
+        # ツールコールがある場合はそれを処理する
+        if assistant_message.tool_calls:
+            # 各ツールの呼び出しを並行に処理し、会話にツールの反応を追加する
+            messages.extend(
+                await self.call_tools(
+                    assistant_message.tool_calls,
+                    deadline.phase(PHASE_SHARES["call_tools"]),
+                    prefetch,
+                )
+            )
+
+            # LLMからツール結果の最終応答を得る
+            with self.tracer.span("completion.final"):
+                final_response = await self._create_completion(
+                    deadline=deadline.phase(PHASE_SHARES["completion.final"]),
+                    model=self.model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice="none",  # Don't allow more tool calls
+                )
+
+            return self._label("(MCP) ") + (final_response.choices[0].message.content or "")
+
+        # ツールの呼び出しはなく、LLMから直接レスポンスを返すだけ
+        return assistant_message.content
+
+    async def process_queries(
+        self, queries: Iterable[str], concurrency: int = 8
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """複数のクエリを並行に処理し、終わった順に結果を返す.
+
+        LLMのリクエスト数とトークン数は rate_limiter の上限内に収める.
+
+        Args:
+            queries: ユーザークエリ（必要になった分だけ順に取り出す）.
+            concurrency: 同時に処理するクエリの最大数.
+
+        Yields:
+            "index"（queries での位置）、"query"、"answer"、"error"（失敗した場合のメッセージ、
+            成功ならNone）、"queued"（処理を始めるまでに待った秒数）、"seconds"（処理にかかった秒数）
+            を持つ辞書.
+        """
+        pending = iter(enumerate(queries))
+        results: asyncio.Queue = asyncio.Queue()
+        batch_start = time.perf_counter()
+
+        async def worker() -> None:
+            try:
+                # すべてのワーカーが同じイテレータから次のクエリを取り出す
+                for index, query in pending:
+                    start = time.perf_counter()
+                    answer, error = None, None
+                    try:
+                        answer = await self.process_query(query)
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    results.put_nowait(
+                        {
+                            "index": index,
+                            "query": query,
+                            "answer": answer,
+                            "error": error,
+                            "queued": start - batch_start,
+                            "seconds": time.perf_counter() - start,
+                        }
+                    )
+            finally:
+                results.put_nowait(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        running = len(workers)
+        try:
+            while running:
+                result = await results.get()
+                if result is None:
+                    running -= 1
+                    continue
+                yield result
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def process_query_stream(
+        self,
+        query: str,
+        memory: Optional[ConversationMemory] = None,
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """process_query のストリーミング版. 回答のトークンを届いた順に返す.
+
+        Args:
+            query: ユーザークエリ.
+            memory: 会話の記憶（process_query と同じ）.
+            deadline: このクエリの持ち時間の秒数（Noneの場合はクライアントの deadline）.
+
+        Yields:
+            LLMからの回答の断片.
+
+        Raises:
+            DeadlineExceeded: 持ち時間のうちに回答を流し終えなかった場合.
+        """
+        budget = Deadline(deadline if deadline is not None else self.deadline)
+        history = await memory.messages() if memory is not None else []
+        parts: List[str] = []
+        # 途中でyieldするため、現在のスパンは切り替えずに親子関係を明示する
+        root = self.tracer.start_span("process_query_stream")
+        error = None
+        try:
+            async for delta in self._stream_answer(query, history, root, budget):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.tracer.end_span(root, error)
+        if memory is not None:
+            memory.add_turn(query, "".join(parts), self._summarize)
+
+    async def _stream_answer(
+        self,
+        query: str,
+        history: List[Dict[str, Any]],
+        root: Span,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[str]:
+        """ツールを使ってクエリに答え、回答の断片を返す（process_query_stream の本体）.
+
+        Args:
+            query: ユーザークエリ.
+            history: クエリの前に置く会話（要約と直近の会話）.
+            root: 各フェーズのスパンの親にするスパン.
+            deadline: クエリの期限（各フェーズに残りの一部を割り当てる）.
+
+        Yields:
+            LLMからの回答の断片.
+        """
+        # KBの質問とほぼ同じクエリには、LLMを呼ばずに保存済みの回答を返す
+        if self.faq is not None:
+            answer = self.faq.match(query)
+            if answer is not None:
+                yield self._label("(FAQ) ") + answer
+                return
+
+        # 利用可能なツールを入手する
+        with self.tracer.span("list_tools", parent=root) as span:
+            tools = await self.select_tools(query)
+            span.attributes["tools"] = len(tools)
+
+        # KBの質問らしいクエリでは、モデルが呼びそうなツールを最初の応答と並行に実行する
+        deadline = deadline or Deadline()
+        prefetch = self._start_prefetch(query, tools, deadline)
+
+        # LLMのAPIコール（ストリーミング）
+        first = self.tracer.start_span("completion.first", parent=root)
+        error = None
+        try:
+            stream = self._stream_completion(
+                {
+                    "model": self.model,
+                    "messages": [*history, {"role": "user", "content": query}],
+                    "tools": tools,
+                    "tool_choice": "auto",
+                },
+                deadline.phase(PHASE_SHARES["completion.first"]),
+            )
+
+            # 本文はそのまま流し、ツールコールは断片を index ごとにつなぎ合わせる
+            content_parts: List[str] = []
+            partial_calls: Dict[int, Dict[str, Any]] = {}
+            async with aclosing(stream):
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield delta.content
+                    for call in delta.tool_calls or []:
+                        slot = partial_calls.setdefault(
+                            call.index,
+                            {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+                        )
+                        if call.id:
+                            slot["id"] = call.id
+                        if call.function and call.function.name:
+                            slot["function"]["name"] += call.function.name
+                        if call.function and call.function.arguments:
+                            slot["function"]["arguments"] += call.function.arguments
+        except BaseException as e:
+            error = e
+            if prefetch is not None:
+                await prefetch.discard()
+            raise
+        finally:
+            self.tracer.end_span(first, error)
+
+        tool_calls = [
+            ChatCompletionMessageToolCall.model_validate(partial_calls[index])
+            for index in sorted(partial_calls)
+        ]
+        await self._settle_prefetch(query, prefetch, tool_calls)
+
+        # ツールの呼び出しはなく、LLMからの直接レスポンスを流し終えた
+        if not tool_calls:
+            return
+        messages = [
+            *history,
+            {"role": "user", "content": query},
+            {
+                "role": "assistant",
+                "content": "".join(content_parts) or None,
+                "tool_calls": [tool_call.model_dump() for tool_call in tool_calls],
+            },
+        ]
+        with self.tracer.span("call_tools", parent=root):
+            messages.extend(
+                await self.call_tools(
+                    tool_calls, deadline.phase(PHASE_SHARES["call_tools"]), prefetch
+                )
+            )
+
+        # LLMからツール結果の最終応答をストリーミングで得る
+        final = self.tracer.start_span("completion.final", parent=root)
+        error = None
+        try:
+            final_stream = self._stream_completion(
+                {
+                    "model": self.model,
+                    "messages": messages,
+                    "tools": tools,
+                    "tool_choice": "none",  # Don't allow more tool calls
+                },
+                deadline.phase(PHASE_SHARES["completion.final"]),
+            )
+            label = self._label("(MCP) ")
+            async with aclosing(final_stream):
+                async for chunk in final_stream:
+                    if label:
+                        yield label
+                        label = ""
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.tracer.end_span(final, error)
+
+    def _label(self, label: str) -> str:
+        """label_answers なら回答の先頭に付けるラベルを、そうでなければ空文字列を返す."""
+        return label if self.label_answers else ""
+
+    async def cleanup(self):
+        """クリーンアップ・リソース."""
+        self.tracer.close()
+        await self.exit_stack.aclose()
+
@@ -0,0 +1,179 @@
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+
+from .tracing import percentile
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """クエリの持ち時間を使い切った."""
+
+
+class Deadline:
+    """1つのクエリの持ち時間. フェーズごとに残りの一部を割り当てる."""
+
+    def __init__(self, seconds: Optional[float] = None, expires: Optional[float] = None):
+        """持ち時間を決める.
+
+        Args:
+            seconds: 今からの秒数（Noneは無制限）.
+            expires: 期限の time.monotonic() の値（seconds より優先する）.
+        """
+        if expires is None and seconds is not None:
+            expires = time.monotonic() + seconds
+        self.expires = expires
+
+    def remaining(self) -> Optional[float]:
+        """残りの秒数を返す（無制限ならNone、期限を過ぎていれば0）."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def phase(self, share: float) -> "Deadline":
+        """残りの時間の share（0〜1）を持ち時間とする、フェーズの期限を作る（元の期限は越えない）."""
+        remaining = self.remaining()
+        if remaining is None:
+            return Deadline()
+        return Deadline(expires=min(self.expires, time.monotonic() + remaining * share))
+
+    def check(self) -> None:
+        """期限を過ぎていれば DeadlineExceeded を送出する."""
+        if self.remaining() == 0.0:
+            raise DeadlineExceeded("クエリの持ち時間を使い切りました")
+
+    async def wait(self, awaitable: Awaitable[T]) -> T:
+        """期限までに awaitable が終わるのを待つ.
+
+        Raises:
+            DeadlineExceeded: 期限までに終わらなかった場合. awaitable 自身が送出した
+                asyncio.TimeoutError（OpenAIクライアントやツールのタイムアウト）はそのまま送出する.
+        """
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        try:
+            done, _ = await asyncio.wait([task], timeout=self.remaining())
+            if not done:
+                raise DeadlineExceeded("クエリの持ち時間を使い切りました")
+            return task.result()
+        finally:
+            # 期限を過ぎた場合と、呼び出し元がキャンセルされた場合は止める
+            task.cancel()
+
+    @asynccontextmanager
+    async def limit(self) -> AsyncIterator[None]:
+        """ブロックを期限までに終える. wait と違い、ブロックは呼び出し元のタスクで動くため、
+        非同期イテレータの次の要素を待つのに使える.
+
+        Raises:
+            DeadlineExceeded: 期限までに終わらなかった場合（ブロックはキャンセルする）.
+                ブロック自身が送出した asyncio.TimeoutError はそのまま送出する.
+        """
+        self.check()
+        timeout = asyncio.timeout(self.remaining())
+        try:
+            async with timeout:
+                yield
+        except TimeoutError:
+            if timeout.expired():
+                raise DeadlineExceeded("クエリの持ち時間を使い切りました") from None
+            raise
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """やり直す前に待つ秒数（上限つきの指数バックオフに、0.5〜1.5倍のジッターをかける）."""
+    return min(cap, base * 2**attempt) * random.uniform(0.5, 1.5)
+
+
+class Hedger:
+    """応答が遅いリクエストの複製（ヘッジ）を送り、先に返った方を使う.
+
+    最初のリクエストが直近の応答時間の quantile（既定はp95）を過ぎても返らなければ、
+    同じリクエストをもう1つ送る. ヘッジで負荷が増えすぎないよう、ヘッジの割合は
+    max_rate までに抑える.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        delay: Optional[float] = None,
+        min_samples: int = 20,
+        max_rate: float = 0.1,
+        window: int = 1000,
+    ):
+        """ヘッジの条件を決める.
+
+        Args:
+            quantile: ヘッジを送るまでの時間に使う、直近の応答時間の分位数.
+            delay: ヘッジを送るまでの秒数（指定した場合は quantile より優先する）.
+            min_samples: quantile で決める場合に、ヘッジを始めるのに必要な応答の数.
+            max_rate: リクエストのうちヘッジを送る割合の上限.
+            window: 応答時間の分布の計算に使う直近の件数.
+        """
+        self.quantile = quantile
+        self.delay = delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self._latencies: deque = deque(maxlen=window)
+        self._stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの秒数を返す（ヘッジを送らない場合はNone）."""
+        if self._stats["hedged"] >= self.max_rate * max(1, self._stats["requests"]):
+            return None
+        if self.delay is not None:
+            return self.delay
+        if len(self._latencies) < self.min_samples:
+            return None
+        return percentile(sorted(self._latencies), self.quantile)
+
+    async def run(self, send: Callable[[], Awaitable[T]]) -> T:
+        """send を呼び、必要ならヘッジを送って、先に成功した方の結果を返す.
+
+        Args:
+            send: リクエストを1回送るコルーチン関数.
+
+        Returns:
+            先に成功したリクエストの結果（両方失敗したら後の方の例外を送出する）.
+        """
+        self._stats["requests"] += 1
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        tasks = [asyncio.ensure_future(send())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self._stats["hedged"] += 1
+                tasks.append(asyncio.ensure_future(send()))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not tasks[0]:
+                        self._stats["hedge_wins"] += 1
+                    self._latencies.append(time.perf_counter() - start)
+                    return task.result()
+            raise error
+        finally:
+            # 負けた方（と、キャンセルされた場合は両方）を止める
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """リクエスト数、ヘッジの回数と割合、ヘッジが勝った回数、応答時間のp50/p95/p99を返す."""
+        latencies = sorted(self._latencies)
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["hedge_rate"] = self._stats["hedged"] / max(1, self._stats["requests"])
+        stats["hedge_delay"] = self.hedge_delay()
+        for q in (0.5, 0.95, 0.99):
+            stats[f"latency_p{int(q * 100)}"] = percentile(latencies, q)
+        return stats
@@ -0,0 +1,166 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .kbstore import KnowledgeBaseStore
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_WORD_RE = re.compile(r"[a-z0-9]+(?:['’][a-z]+)?")
+
+# 否定を表す語（英語）と語尾（日本語）
+_NEGATION_WORDS = frozenset({"no", "not", "never", "nor", "cannot", "without"})
+_NEGATION_SUFFIXES = ("n't", "n’t")
+_JA_NEGATIONS = ("ない", "ません")
+
+# 質問の内容を変えない、疑問詞などのありふれた語
+_STOP_WORDS = frozenset(
+    "what when where which does have there this that about tell please could would should "
+    "with from your".split()
+)
+
+
+def normalize_question(text: str) -> str:
+    """表記ゆれを吸収するために質問文を正規化する（NFKC、小文字化、記号と空白の除去）.
+
+    Args:
+        text: 質問文.
+
+    Returns:
+        正規化された文字列.
+    """
+    return _NON_WORD_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def char_ngrams(text: str, n: int = 3) -> set:
+    """文字n-gramの集合を返す（n文字より短い場合は文字列そのもの）."""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def question_terms(text: str) -> Tuple[FrozenSet[str], bool]:
+    """質問の意図を比べるために、内容語と否定の有無を取り出す.
+
+    Args:
+        text: 質問文.
+
+    Returns:
+        (内容語の集合, 否定を含むかどうか). 内容語は4文字以上の英数字の語から、
+        疑問詞などのありふれた語と否定語を除いたもの.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    words = _WORD_RE.findall(text)
+    negated = any(
+        word in _NEGATION_WORDS or word.endswith(_NEGATION_SUFFIXES) for word in words
+    ) or any(negation in text for negation in _JA_NEGATIONS)
+    terms = frozenset(
+        base
+        for base in (re.split(r"['’]", word)[0] for word in words)
+        if len(base) >= 4 and base not in _STOP_WORDS and base not in _NEGATION_WORDS
+    )
+    return terms, negated
+
+
+class FaqIndex:
+    """KBの質問文に対する完全一致ハッシュと文字n-gramの転置インデックス."""
+
+    def __init__(self, entries: Sequence[Dict[str, str]], n: int = 3):
+        """インデックスを構築する.
+
+        Args:
+            entries: "question" と "answer" を持つ辞書のシーケンス.
+            n: 文字n-gramの長さ.
+        """
+        self.entries = entries
+        self.n = n
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.gram_counts: List[int] = []
+
+        for idx, entry in enumerate(entries):
+            question = normalize_question(entry["question"])
+            self.exact.setdefault(question, idx)
+            grams = char_ngrams(question, n)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(idx)
+
+    def lookup(self, query: str) -> Optional[Tuple[int, float]]:
+        """クエリに最も近い質問を探す.
+
+        Args:
+            query: ユーザークエリ.
+
+        Returns:
+            (エントリの添字, 類似度) . 類似度は文字n-gramのDice係数で、完全一致なら1.0.
+            候補が無い場合はNone.
+        """
+        question = normalize_question(query)
+        if question in self.exact:
+            return self.exact[question], 1.0
+
+        grams = char_ngrams(question, self.n)
+        if not grams:
+            return None
+
+        overlap: Counter = Counter()
+        for gram in grams:
+            overlap.update(self.postings.get(gram, ()))
+        if not overlap:
+            return None
+
+        return max(
+            (
+                (idx, 2 * shared / (len(grams) + self.gram_counts[idx]))
+                for idx, shared in overlap.items()
+            ),
+            key=lambda item: item[1],
+        )
+
+
+class FaqMatcher:
+    """KBの質問とほぼ同じクエリに、LLMを呼ばずに保存済みの回答を返すマッチャー.
+
+    文字n-gramの類似度が高くても、否定の有無や内容語（"vacation" と "vaccination"、
+    "for contractors" などの追加）が違うクエリは、別の質問として扱う.
+    """
+
+    def __init__(self, kb_path: str, threshold: float = 0.85):
+        """マッチャーを初期化する.
+
+        Args:
+            kb_path: サーバーと同じ kb.json へのパス.
+            threshold: 回答をそのまま返す類似度の下限.
+        """
+        self.store = KnowledgeBaseStore(kb_path)
+        self.threshold = threshold
+        self.stats = {"hits": 0, "misses": 0}
+
+    def match(self, query: str) -> Optional[str]:
+        """クエリに十分近い質問があれば、その回答を返す.
+
+        Args:
+            query: ユーザークエリ.
+
+        Returns:
+            保存済みの回答. 確信を持って一致する質問が無ければNone.
+        """
+        try:
+            # KBのバージョンが変わるとインデックスは作り直される
+            index = self.store.derived("faq", FaqIndex)
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+
+        hit = index.lookup(query)
+        if (
+            hit is None
+            or hit[1] < self.threshold
+            or question_terms(query) != question_terms(index.entries[hit[0]]["question"])
+        ):
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return index.entries[hit[0]]["answer"]
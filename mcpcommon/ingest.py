@@ -0,0 +1,201 @@
+# uv add docling
+
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from .kbstream import file_digest
+
+SUPPORTED_SUFFIXES = {".pdf", ".docx", ".html", ".htm"}
+
+# ワーカー・プロセスごとに一度だけ作るDoclingのコンバーター
+_converter = None
+
+
+def _init_worker() -> None:
+    """ワーカー・プロセスでDoclingのコンバーターを初期化する."""
+    global _converter
+    from docling.document_converter import DocumentConverter
+
+    _converter = DocumentConverter()
+
+
+def convert_document(path: str, source: str) -> List[Dict[str, str]]:
+    """1つの文書をDoclingで変換し、KBのQ&Aエントリに分割する.
+
+    Args:
+        path: 文書へのパス.
+        source: エントリに記録する文書の相対パス.
+
+    Returns:
+        "question", "answer", "source" を持つ辞書のリスト.
+    """
+    from docling.chunking import HierarchicalChunker
+
+    if _converter is None:
+        _init_worker()
+
+    document = _converter.convert(path).document
+    title = os.path.splitext(os.path.basename(path))[0]
+
+    entries = []
+    for chunk in HierarchicalChunker().chunk(document):
+        text = chunk.text.strip()
+        if not text:
+            continue
+        headings = chunk.meta.headings or []
+        entries.append(
+            {
+                "question": " / ".join([title, *headings]),
+                "answer": text,
+                "source": source,
+            }
+        )
+    return entries
+
+
+def find_documents(docs_dir: str) -> List[str]:
+    """ディレクトリ以下の変換対象の文書を探す.
+
+    Args:
+        docs_dir: 文書のディレクトリ.
+
+    Returns:
+        docs_dir からの相対パスのリスト（ソート済み）.
+    """
+    found = []
+    for root, _, files in os.walk(docs_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in SUPPORTED_SUFFIXES:
+                found.append(os.path.relpath(os.path.join(root, name), docs_dir))
+    return sorted(found)
+
+
+def _load_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json_atomic(path: str, data) -> None:
+    """一時ファイルに書いてから置き換え、サーバーが書きかけのファイルを読まないようにする."""
+    # 同じファイルを複数のプロセスが同時に書いても、一時ファイルが重ならないようにする
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or "."
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # 書きかけのファイルを残さない
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def ingest(
+    docs_dir: str,
+    kb_path: str,
+    cache_dir: str,
+    workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """文書ディレクトリを変換して kb.json に書き込む.
+
+    内容が変わっていない文書はキャッシュから読み、変わった文書だけを
+    プロセス・プールで並列に変換する. 手で書かれた（"source" の無い）エントリは残す.
+    変換に失敗した文書は、次に変換できるまで kb.json にある前回のエントリを残す.
+
+    Args:
+        docs_dir: 文書のディレクトリ.
+        kb_path: 書き込む kb.json へのパス.
+        cache_dir: 変換結果をハッシュごとに保存するディレクトリ.
+        workers: ワーカー・プロセス数（Noneの場合はCPU数）.
+
+    Returns:
+        文書数、変換・キャッシュ利用・失敗した文書数、書き込んだエントリ数.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = find_documents(docs_dir)
+    digests = {source: file_digest(os.path.join(docs_dir, source)) for source in sources}
+
+    def cache_path(digest: str) -> str:
+        return os.path.join(cache_dir, f"{digest}.json")
+
+    kb_data = _load_json(kb_path, [])
+    manual = [item for item in kb_data if not (isinstance(item, dict) and "source" in item)]
+    previous: Dict[str, List[Dict[str, str]]] = {}
+    for item in kb_data:
+        if isinstance(item, dict) and "source" in item:
+            previous.setdefault(item["source"], []).append(item)
+
+    chunks: Dict[str, List[Dict[str, str]]] = {}
+    pending = []
+    for source, digest in digests.items():
+        cached = _load_json(cache_path(digest), None)
+        if cached is None:
+            pending.append(source)
+        else:
+            # 同じ内容のファイルが移動・改名された場合に備えてsourceを付け直す
+            chunks[source] = [{**entry, "source": source} for entry in cached]
+
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {
+                pool.submit(convert_document, os.path.join(docs_dir, source), source): source
+                for source in pending
+            }
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    entries = future.result()
+                except Exception as e:
+                    failed += 1
+                    chunks[source] = previous.get(source, [])
+                    print(f"  ! {source}: {e}（前回のエントリ {len(chunks[source])} 件を残します）")
+                    continue
+                _write_json_atomic(cache_path(digests[source]), entries)
+                chunks[source] = entries
+                print(f"  + {source}: {len(entries)} chunks")
+
+    generated = [entry for source in sources for entry in chunks.get(source, [])]
+    _write_json_atomic(kb_path, manual + generated)
+
+    return {
+        "documents": len(sources),
+        "converted": len(pending) - failed,
+        "cached": len(sources) - len(pending),
+        "failed": failed,
+        "entries": len(manual) + len(generated),
+    }
+
+
+def main():
+    """インジェスト・コマンドのメイン・エントリー・ポイント."""
+    parser = argparse.ArgumentParser(description="文書ディレクトリから kb.json を作る")
+    parser.add_argument("docs_dir", help="PDF/DOCX/HTML文書のディレクトリ")
+    parser.add_argument("--kb", default=os.path.join("data", "kb.json"))
+    parser.add_argument("--cache", default=os.path.join("data", "ingest_cache"))
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = ingest(args.docs_dir, args.kb, args.cache, args.workers)
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{summary['documents']}文書 (変換 {summary['converted']}, "
+        f"キャッシュ {summary['cached']}, 失敗 {summary['failed']}) -> "
+        f"{summary['entries']}エントリ ({elapsed:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
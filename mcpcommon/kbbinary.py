@@ -0,0 +1,141 @@
+import argparse
+import array
+import contextlib
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Iterator
+
+from .kbstream import HashingReader, iter_items, normalize_entry
+
+# ファイル形式:
+#   magic (8バイト) | エントリ数 N (uint64) | オフセット配列の位置 (uint64)
+#   | 元のkb.jsonのSHA-256 (32バイト) | UTF-8文字列ブロブ
+#   | オフセット配列 (ネイティブのバイト順のuint64 × (2N+1))
+# エントリ i の質問は blob[off[2i]:off[2i+1]]、回答は blob[off[2i+1]:off[2i+2]].
+# 入力をストリームで読みながら書けるよう、エントリ数の要るオフセット配列は最後に置く.
+MAGIC = b"KBIN0002"
+KBIN_SUFFIX = ".kbin"
+_HEADER = struct.Struct("<8sQQ32s")
+
+
+class BinaryKnowledgeBase:
+    """mmapで開いたバイナリ形式のナレッジ・ベース.
+
+    オフセット配列とブロブはOSのページ・キャッシュを通して共有され、
+    エントリはアクセスされた時にだけ添字で取り出される.
+    """
+
+    def __init__(self, path: str):
+        """ファイルを開いてmmapする.
+
+        Args:
+            path: .kbin ファイルへのパス.
+
+        Raises:
+            ValueError: ファイルの形式が不正な場合.
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{path} はバイナリ形式のナレッジ・ベースではありません")
+        magic, count, offsets_pos, digest = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} はバイナリ形式のナレッジ・ベースではありません")
+
+        self._count = count
+        self.digest = digest.hex()
+        view = memoryview(self._mmap)
+        self._blob = view[_HEADER.size : offsets_pos]
+        self._offsets = view[offsets_pos : offsets_pos + 8 * (2 * count + 1)].cast("Q")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _string(self, k: int) -> str:
+        return str(self._blob[self._offsets[k] : self._offsets[k + 1]], "utf-8")
+
+    def question(self, i: int) -> str:
+        """i番目のエントリの質問を返す."""
+        return self._string(2 * i)
+
+    def answer(self, i: int) -> str:
+        """i番目のエントリの回答を返す."""
+        return self._string(2 * i + 1)
+
+    def __getitem__(self, i: int) -> Dict[str, str]:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return {"question": self.question(i), "answer": self.answer(i)}
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        for i in range(self._count):
+            yield self[i]
+
+
+def build_binary(kb_path: str, bin_path: str) -> int:
+    """kb.json / kb.jsonl をストリームで読み、バイナリ形式のナレッジ・ベースを作る.
+
+    入力全体をメモリに置かないため、メモリ使用量はオフセット配列の分だけになる.
+
+    Args:
+        kb_path: 元の kb.json または kb.jsonl へのパス.
+        bin_path: 書き込む .kbin ファイルへのパス.
+
+    Returns:
+        書き込んだエントリ数.
+    """
+    offsets = array.array("Q", [0])
+    count = 0
+    # 同じファイルを複数のプロセスが同時に作っても、書きかけのファイルを開かないようにする
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(bin_path) + ".", suffix=".tmp", dir=os.path.dirname(bin_path) or "."
+    )
+    try:
+        with open(kb_path, "rb") as f, os.fdopen(fd, "wb") as out:
+            reader = HashingReader(f)
+            # ヘッダの場所を空けておき、ブロブを先に書く
+            out.seek(_HEADER.size)
+            for count, item in enumerate(iter_items(reader, kb_path), 1):
+                entry = normalize_entry(count, item)
+                for text in (entry["question"], entry["answer"]):
+                    data = text.encode("utf-8")
+                    out.write(data)
+                    offsets.append(offsets[-1] + len(data))
+
+            # 配列の後ろの空白などもハッシュに含める
+            while reader.read(1 << 16):
+                pass
+
+            offsets_pos = out.tell()
+            out.write(offsets.tobytes())
+            out.seek(0)
+            out.write(
+                _HEADER.pack(MAGIC, count, offsets_pos, bytes.fromhex(reader.hexdigest()))
+            )
+        os.replace(tmp_path, bin_path)
+    except BaseException:
+        # 書きかけのファイルを残さない
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    return count
+
+
+def main():
+    """kb.json を .kbin に変換するコマンドのメイン・エントリー・ポイント."""
+    parser = argparse.ArgumentParser(description="kb.json をmmap用のバイナリ形式に変換する")
+    parser.add_argument("--kb", default=os.path.join("data", "kb.json"))
+    parser.add_argument("--out", default=os.path.join("data", "kb" + KBIN_SUFFIX))
+    args = parser.parse_args()
+
+    count = build_binary(args.kb, args.out)
+    print(f"{count}エントリを {args.out} に書き込みました")
+
+
+if __name__ == "__main__":
+    main()
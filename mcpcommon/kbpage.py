@@ -0,0 +1,162 @@
+# uv add tiktoken
+
+import functools
+import os
+import re
+import sys
+from typing import List, Sequence, Tuple
+
+# トークン数を数える対象のモデル（クライアントが使うモデルに合わせる）
+TOKEN_MODEL = os.getenv("KB_TOKEN_MODEL", "gpt-4.1-nano")
+
+# 続きのカーソルを書く行のために残しておくトークン数
+_CURSOR_RESERVE = 16
+
+
+class _ApproxEncoding:
+    """tiktokenの語彙ファイルを取得できない（オフラインの）場合の概算エンコーディング.
+
+    ASCIIはおよそ4文字、それ以外はおよそ1文字を1トークンとして数える.
+    """
+
+    def encode(self, text: str) -> List[str]:
+        pieces: List[str] = []
+        for run in _APPROX_RE.findall(text):
+            if run.isascii():
+                pieces.extend(run[i : i + 4] for i in range(0, len(run), 4))
+            else:
+                pieces.extend(run)
+        return pieces
+
+    def encode_batch(self, texts: List[str]) -> List[List[str]]:
+        return [self.encode(text) for text in texts]
+
+    def decode(self, pieces: List[str]) -> str:
+        return "".join(pieces)
+
+
+_APPROX_RE = re.compile(r"[\x00-\x7f]+|[^\x00-\x7f]+")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = TOKEN_MODEL):
+    """モデルに対応するtiktokenのエンコーディングを返す.
+
+    Args:
+        model: OpenAIのモデル名.
+
+    Returns:
+        tiktokenのエンコーディング（未知のモデルの場合はo200k_base、
+        語彙ファイルを取得できない場合は概算エンコーディング）.
+    """
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"tiktokenを使えないため、トークン数を概算します: {e}", file=sys.stderr)
+        return _ApproxEncoding()
+
+
+def count_tokens(text: str, model: str = TOKEN_MODEL) -> int:
+    """テキストのトークン数を数える.
+
+    Args:
+        text: 数えるテキスト.
+        model: OpenAIのモデル名.
+
+    Returns:
+        トークン数.
+    """
+    return len(get_encoding(model).encode(text))
+
+
+def count_tokens_batch(texts: List[str], model: str = TOKEN_MODEL) -> List[int]:
+    """複数のテキストのトークン数をまとめて数える.
+
+    Args:
+        texts: 数えるテキストのリスト.
+        model: OpenAIのモデル名.
+
+    Returns:
+        各テキストのトークン数.
+    """
+    return [len(tokens) for tokens in get_encoding(model).encode_batch(texts)]
+
+
+def make_cursor(version: str, offset: int) -> str:
+    """KBのバージョンと次の位置からカーソル文字列を作る."""
+    return f"{version[:12]}.{offset}"
+
+
+def parse_cursor(cursor: str, version: str) -> int:
+    """カーソル文字列から次の位置を取り出す.
+
+    Args:
+        cursor: make_cursor で作ったカーソル（空文字列は先頭）.
+        version: 現在のKBのバージョン.
+
+    Returns:
+        次に返すブロックの位置.
+
+    Raises:
+        ValueError: カーソルが不正か、KBが更新されて古くなった場合.
+    """
+    if not cursor:
+        return 0
+    prefix, _, offset = cursor.partition(".")
+    if not offset.isdigit():
+        raise ValueError(f"不正なカーソル: {cursor}")
+    if prefix != version[:12]:
+        raise ValueError("ナレッジ・ベースが更新されたため、カーソルが古くなりました")
+    return int(offset)
+
+
+def paginate(
+    header: str,
+    blocks: Sequence[str],
+    block_tokens: Sequence[int],
+    max_tokens: int,
+    cursor: str,
+    version: str,
+    model: str = TOKEN_MODEL,
+) -> Tuple[str, str]:
+    """トークン予算に収まるだけのブロックを返す.
+
+    予算に1つも収まらない場合でも先に進めるよう、先頭のブロックを予算まで切り詰めて返す.
+
+    Args:
+        header: ページの先頭に付ける文字列.
+        blocks: フォーマット済みのブロック（Q&Aペアなど. 返す範囲だけが添字で読まれる）.
+        block_tokens: 各ブロックのトークン数.
+        max_tokens: ページ全体のトークン予算.
+        cursor: 前のページが返したカーソル（空文字列は先頭）.
+        version: 現在のKBのバージョン.
+        model: トークン数を数えるモデル名.
+
+    Returns:
+        (ページの文字列, 次のカーソル). 最後のページなら次のカーソルは空文字列.
+    """
+    offset = parse_cursor(cursor, version)
+    budget = max_tokens - count_tokens(header, model) - _CURSOR_RESERVE
+
+    page = []
+    end = offset
+    while end < len(blocks) and block_tokens[end] <= budget:
+        page.append(blocks[end])
+        budget -= block_tokens[end]
+        end += 1
+
+    if end == offset and end < len(blocks):
+        encoding = get_encoding(model)
+        page.append(encoding.decode(encoding.encode(blocks[end])[: max(budget, 1)]) + "\n\n")
+        end += 1
+
+    next_cursor = make_cursor(version, end) if end < len(blocks) else ""
+    text = header + "".join(page)
+    if next_cursor:
+        text += f"[next_cursor: {next_cursor}]\n"
+    return text, next_cursor
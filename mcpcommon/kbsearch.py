@@ -0,0 +1,86 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+# 英数字の単語と、日本語（ひらがな・カタカナ・漢字）の連続部分
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_ASCII_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """日本語と英語が混在したテキストを検索用のトークンに分割する.
+
+    英数字は単語単位、日本語は分かち書きが無いため文字バイグラム単位で分割する.
+
+    Args:
+        text: 分割するテキスト.
+
+    Returns:
+        トークンのリスト.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(text):
+        if _ASCII_RE.fullmatch(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """Q&Aエントリの質問と回答に対するBM25の転置インデックス."""
+
+    def __init__(self, entries: List[Dict[str, str]], k1: float = 1.5, b: float = 0.75):
+        """インデックスを構築する.
+
+        Args:
+            entries: "question" と "answer" を持つ辞書のリスト.
+            k1: 単語頻度の飽和パラメータ.
+            b: 文書長の正規化パラメータ.
+        """
+        self.entries = entries
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+
+        for doc_id, entry in enumerate(entries):
+            tokens = tokenize(f"{entry['question']}\n{entry['answer']}")
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_id, tf))
+
+        n = len(entries)
+        self.avg_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        """クエリに対するBM25スコアの上位k件を返す.
+
+        Args:
+            query: 検索クエリ.
+            k: 返すエントリの最大数.
+
+        Returns:
+            (エントリの添字, スコア) のリスト（スコアの降順）.
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in docs:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        return heapq.nlargest(max(k, 0), scores.items(), key=lambda item: item[1])
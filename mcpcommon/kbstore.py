@@ -0,0 +1,239 @@
+import array
+import json
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .kbbinary import KBIN_SUFFIX, BinaryKnowledgeBase, build_binary
+from .kbpage import TOKEN_MODEL, count_tokens_batch
+from .kbstream import JSONL_SUFFIX, file_digest, first_char, iter_entries
+
+KB_HEADER = "Here is the retrieved knowledge base:\n\n"
+
+# text() の結果をバージョンごとに保持する文字数の上限（これより大きいKBは呼ばれるたびに組み立てる）
+MAX_CACHED_TEXT = 4 * 1024 * 1024
+
+
+def format_entry(i: int, entry: Dict[str, str]) -> str:
+    """Q&Aエントリを1件分の文字列にフォーマットする.
+
+    Args:
+        i: 1から始まるエントリ番号.
+        entry: "question" と "answer" を持つ辞書.
+
+    Returns:
+        番号付きの質問と回答の2行からなる文字列.
+    """
+    return f"Q{i}: {entry['question']}\nA{i}: {entry['answer']}\n\n"
+
+
+class EntryBlocks(Sequence):
+    """Q&Aエントリを、添字でアクセスされた時にだけ format_entry でフォーマットするシーケンス.
+
+    ページに載せるブロックだけを作るため、フォーマット済みの文字列をKB全体の分持たない.
+    """
+
+    def __init__(self, entries: Sequence[Dict[str, str]]):
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self.entries)
+        return format_entry(i + 1, self.entries[i])
+
+    def __iter__(self) -> Iterator[str]:
+        for i, entry in enumerate(self.entries, 1):
+            yield format_entry(i, entry)
+
+
+def entry_token_counts(
+    entries: Iterable[Dict[str, str]], model: str = TOKEN_MODEL, batch_size: int = 1024
+) -> array.array:
+    """各Q&Aエントリをフォーマットした時のトークン数を、batch_size 件ずつ数える.
+
+    Args:
+        entries: "question" と "answer" を持つ辞書のイテラブル.
+        model: トークン数を数えるモデル名.
+        batch_size: 一度にフォーマットして数えるエントリ数.
+
+    Returns:
+        各エントリのトークン数の配列（1件あたり4バイト）.
+    """
+    counts = array.array("I")
+    batch: List[str] = []
+    for i, entry in enumerate(entries, 1):
+        batch.append(format_entry(i, entry))
+        if len(batch) >= batch_size:
+            counts.extend(count_tokens_batch(batch, model))
+            batch = []
+    counts.extend(count_tokens_batch(batch, model))
+    return counts
+
+
+class KnowledgeBaseStore:
+    """ナレッジ・ベース・ファイルを一度だけ読み込み、メモリ上に保持するストア.
+
+    ファイルの mtime/サイズが変わった時だけ内容を読み直し、さらに内容のハッシュが
+    変わった時だけ JSON / JSONL をストリームで再パースし、隣に作る .kbin のキャッシュに書く.
+    エントリはmmapで開いたファイルから必要な時に読み出す. フォーマット済みの文字列は
+    max_cached_text までならバージョンごとに保持し、それより大きければ必要な時に組み立てる.
+    .kbin ファイルを直接指定した場合はそれを開く.
+    """
+
+    def __init__(self, kb_path: str, max_cached_text: int = MAX_CACHED_TEXT):
+        """ストアを初期化する.
+
+        Args:
+            kb_path: kb.json、kb.jsonl または .kbin ファイルへのパス.
+            max_cached_text: text() の結果を保持する文字数の上限（0は保持しない）.
+        """
+        self.kb_path = kb_path
+        self.max_cached_text = max_cached_text
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, int]] = None
+        self._digest: Optional[str] = None
+        self._entries: Sequence[Dict[str, str]] = []
+        self._text: Optional[str] = None
+        self._derived: Dict[str, Any] = {}
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    def _refresh(self) -> None:
+        """ファイルが変更されていれば読み直す（ロックを保持した状態で呼ぶ）."""
+        st = os.stat(self.kb_path)
+        signature = (st.st_mtime_ns, st.st_size)
+        if self._digest is not None and signature == self._signature:
+            self._stats["hits"] += 1
+            return
+
+        self._stats["misses"] += 1
+        if self.kb_path.endswith(KBIN_SUFFIX):
+            # 全体を読まずに、ヘッダに記録された元のkb.jsonのハッシュをバージョンとする
+            kb = BinaryKnowledgeBase(self.kb_path)
+            if kb.digest != self._digest:
+                self._load(kb.digest, kb, None)
+            self._signature = signature
+            return
+
+        # ファイル全体をメモリに置かずにハッシュを計算する
+        digest = file_digest(self.kb_path)
+        if digest == self._digest:
+            # touch されただけで内容は同じ
+            self._signature = signature
+            return
+
+        if self.kb_path.endswith(JSONL_SUFFIX) or first_char(self.kb_path) == "[":
+            self._load(digest, self._binary_cache(digest), None)
+        else:
+            # Q&Aペアのリストでない場合は内容をそのまま表示する
+            with open(self.kb_path, "r", encoding="utf-8") as f:
+                kb_data = json.load(f)
+            self._load(
+                digest,
+                [],
+                f"{KB_HEADER}Knowledge base content: {json.dumps(kb_data, indent=2)}\n\n",
+            )
+        self._signature = signature
+
+    def _binary_cache(self, digest: str) -> Sequence[Dict[str, str]]:
+        """JSON / JSONL をストリームで .kbin のキャッシュに書き、mmapで開く.
+
+        エントリはパーサからバイナリ形式の書き込みへ1件ずつ流すため、読み込み中も
+        その後も、メモリに置くのはオフセット配列だけになる. 同じ内容のキャッシュが
+        既にあれば（別のサーバー・プロセスが作った場合など）そのまま使う.
+
+        Args:
+            digest: 元のファイルの内容のハッシュ.
+
+        Returns:
+            エントリのシーケンス.
+        """
+        cache_path = self.kb_path + KBIN_SUFFIX
+        try:
+            kb = BinaryKnowledgeBase(cache_path)
+            if kb.digest == digest:
+                return kb
+        except (OSError, ValueError):
+            pass
+        try:
+            build_binary(self.kb_path, cache_path)
+            return BinaryKnowledgeBase(cache_path)
+        except OSError as e:
+            # キャッシュを書けない場合（読み取り専用のディレクトリなど）はメモリに読み込む
+            print(f"{cache_path} を作れないため、KBをメモリに読み込みます: {e}", file=sys.stderr)
+            return list(iter_entries(self.kb_path))
+
+    def _load(self, digest: str, entries: Sequence[Dict[str, str]], text: Optional[str]) -> None:
+        """新しい内容に切り替え、派生データを捨てる."""
+        if self._digest is not None:
+            self._stats["reloads"] += 1
+        self._entries = entries
+        self._text = text
+        self._derived = {}
+        self._digest = digest
+
+    @property
+    def version(self) -> str:
+        """現在読み込まれている内容のSHA-256ハッシュ."""
+        with self._lock:
+            self._refresh()
+            return self._digest
+
+    def entries(self) -> Sequence[Dict[str, str]]:
+        """Q&Aエントリのシーケンスを返す.
+
+        Returns:
+            "question" と "answer" を持つ辞書のシーケンス.
+        """
+        with self._lock:
+            self._refresh()
+            return self._entries
+
+    def text(self) -> str:
+        """フォーマット済みのナレッジ・ベース全体を返す.
+
+        Returns:
+            すべてのQ&Aペアを含むフォーマットされた文字列.
+        """
+        with self._lock:
+            self._refresh()
+            if self._text is not None:
+                return self._text
+            digest, entries = self._digest, self._entries
+
+        # 小さいKBは一度だけ組み立ててバージョンごとに保持し、大きいKBは常駐させずに呼ばれた時に組み立てる
+        text = KB_HEADER + "".join(EntryBlocks(entries))
+        if len(text) <= self.max_cached_text:
+            with self._lock:
+                # 組み立てている間に読み直していれば、古い内容は保持しない
+                if self._digest == digest:
+                    self._text = text
+        return text
+
+    def derived(self, name: str, builder: Callable[[Sequence[Dict[str, str]]], Any]) -> Any:
+        """エントリから作られる派生データ（検索インデックスなど）をバージョンごとにキャッシュする.
+
+        Args:
+            name: 派生データの名前.
+            builder: エントリのシーケンスから派生データを作る関数.
+
+        Returns:
+            現在のバージョンに対応する派生データ.
+        """
+        with self._lock:
+            self._refresh()
+            if name not in self._derived:
+                self._derived[name] = builder(self._entries)
+            return self._derived[name]
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット/ミス/再読込の回数を返す.
+
+        Returns:
+            カウンタと現在のバージョンを含む辞書.
+        """
+        with self._lock:
+            return {**self._stats, "version": self._digest}
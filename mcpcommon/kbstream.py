@@ -0,0 +1,206 @@
+import codecs
+import hashlib
+import json
+from typing import Any, BinaryIO, Dict, Iterator, Optional
+
+JSONL_SUFFIX = ".jsonl"
+
+# 一度に読み込むバイト数
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = ",]" + _WHITESPACE
+
+
+def normalize_entry(i: int, item: Any) -> Dict[str, str]:
+    """kb.json の1要素を "question" と "answer" を持つ辞書にそろえる.
+
+    Args:
+        i: 1から始まるエントリ番号.
+        item: kb.json のリストの要素.
+
+    Returns:
+        "question" と "answer" を持つ辞書.
+    """
+    if isinstance(item, dict):
+        return {
+            "question": item.get("question", "Unknown question"),
+            "answer": item.get("answer", "Unknown answer"),
+        }
+    return {"question": f"Item {i}", "answer": str(item)}
+
+
+class HashingReader:
+    """読み込んだバイト列のSHA-256ハッシュを同時に計算するファイル・ラッパー."""
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._hash.update(data)
+        return data
+
+    def readline(self) -> bytes:
+        data = self._f.readline()
+        self._hash.update(data)
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.readline, b"")
+
+    def hexdigest(self) -> str:
+        """ここまでに読み込んだ内容のハッシュを返す."""
+        return self._hash.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """ファイル全体を読み込まずに、内容のSHA-256ハッシュを計算する.
+
+    Args:
+        path: ファイルへのパス.
+
+    Returns:
+        16進数のハッシュ文字列.
+    """
+    with open(path, "rb") as f:
+        reader = HashingReader(f)
+        while reader.read(CHUNK_SIZE):
+            pass
+    return reader.hexdigest()
+
+
+def first_char(path: str) -> Optional[str]:
+    """ファイルの空白以外の最初の文字を返す（空ファイルならNone）."""
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(1024)
+            if not chunk:
+                return None
+            stripped = chunk.lstrip(_WHITESPACE)
+            if stripped:
+                return stripped[0]
+
+
+def iter_json_array(f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """トップレベルがJSON配列のファイルから、要素を1つずつ取り出す.
+
+    ファイル全体ではなく、読みかけの要素1つ分とチャンク1つ分だけをメモリに置く.
+
+    Args:
+        f: バイナリ・モードで開いたファイル.
+        chunk_size: 一度に読み込むバイト数.
+
+    Yields:
+        配列の各要素をパースした値.
+
+    Raises:
+        json.JSONDecodeError: JSONが無効な場合（配列の後ろに空白以外が続く場合も含む）.
+    """
+    decoder = json.JSONDecoder()
+    # マルチバイト文字がチャンクの境目で切れても正しくデコードする
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        data = f.read(chunk_size)
+        eof = not data
+        buf = buf[pos:] + utf8.decode(data, final=eof)
+        pos = 0
+        return not eof
+
+    def skip_whitespace() -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def expect_end() -> None:
+        nonlocal pos
+        pos += 1
+        skip_whitespace()
+        if pos < len(buf):
+            raise json.JSONDecodeError("配列の後ろに余分なデータがあります", buf, pos)
+
+    skip_whitespace()
+    if buf[pos : pos + 1] != "[":
+        raise json.JSONDecodeError("JSON配列ではありません", buf, pos)
+    pos += 1
+
+    skip_whitespace()
+    if buf[pos : pos + 1] == "]":
+        expect_end()
+        return
+
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # 数値はチャンクの境目で途切れていても（"2." の "2" など）パースできてしまう
+                if buf[pos] in '{["' or eof or (end < len(buf) and buf[end] in _DELIMITERS):
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        pos = end
+        yield item
+
+        skip_whitespace()
+        sep = buf[pos : pos + 1]
+        if sep == "]":
+            expect_end()
+            return
+        if sep != ",":
+            raise json.JSONDecodeError("',' または ']' が必要です", buf, pos)
+        pos += 1
+
+
+def iter_jsonl(f: BinaryIO) -> Iterator[Any]:
+    """JSONLファイルから1行ずつ値を取り出す.
+
+    Args:
+        f: バイナリ・モードで開いたファイル.
+
+    Yields:
+        各行をパースした値（空行は飛ばす）.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_items(f: BinaryIO, path: str) -> Iterator[Any]:
+    """拡張子に応じて、JSON配列またはJSONLの要素を1つずつ取り出す.
+
+    Args:
+        f: バイナリ・モードで開いたファイル（HashingReaderでもよい）.
+        path: ファイル名（拡張子の判定に使う）.
+
+    Yields:
+        ファイルの各要素をパースした値.
+    """
+    if path.endswith(JSONL_SUFFIX):
+        return iter_jsonl(f)
+    return iter_json_array(f)
+
+
+def iter_entries(path: str) -> Iterator[Dict[str, str]]:
+    """kb.json / kb.jsonl からQ&Aエントリを1つずつ取り出す.
+
+    Args:
+        path: kb.json または kb.jsonl へのパス.
+
+    Yields:
+        "question" と "answer" を持つ辞書.
+    """
+    with open(path, "rb") as f:
+        for i, item in enumerate(iter_items(f, path), 1):
+            yield normalize_entry(i, item)
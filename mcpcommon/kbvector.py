@@ -0,0 +1,222 @@
+import hashlib
+import math
+import unicodedata
+from typing import Dict, Iterable, List, Protocol, Tuple
+
+# IVF_PQ の学習には最低でもこの行数が必要
+MIN_ROWS_FOR_ANN = 256
+
+
+class Embedder(Protocol):
+    """テキストをベクトルに変換する埋め込みバックエンドのインターフェース."""
+
+    name: str
+    dim: int
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+
+class HashingEmbedder:
+    """文字n-gramをハッシュしてベクトル化する、オフラインで決定的な埋め込み."""
+
+    def __init__(self, dim: int = 256, ngram_sizes: tuple = (2, 3)):
+        """埋め込みを初期化する.
+
+        Args:
+            dim: ベクトルの次元数.
+            ngram_sizes: 使用する文字n-gramの長さ.
+        """
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.name = f"hash{dim}_" + "".join(str(n) for n in ngram_sizes)
+
+    def _embed_one(self, text: str) -> List[float]:
+        text = " ".join(unicodedata.normalize("NFKC", text).lower().split())
+        vector = [0.0] * self.dim
+        for n in self.ngram_sizes:
+            for i in range(len(text) - n + 1):
+                digest = hashlib.blake2b(text[i : i + n].encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+class OpenAIEmbedder:
+    """OpenAIのEmbeddings APIを使う埋め込み."""
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 1536):
+        """埋め込みを初期化する.
+
+        Args:
+            model: 使用する埋め込みモデル.
+            dim: モデルが返すベクトルの次元数.
+        """
+        from openai import OpenAI
+
+        self.client = OpenAI()
+        self.model = model
+        self.dim = dim
+        self.name = model.replace("-", "_")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in response.data]
+
+
+def entry_id(entry: Dict[str, str]) -> str:
+    """Q&Aエントリの内容から決まるID（内容が変わればIDも変わる）.
+
+    Args:
+        entry: "question" と "answer" を持つ辞書.
+
+    Returns:
+        エントリ内容のSHA-256ハッシュ.
+    """
+    text = f"{entry['question']}\n{entry['answer']}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorIndex:
+    """Q&AエントリのベクトルをローカルのLanceDBテーブルに保持するインデックス."""
+
+    def __init__(self, db_path: str, embedder: Embedder, batch_size: int = 256):
+        """LanceDBに接続する.
+
+        Args:
+            db_path: LanceDBのディレクトリ.
+            embedder: 埋め込みバックエンド.
+            batch_size: 一度に埋め込むエントリ数.
+        """
+        import lancedb
+
+        self.db = lancedb.connect(db_path)
+        self.embedder = embedder
+        self.batch_size = batch_size
+        # 埋め込みが変わればベクトルの互換性が無いので別テーブルにする
+        self.table_name = f"kb_{embedder.name}"
+        self.table = None
+
+    def _schema(self):
+        import pyarrow as pa
+
+        return pa.schema(
+            [
+                pa.field("id", pa.string()),
+                pa.field("question", pa.string()),
+                pa.field("answer", pa.string()),
+                pa.field("vector", pa.list_(pa.float32(), self.embedder.dim)),
+            ]
+        )
+
+    def sync(self, entries: Iterable[Dict[str, str]]) -> Dict[str, int]:
+        """テーブルをエントリと同期する。追加・変更されたエントリだけを埋め込む.
+
+        エントリはストリームで受け取り、埋め込みのバッチ1つ分だけをメモリに置く.
+
+        Args:
+            entries: "question" と "answer" を持つ辞書のイテラブル.
+
+        Returns:
+            追加・削除した行数.
+        """
+        if self.table is None:
+            self.table = self.db.create_table(
+                self.table_name, schema=self._schema(), exist_ok=True
+            )
+
+        # ベクトル列は読まずにIDだけを取り出す
+        existing = set(
+            self.table.search().select(["id"]).limit(None).to_arrow().column("id").to_pylist()
+        )
+
+        seen = set()
+        batch: List[Tuple[str, Dict[str, str]]] = []
+        added = 0
+        for entry in entries:
+            i = entry_id(entry)
+            if i in seen:
+                continue
+            seen.add(i)
+            if i not in existing:
+                batch.append((i, entry))
+            if len(batch) >= self.batch_size:
+                self._add_batch(batch)
+                added += len(batch)
+                batch = []
+        if batch:
+            self._add_batch(batch)
+            added += len(batch)
+
+        stale = existing - seen
+        if stale:
+            ids = ", ".join(f"'{i}'" for i in stale)
+            self.table.delete(f"id IN ({ids})")
+
+        if added or stale:
+            self._update_ann_index()
+
+        return {"added": added, "deleted": len(stale)}
+
+    def _add_batch(self, batch: List[Tuple[str, Dict[str, str]]]) -> None:
+        """エントリのバッチを埋め込んでテーブルに追加する."""
+        vectors = self.embedder.embed(
+            [f"{entry['question']}\n{entry['answer']}" for _, entry in batch]
+        )
+        self.table.add(
+            [
+                {
+                    "id": i,
+                    "question": entry["question"],
+                    "answer": entry["answer"],
+                    "vector": vector,
+                }
+                for (i, entry), vector in zip(batch, vectors)
+            ]
+        )
+
+    def _update_ann_index(self) -> None:
+        """行数が十分ならANNインデックスを作り、既にあれば新しい行を取り込む."""
+        rows = self.table.count_rows()
+        if rows < MIN_ROWS_FOR_ANN:
+            return
+
+        if self.table.list_indices():
+            self.table.optimize()
+        else:
+            self.table.create_index(
+                metric="cosine",
+                num_partitions=max(1, int(math.sqrt(rows))),
+                num_sub_vectors=max(1, self.embedder.dim // 16),
+            )
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, str]]:
+        """クエリに意味的に近いエントリの上位k件を返す.
+
+        Args:
+            query: 検索クエリ.
+            k: 返すエントリの最大数.
+
+        Returns:
+            "question", "answer", "_distance" を持つ辞書のリスト（近い順）.
+            まだ sync されていない（テーブルが無い）場合は空のリスト.
+        """
+        if self.table is None:
+            # 別のプロセスが sync したテーブルがあれば、それを開く
+            if self.table_name not in self.db.table_names():
+                return []
+            self.table = self.db.open_table(self.table_name)
+
+        vector = self.embedder.embed([query])[0]
+        return (
+            self.table.search(vector)
+            .metric("cosine")
+            .select(["question", "answer"])
+            .limit(k)
+            .to_list()
+        )
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from openai.types.chat import ChatCompletion
+
+from .kbstore import KnowledgeBaseStore
+
+
+def _to_jsonable(value: Any) -> Any:
+    """pydanticのモデル（アシスタントの応答など）をJSONにできる値に変換する."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    raise TypeError(f"JSONにできない値です: {type(value)}")
+
+
+class CompletionCache:
+    """Chat Completions APIの応答をSQLiteファイルに保存するLRUキャッシュ."""
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10000,
+        ttl: Optional[float] = 24 * 60 * 60,
+        kb_path: Optional[str] = None,
+    ):
+        """キャッシュを開く.
+
+        Args:
+            path: SQLiteファイルへのパス.
+            max_entries: 保存する応答の最大数（超えたら最も古く使われたものから消す）.
+            ttl: 応答の有効期間の秒数（Noneは無期限）.
+            kb_path: 指定した場合、この kb.json のバージョンをキーに含め、
+                KBが更新されたら古い応答を使わないようにする.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.kb_store = KnowledgeBaseStore(kb_path) if kb_path else None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, latency REAL NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)"
+        )
+        self._db.commit()
+        self._stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+    def make_key(self, request: Dict[str, Any]) -> str:
+        """リクエストの正規化したJSONからキーを作る.
+
+        Args:
+            request: chat.completions.create に渡す引数（model、messages、tools、tool_choice）.
+
+        Returns:
+            キーとなるSHA-256ハッシュ.
+        """
+        payload = {
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "tools": request.get("tools"),
+            "tool_choice": request.get("tool_choice"),
+        }
+        if self.kb_store is not None:
+            payload["kb_version"] = self.kb_store.version
+        canonical = json.dumps(
+            payload, default=_to_jsonable, ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[ChatCompletion]:
+        """保存された応答を返す.
+
+        Args:
+            key: make_key で作ったキー.
+
+        Returns:
+            保存された応答. 無いか期限切れの場合はNone.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, latency, created FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._stats["hits"] += 1
+            self._stats["saved_seconds"] += row[1]
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, key: str, response: ChatCompletion, latency: float) -> None:
+        """応答を保存し、上限を超えた分を古く使われた順に消す.
+
+        Args:
+            key: make_key で作ったキー.
+            response: APIの応答.
+            latency: APIの呼び出しにかかった秒数（ヒット時に節約できた時間として数える）.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, response.model_dump_json(), latency, now, now),
+            )
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率と節約できた時間を返す.
+
+        Returns:
+            ヒット数、ミス数、ヒット率、節約できた秒数、保存されている応答の数.
+        """
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = entries
+        return stats
+
+    def close(self) -> None:
+        """SQLiteファイルを閉じる."""
+        with self._lock:
+            self._db.close()
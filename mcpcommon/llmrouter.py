@@ -0,0 +1,535 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from .tracing import percentile
+
+# 回路の状態: closed（通常）、open（送らない）、half_open（試しに1件だけ送る）
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Geminiの関数宣言のスキーマで使えるキー（それ以外のJSON Schemaのキーは落とす）
+GEMINI_SCHEMA_KEYS = {"type", "format", "description", "nullable", "enum", "properties", "required", "items"}
+
+# OpenAIの tool_choice → Geminiの function_calling_config の mode
+_GEMINI_TOOL_MODES = {"auto": "AUTO", "none": "NONE", "required": "ANY"}
+
+# Geminiのレート制限のエラー（429）
+_GEMINI_RATE_LIMITED = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+# 別のプロバイダーに切り替えて送り直すGeminiのエラー（429、5xx、タイムアウト）
+_GEMINI_RETRYABLE = (
+    *_GEMINI_RATE_LIMITED,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+def to_gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """MCPツールの入力スキーマ（JSON Schema）を、Geminiの関数宣言で使える形に変換する.
+
+    title、default、additionalProperties などGeminiが受け付けないキーを落とし、
+    Optional（anyOf で null を含むもの）は nullable に置き換える.
+
+    Args:
+        schema: JSON Schemaのオブジェクト.
+
+    Returns:
+        Geminiのスキーマ.
+    """
+    schema = dict(schema)
+    nullable = False
+    variants = schema.pop("anyOf", None)
+    if variants:
+        non_null = [v for v in variants if v.get("type") != "null"]
+        nullable = len(non_null) < len(variants)
+        # 型の和は表せないので、null以外の最初の型を使う
+        if non_null:
+            schema.update(non_null[0])
+    if isinstance(schema.get("type"), list):
+        types = [t for t in schema["type"] if t != "null"]
+        nullable = nullable or len(types) < len(schema["type"])
+        schema["type"] = types[0] if types else "string"
+
+    result = {k: v for k, v in schema.items() if k in GEMINI_SCHEMA_KEYS}
+    # 型の指定がない引数は文字列として扱う
+    result.setdefault("type", "object" if "properties" in result else "string")
+    if nullable:
+        result["nullable"] = True
+    if "properties" in result:
+        result["properties"] = {
+            name: to_gemini_schema(value) for name, value in result["properties"].items()
+        }
+    if "items" in result:
+        result["items"] = to_gemini_schema(result["items"])
+    return result
+
+
+def to_gemini_declaration(name: str, description: Optional[str], schema: Dict[str, Any]) -> Dict[str, Any]:
+    """ツールの名前、説明、入力スキーマからGeminiの関数宣言を作る."""
+    declaration = {"name": name, "description": description or ""}
+    parameters = to_gemini_schema(schema)
+    # 引数のないツールにはparametersを付けない（空のオブジェクトは受け付けられない）
+    if parameters.get("properties"):
+        declaration["parameters"] = parameters
+    return declaration
+
+
+def completion_chunk(completion: ChatCompletion) -> ChatCompletionChunk:
+    """応答全体を、ストリーミングの1つの断片にする（ストリーミングしないプロバイダー用）."""
+    choice = completion.choices[0]
+    delta: Dict[str, Any] = {"role": "assistant", "content": choice.message.content}
+    if choice.message.tool_calls:
+        delta["tool_calls"] = [
+            {"index": index, **call.model_dump()}
+            for index, call in enumerate(choice.message.tool_calls)
+        ]
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": completion.id,
+            "object": "chat.completion.chunk",
+            "created": completion.created,
+            "model": completion.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": choice.finish_reason}],
+            "usage": completion.usage.model_dump() if completion.usage else None,
+        }
+    )
+
+
+async def _prepend(first: Any, rest: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """受け取り済みの最初の断片と、残りの断片をつないだストリーム."""
+    try:
+        yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        await rest.aclose()
+
+
+async def _empty() -> AsyncIterator[Any]:
+    """断片の無いストリーム."""
+    for chunk in ():
+        yield chunk
+
+
+def _as_dict(message: Any) -> Dict[str, Any]:
+    """会話のメッセージ（dictかpydanticのモデル）をdictにする."""
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    return message
+
+
+class Provider(ABC):
+    """Chat Completions APIの形式のリクエストを受けて、ChatCompletionを返すLLMのプロバイダー.
+
+    クライアントの会話は OpenAI の形式のまま持ち、プロバイダーごとの違いは
+    complete の中で変換する.
+    """
+
+    name = "provider"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def key(self) -> str:
+        """ルーターが統計を分ける単位（プロバイダー名とモデル名）."""
+        return f"{self.name}:{self.model}"
+
+    @abstractmethod
+    async def complete(self, request: Dict[str, Any]) -> ChatCompletion:
+        """リクエストを送り、応答を返す（リクエストの model はこのプロバイダーのモデルに置き換える）."""
+
+    async def stream(self, request: Dict[str, Any]) -> AsyncIterator[ChatCompletionChunk]:
+        """リクエストを送り、応答の断片を届いた順に返す.
+
+        既定では complete の応答全体を1つの断片として返す.
+        """
+        yield completion_chunk(await self.complete(request))
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """別のプロバイダーに送り直すべき一時的なエラー（429、5xx、接続の失敗）かどうか."""
+        return False
+
+    def is_rate_limited(self, error: BaseException) -> bool:
+        """レート制限のエラー（429）かどうか."""
+        return False
+
+
+class OpenAIProvider(Provider):
+    """OpenAIのChat Completions API."""
+
+    name = "openai"
+
+    def __init__(self, model: str = "gpt-4.1-nano", client: Optional[AsyncOpenAI] = None):
+        """プロバイダーを初期化する.
+
+        Args:
+            model: 使用するOpenAIモデル.
+            client: 使用するクライアント（Noneの場合は環境変数の設定で作る）.
+        """
+        super().__init__(model)
+        # 失敗したらSDKで再試行せず、ルーターが別のプロバイダーに切り替える
+        self.client = (client or AsyncOpenAI()).with_options(max_retries=0)
+
+    async def complete(self, request: Dict[str, Any]) -> ChatCompletion:
+        return await self.client.chat.completions.create(**{**request, "model": self.model})
+
+    async def stream(self, request: Dict[str, Any]) -> AsyncIterator[ChatCompletionChunk]:
+        response = await self.client.chat.completions.create(
+            **{**request, "model": self.model, "stream": True}
+        )
+        async with response:
+            async for chunk in response:
+                yield chunk
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return isinstance(error, (APIConnectionError, RateLimitError, InternalServerError))
+
+    def is_rate_limited(self, error: BaseException) -> bool:
+        return isinstance(error, RateLimitError)
+
+
+class GeminiProvider(Provider):
+    """Geminiの関数呼び出し（google.generativeai の非同期API）."""
+
+    name = "gemini"
+
+    def __init__(self, model: str = "gemini-2.5-flash", api_key: Optional[str] = None):
+        """プロバイダーを初期化する.
+
+        Args:
+            model: 使用するGeminiモデル.
+            api_key: APIキー（Noneの場合は環境変数 GIMINI_API_KEY）.
+        """
+        super().__init__(model)
+        genai.configure(api_key=api_key or os.getenv("GIMINI_API_KEY"))
+
+    async def complete(self, request: Dict[str, Any]) -> ChatCompletion:
+        system, contents = self._to_contents(request["messages"])
+        kwargs: Dict[str, Any] = {}
+        if request.get("tools"):
+            kwargs["tools"] = [
+                {
+                    "function_declarations": [
+                        to_gemini_declaration(
+                            tool["function"]["name"],
+                            tool["function"].get("description"),
+                            tool["function"].get("parameters") or {},
+                        )
+                        for tool in request["tools"]
+                    ]
+                }
+            ]
+            mode = _GEMINI_TOOL_MODES.get(request.get("tool_choice") or "auto", "AUTO")
+            kwargs["tool_config"] = {"function_calling_config": {"mode": mode}}
+
+        model = genai.GenerativeModel(self.model, system_instruction=system or None)
+        response = await model.generate_content_async(contents, **kwargs)
+        return self._to_completion(response)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return isinstance(error, _GEMINI_RETRYABLE)
+
+    def is_rate_limited(self, error: BaseException) -> bool:
+        return isinstance(error, _GEMINI_RATE_LIMITED)
+
+    @staticmethod
+    def _to_contents(messages: Sequence[Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """OpenAIの形式の会話を、Geminiのシステム指示とcontentsに変換する."""
+        system: List[str] = []
+        contents: List[Dict[str, Any]] = []
+        # tool_call_id → ツール名（Geminiの function_response は名前で対応づける）
+        names: Dict[str, str] = {}
+        previous_role = None
+        for message in map(_as_dict, messages):
+            role = message["role"]
+            if role == "system":
+                system.append(message["content"])
+            elif role == "tool":
+                part = {
+                    "function_response": {
+                        "name": names.get(message["tool_call_id"], ""),
+                        "response": {"result": message["content"]},
+                    }
+                }
+                # 1つの応答のツール呼び出しの結果は、1つのcontentにまとめる
+                if previous_role == "tool":
+                    contents[-1]["parts"].append(part)
+                else:
+                    contents.append({"role": "user", "parts": [part]})
+            elif role == "assistant":
+                parts: List[Any] = [message["content"]] if message.get("content") else []
+                for call in message.get("tool_calls") or []:
+                    names[call["id"]] = call["function"]["name"]
+                    parts.append(
+                        {
+                            "function_call": {
+                                "name": call["function"]["name"],
+                                "args": json.loads(call["function"]["arguments"] or "{}"),
+                            }
+                        }
+                    )
+                if parts:
+                    contents.append({"role": "model", "parts": parts})
+            else:
+                contents.append({"role": "user", "parts": [message["content"]]})
+            previous_role = role
+        return "\n\n".join(system), contents
+
+    def _to_completion(self, response: Any) -> ChatCompletion:
+        """Geminiの応答を、OpenAIのChatCompletionに変換する."""
+        parts = response.candidates[0].content.parts
+        text = "".join(part.text for part in parts if "text" in part)
+        tool_calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {
+                    "name": part.function_call.name,
+                    "arguments": json.dumps(
+                        type(part.function_call).to_dict(part.function_call).get("args", {}),
+                        ensure_ascii=False,
+                    ),
+                },
+            }
+            for part in parts
+            if "function_call" in part
+        ]
+        message: Dict[str, Any] = {"role": "assistant", "content": text or None}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        usage = response.usage_metadata
+        return ChatCompletion.model_validate(
+            {
+                "id": f"gemini-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": self.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if tool_calls else "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": usage.prompt_token_count,
+                    "completion_tokens": usage.candidates_token_count,
+                    "total_tokens": usage.total_token_count,
+                },
+            }
+        )
+
+
+class _Backend:
+    """1つのプロバイダーの直近の遅延と成否、回路の状態."""
+
+    def __init__(self, provider: Provider, window: int):
+        self.provider = provider
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.consecutive_failures = 0
+        self.stats = {"requests": 0, "errors": 0, "trips": 0}
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def latency(self, q: float) -> float:
+        return percentile(sorted(self.latencies), q)
+
+
+class LLMRouter:
+    """複数のプロバイダーのうち、健全で最も速いものにリクエストを送るルーター.
+
+    プロバイダーとモデルごとに直近の遅延と失敗率を記録し、遅延の中央値が小さい順に送る.
+    一時的なエラーやタイムアウトで失敗したら、次に速いプロバイダーに送り直す.
+    失敗が続く（連続 failure_threshold 回か、失敗率が max_error_rate 以上）と回路を開いて
+    cooldown 秒の間は送らず、その後に1件だけ試して成功したら戻す.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[Provider],
+        window: int = 50,
+        failure_threshold: int = 5,
+        max_error_rate: float = 0.5,
+        min_samples: int = 10,
+        cooldown: float = 30.0,
+        timeout: Optional[float] = None,
+    ):
+        """ルーターを初期化する.
+
+        Args:
+            providers: 使用するプロバイダー（同じ遅延なら先に指定したものを使う）.
+            window: 遅延と失敗率の計算に使う直近のリクエスト数.
+            failure_threshold: 回路を開く連続の失敗回数.
+            max_error_rate: 回路を開く直近の失敗率.
+            min_samples: 失敗率で回路を開くのに必要な直近のリクエスト数.
+            cooldown: 回路を開いてから、試しに送るまでの秒数.
+            timeout: 1回のリクエストのタイムアウト秒数（超えたら次のプロバイダーに送る. Noneは無制限）.
+        """
+        if not providers:
+            raise ValueError("プロバイダーを1つ以上指定してください")
+        self.backends = [_Backend(provider, window) for provider in providers]
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.timeout = timeout
+
+    def _candidates(self) -> List[_Backend]:
+        """送る順に並べたプロバイダー（回路が開いているものを除く）."""
+        now = time.monotonic()
+        ready = []
+        for backend in self.backends:
+            if backend.state == OPEN and now - backend.opened_at >= self.cooldown:
+                backend.state = HALF_OPEN
+            if backend.state == OPEN or (backend.state == HALF_OPEN and backend.probing):
+                continue
+            ready.append(backend)
+        if not ready:
+            # すべての回路が開いている場合は、最も早く開いたものから試す
+            return sorted(self.backends, key=lambda b: b.opened_at)
+        # まだ遅延の記録がないプロバイダーは、遅延0として先に試す
+        return sorted(ready, key=lambda b: b.latency(0.5))
+
+    async def complete(self, request: Dict[str, Any]) -> ChatCompletion:
+        """最も速い健全なプロバイダーにリクエストを送り、失敗したら次のプロバイダーに送る.
+
+        Args:
+            request: chat.completions.create に渡す引数.
+
+        Returns:
+            いずれかのプロバイダーの応答.
+
+        Raises:
+            Exception: 送り直せないエラーか、すべてのプロバイダーが失敗した場合の最後のエラー.
+        """
+        last_error: Optional[BaseException] = None
+        for backend in self._candidates():
+            probe = backend.state == HALF_OPEN
+            if probe:
+                backend.probing = True
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(backend.provider.complete(request), self.timeout)
+            except Exception as e:
+                if not isinstance(e, asyncio.TimeoutError) and not backend.provider.is_retryable(e):
+                    # リクエスト自体の誤りは、プロバイダーの健全さとは関係がない
+                    raise
+                self._record(backend, time.perf_counter() - start, e)
+                last_error = e
+                continue
+            finally:
+                # ヘッジや持ち時間でキャンセルされた場合も、次のリクエストで試せるようにする
+                if probe:
+                    backend.probing = False
+            self._record(backend, time.perf_counter() - start)
+            return response
+        raise last_error
+
+    async def stream(self, request: Dict[str, Any]) -> AsyncIterator[ChatCompletionChunk]:
+        """complete のストリーミング版. 最初の断片が届くまでを1回のリクエストとして扱う.
+
+        最初の断片が届くまでの時間を遅延として記録し、それまでに一時的なエラーか
+        タイムアウトで失敗したら次のプロバイダーに送る. 最初の断片が届いた後の失敗は
+        送り直さない（回答の一部を返した後なので）.
+
+        Args:
+            request: chat.completions.create に渡す引数（stream は指定しない）.
+
+        Returns:
+            最初の断片を受け取り済みの、応答の断片のストリーム.
+
+        Raises:
+            Exception: 送り直せないエラーか、すべてのプロバイダーが失敗した場合の最後のエラー.
+        """
+        last_error: Optional[BaseException] = None
+        for backend in self._candidates():
+            probe = backend.state == HALF_OPEN
+            if probe:
+                backend.probing = True
+            start = time.perf_counter()
+            chunks = backend.provider.stream(request)
+            try:
+                first = await asyncio.wait_for(anext(chunks, None), self.timeout)
+            except BaseException as e:
+                await chunks.aclose()
+                if not isinstance(e, Exception) or (
+                    not isinstance(e, asyncio.TimeoutError) and not backend.provider.is_retryable(e)
+                ):
+                    raise
+                self._record(backend, time.perf_counter() - start, e)
+                last_error = e
+                continue
+            finally:
+                if probe:
+                    backend.probing = False
+            self._record(backend, time.perf_counter() - start)
+            return _empty() if first is None else _prepend(first, chunks)
+        raise last_error
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """いずれかのプロバイダーの一時的なエラー（やり直せば成功する見込みがある）かどうか."""
+        return any(backend.provider.is_retryable(error) for backend in self.backends)
+
+    def is_rate_limited(self, error: BaseException) -> bool:
+        """いずれかのプロバイダーのレート制限のエラーかどうか."""
+        return any(backend.provider.is_rate_limited(error) for backend in self.backends)
+
+    def _record(self, backend: _Backend, seconds: float, error: Optional[BaseException] = None) -> None:
+        backend.stats["requests"] += 1
+        if error is None:
+            backend.latencies.append(seconds)
+            backend.outcomes.append(True)
+            backend.consecutive_failures = 0
+            if backend.state == HALF_OPEN:
+                # 試しのリクエストが成功したので、以前の失敗は忘れて戻す
+                backend.state = CLOSED
+                backend.outcomes.clear()
+            return
+
+        backend.outcomes.append(False)
+        backend.consecutive_failures += 1
+        backend.stats["errors"] += 1
+        if (
+            backend.state == HALF_OPEN
+            or backend.consecutive_failures >= self.failure_threshold
+            or (
+                len(backend.outcomes) >= self.min_samples
+                and backend.error_rate() >= self.max_error_rate
+            )
+        ):
+            if backend.state != OPEN:
+                backend.stats["trips"] += 1
+            backend.state = OPEN
+            backend.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """プロバイダーとモデルごとの回路の状態、リクエスト数、失敗率、遅延（p50・p95）を返す."""
+        return {
+            backend.provider.key: {
+                **backend.stats,
+                "state": backend.state,
+                "error_rate": backend.error_rate(),
+                "latency_p50": backend.latency(0.5),
+                "latency_p95": backend.latency(0.95),
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import sys
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .kbpage import TOKEN_MODEL, count_tokens, get_encoding
+
+# メッセージ1つあたりの、本文以外（役割や区切り）のトークン数の目安
+_MESSAGE_OVERHEAD = 4
+
+# 要約を更新する関数: (これまでの要約, 新しく押し出された会話) -> 新しい要約
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+
+class ConversationMemory:
+    """トークン数の上限つきの会話の記憶.
+
+    直近の会話は上限のトークン数までそのまま保持し、押し出された古い会話は
+    要約に少しずつ書き足していく（要約を毎回作り直すことはしない）.
+    そのため、会話がどれだけ長く続いても、毎回のプロンプトに足される量は
+    max_tokens + summary_tokens 程度に収まる.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        summary_tokens: int = 300,
+        model: str = TOKEN_MODEL,
+    ):
+        """記憶を初期化する.
+
+        Args:
+            max_tokens: そのまま保持する直近の会話のトークン数の上限.
+            summary_tokens: 要約のトークン数の上限.
+            model: トークン数を数えるモデル名.
+        """
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.summary = ""
+        # (ユーザーとアシスタントのメッセージ, トークン数) の直近の会話
+        self.turns: deque = deque()
+        self._turn_tokens = 0
+        # 押し出されたが、まだ要約に書き足していない会話
+        self._evicted: List[Dict[str, str]] = []
+        self._compaction: Optional[asyncio.Task] = None
+        self.stats = {"turns": 0, "evicted_turns": 0, "summary_updates": 0}
+
+    async def messages(self) -> List[Dict[str, str]]:
+        """次のクエリの前に置くメッセージ（要約と直近の会話）を返す.
+
+        要約の更新が進行中であれば、終わるのを待つ.
+        """
+        if self._compaction is not None:
+            await self._compaction
+        messages: List[Dict[str, str]] = []
+        if self.summary:
+            messages.append(
+                {"role": "system", "content": f"これまでの会話の要約:\n{self.summary}"}
+            )
+        for turn, _ in self.turns:
+            messages.extend(turn)
+        return messages
+
+    def add_turn(self, query: str, answer: str, summarize: Summarizer) -> None:
+        """1往復の会話を記憶し、上限を超えた古い会話を要約に回す.
+
+        要約の更新はバックグラウンドで行い、次の messages で待つ.
+
+        Args:
+            query: ユーザーの入力.
+            answer: アシスタントの回答.
+            summarize: 要約を更新する関数.
+        """
+        turn = [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": answer or ""},
+        ]
+        tokens = sum(count_tokens(m["content"], self.model) + _MESSAGE_OVERHEAD for m in turn)
+        self.turns.append((turn, tokens))
+        self._turn_tokens += tokens
+        self.stats["turns"] += 1
+
+        while self.turns and self._turn_tokens > self.max_tokens:
+            old_turn, old_tokens = self.turns.popleft()
+            self._turn_tokens -= old_tokens
+            self._evicted.extend(old_turn)
+            self.stats["evicted_turns"] += 1
+
+        if self._evicted and (self._compaction is None or self._compaction.done()):
+            self._compaction = asyncio.create_task(self._compact(summarize))
+
+    async def _compact(self, summarize: Summarizer) -> None:
+        # 更新中に押し出された会話も、続けて書き足す
+        while self._evicted:
+            evicted, self._evicted = self._evicted, []
+            try:
+                summary = await summarize(self.summary, evicted)
+            except Exception as e:
+                # 失敗した分は次の会話の時に改めて要約する
+                self._evicted = evicted + self._evicted
+                print(f"会話の要約に失敗しました: {e}", file=sys.stderr)
+                return
+            encoding = get_encoding(self.model)
+            self.summary = encoding.decode(encoding.encode(summary)[: self.summary_tokens])
+            self.stats["summary_updates"] += 1
+
+    def tokens(self) -> int:
+        """次のクエリの前に置く、要約と直近の会話のトークン数を返す."""
+        return self._turn_tokens + (
+            count_tokens(self.summary, self.model) + _MESSAGE_OVERHEAD if self.summary else 0
+        )
@@ -0,0 +1,157 @@
+import functools
+import inspect
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from mcp.types import ToolAnnotations
+
+
+def canonical_arguments(arguments: Optional[Dict[str, Any]]) -> str:
+    """ツールの引数をキーの順序によらない文字列にする."""
+    return json.dumps(arguments or {}, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+class TTLCache:
+    """有効期間つきのLRUキャッシュ."""
+
+    def __init__(self, max_entries: int = 128, ttl: Optional[float] = None):
+        """キャッシュを初期化する.
+
+        Args:
+            max_entries: 保持する結果の最大数.
+            ttl: 結果の有効期間の秒数（Noneは無期限）.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """キーに対応する値を返す.
+
+        Returns:
+            (見つかったかどうか, 値).
+        """
+        item = self._items.get(key)
+        if item is not None and (self.ttl is None or time.monotonic() - item[0] <= self.ttl):
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+        if item is not None:
+            del self._items[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key: str, value: Any) -> None:
+        """値を保存し、上限を超えたら最も古く使われたものを消す."""
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+
+def pure_tool(mcp: Any, ttl: Optional[float] = None, max_entries: int = 128) -> Callable:
+    """同じ引数なら常に同じ結果を返す（副作用の無い）ツールとして登録するデコレータ.
+
+    サーバー側で結果をメモ化し、ツールの annotations に pure、cacheTtl、cacheMaxEntries を
+    載せて、クライアントも同じ呼び出しを省略できるようにする.
+
+    Args:
+        mcp: ツールを登録するFastMCPサーバー.
+        ttl: 結果の有効期間の秒数（Noneは無期限）.
+        max_entries: メモ化する結果の最大数.
+
+    Returns:
+        関数をツールとして登録するデコレータ.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        cache = TTLCache(max_entries, ttl)
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def wrapper(**kwargs):
+                key = canonical_arguments(kwargs)
+                found, value = cache.get(key)
+                if not found:
+                    value = await fn(**kwargs)
+                    cache.put(key, value)
+                return value
+
+        else:
+
+            @functools.wraps(fn)
+            def wrapper(**kwargs):
+                key = canonical_arguments(kwargs)
+                found, value = cache.get(key)
+                if not found:
+                    value = fn(**kwargs)
+                    cache.put(key, value)
+                return value
+
+        annotations = ToolAnnotations(
+            readOnlyHint=True,
+            idempotentHint=True,
+            pure=True,
+            cacheTtl=ttl,
+            cacheMaxEntries=max_entries,
+        )
+        mcp.tool(annotations=annotations)(wrapper)
+        return wrapper
+
+    return decorator
+
+
+class ToolResultCache:
+    """サーバーが pure と宣言したツールの結果を、クライアント側で保持するキャッシュ."""
+
+    def __init__(self):
+        self._caches: Dict[str, TTLCache] = {}
+
+    def update_policies(self, tools: Iterable[Any]) -> None:
+        """ツール一覧の annotations から、キャッシュしてよいツールと上限を読み取る.
+
+        Args:
+            tools: list_tools で取得したMCPのツール.
+        """
+        caches = {}
+        for tool in tools:
+            extra = (tool.annotations.model_extra or {}) if tool.annotations else {}
+            if not extra.get("pure"):
+                continue
+            max_entries = extra.get("cacheMaxEntries") or 128
+            ttl = extra.get("cacheTtl")
+            cache = self._caches.get(tool.name)
+            if cache is None or (cache.max_entries, cache.ttl) != (max_entries, ttl):
+                cache = TTLCache(max_entries, ttl)
+            caches[tool.name] = cache
+        self._caches = caches
+
+    def clear(self) -> None:
+        """すべての結果とポリシーを捨てる（再接続時など）."""
+        self._caches = {}
+
+    def get(self, name: str, arguments: Optional[Dict[str, Any]]) -> Optional[str]:
+        """保存されたツールの結果を返す（キャッシュしないツールや未保存ならNone）."""
+        cache = self._caches.get(name)
+        if cache is None:
+            return None
+        found, value = cache.get(canonical_arguments(arguments))
+        return value if found else None
+
+    def put(self, name: str, arguments: Optional[Dict[str, Any]], text: str) -> None:
+        """ツールの結果を保存する（キャッシュしないツールなら何もしない）."""
+        cache = self._caches.get(name)
+        if cache is not None:
+            cache.put(canonical_arguments(arguments), text)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ツールごとのヒット数、ミス数、保存されている結果の数を返す."""
+        return {
+            name: {"hits": cache.hits, "misses": cache.misses, "entries": len(cache._items)}
+            for name, cache in self._caches.items()
+        }
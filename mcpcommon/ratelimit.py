@@ -0,0 +1,165 @@
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, Optional
+
+from .kbpage import count_tokens
+
+
+def estimate_tokens(request: Dict[str, Any], completion_tokens: int = 256) -> int:
+    """Chat Completionsのリクエストが消費するトークン数を、送る前に見積もる.
+
+    Args:
+        request: chat.completions.create に渡す引数.
+        completion_tokens: 応答のトークン数の見積もり.
+
+    Returns:
+        メッセージとツール定義のトークン数に、応答の見積もりを足した値.
+    """
+    payload = json.dumps(
+        {"messages": request.get("messages"), "tools": request.get("tools")},
+        default=lambda value: value.model_dump(exclude_none=True),
+        ensure_ascii=False,
+    )
+    return count_tokens(payload, request.get("model") or "gpt-4.1-nano") + completion_tokens
+
+
+class TokenBucket:
+    """1分あたりの量で補充されるトークン・バケツ."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, scale: float) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.capacity / 60 * scale
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        """amount を取り出せるようになるまでの秒数を返す（0なら今すぐ取り出せる）."""
+        self._refill(scale)
+        # バケツより大きい要求は、満杯になれば通す
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / (self.capacity * scale)
+
+    def take(self, amount: float) -> None:
+        """amount を取り出す（実際の消費量との差の精算では負になることもある）."""
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """RPM（1分あたりのリクエスト数）とTPM（1分あたりのトークン数）の両方を守るスケジューラ.
+
+    429が返ってきたら Retry-After の間すべてのリクエストを止め、補充の速さを半分にする.
+    その後は成功するたびに少しずつ元の速さに戻す.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        completion_tokens: int = 256,
+        max_retries: int = 6,
+        min_scale: float = 0.1,
+    ):
+        """スケジューラを初期化する.
+
+        Args:
+            rpm: 1分あたりのリクエスト数の上限（Noneは無制限）.
+            tpm: 1分あたりのトークン数の上限（Noneは無制限）.
+            completion_tokens: 1回の応答のトークン数の見積もり.
+            max_retries: 429などで失敗したリクエストをやり直す最大回数.
+            min_scale: 429を受けた時に下げる補充の速さの下限（元の速さに対する比）.
+        """
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.completion_tokens = completion_tokens
+        self.max_retries = max_retries
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._stats = {"requests": 0, "tokens": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    async def acquire(self, tokens: int) -> None:
+        """リクエスト1回と tokens トークン分の枠が空くまで待ち、枠を取る.
+
+        待っているリクエストは到着順に通す.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, self.scale))
+                if self.tokens is not None:
+                    wait = max(wait, self.tokens.wait_time(tokens, self.scale))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        self._stats["requests"] += 1
+        self._stats["tokens"] += tokens
+        self._stats["wait_seconds"] += time.monotonic() - start
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """見積もりと実際に使ったトークン数の差をバケツに戻す（または追加で取る）."""
+        if actual is None:
+            return
+        if self.tokens is not None:
+            self.tokens.take(actual - estimated)
+        self._stats["tokens"] += actual - estimated
+        # 成功したので、補充の速さを少しずつ元に戻す
+        self.scale = min(1.0, self.scale + 0.05)
+
+    def on_rate_limited(self, retry_after: Optional[float], attempt: int) -> float:
+        """429を受けた時に呼ぶ. すべてのリクエストを止める秒数を決めて返す.
+
+        Args:
+            retry_after: レスポンスの Retry-After の秒数（無ければNone）.
+            attempt: 何回目のやり直しか（0から）.
+
+        Returns:
+            次に送るまで待つ秒数.
+        """
+        delay = retry_after if retry_after is not None else min(60.0, 2**attempt)
+        delay *= random.uniform(1.0, 1.25)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.scale = max(self.min_scale, self.scale / 2)
+        self._stats["rate_limited"] += 1
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        """通したリクエスト数とトークン数、429の回数、待った時間、現在の速さの比を返す."""
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["scale"] = self.scale
+        return stats
+
+
+def retry_after_seconds(error: Any) -> Optional[float]:
+    """OpenAIのエラーのレスポンス・ヘッダーから、やり直すまでの秒数を取り出す."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
@@ -0,0 +1,446 @@
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlparse
+
+import anyio
+from mcp import ClientSession, StdioServerParameters, types
+from mcp.client.sse import sse_client
+from mcp.client.stdio import get_default_environment, stdio_client
+from mcp.shared.exceptions import McpError
+
+from .tracing import percentile
+
+# 送信の時点で接続が切れていた（リクエストはサーバーに届いていない）ことを表す例外
+_SEND_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)
+
+# 待ち時間の分布を計算するために保持する件数
+_WAIT_SAMPLES = 1000
+
+# 接続先: stdioで起動するサーバーのパラメータか、SSEサーバーのURL
+ServerSpec = Union[StdioServerParameters, str]
+
+# stdioで起動するサーバーに引き継ぐ環境変数の接頭辞（KBの設定やトレースの出力先）
+_FORWARDED_ENV_PREFIXES = ("KB_", "MCP_")
+
+
+def open_transport(server: ServerSpec) -> Any:
+    """サーバーへのトランスポート（読み込みと書き込みのストリーム）を開く."""
+    if isinstance(server, str):
+        return sse_client(server)
+    return stdio_client(server)
+
+
+def resolve_server(spec: Union[str, StdioServerParameters]) -> Tuple[str, ServerSpec]:
+    """サーバーの指定から、ツール名の接頭辞に使うラベルと接続先を決める.
+
+    Args:
+        spec: サーバースクリプトのパス、SSEサーバーのURL（http:// または https://）、
+            またはStdioServerParameters.
+
+    Returns:
+        (ラベル, 接続先). ラベルはスクリプトのディレクトリ名（server.py の場合）か
+        ファイル名、またはURLのホスト名とポート.
+    """
+    if isinstance(spec, str) and spec.startswith(("http://", "https://")):
+        label, server = urlparse(spec).netloc, spec
+    else:
+        if isinstance(spec, str):
+            env = get_default_environment()
+            env.update(
+                (key, value)
+                for key, value in os.environ.items()
+                if key.startswith(_FORWARDED_ENV_PREFIXES)
+            )
+            spec = StdioServerParameters(command="python", args=[spec], env=env)
+        script = os.path.abspath(spec.args[-1]) if spec.args else spec.command
+        stem = os.path.splitext(os.path.basename(script))[0]
+        label = os.path.basename(os.path.dirname(script)) if stem == "server" else stem
+        server = spec
+    # OpenAIのツール名に使える文字（英数字、_、-）だけにする
+    return re.sub(r"[^A-Za-z0-9_-]", "_", label), server
+
+
+def _is_connection_error(e: BaseException) -> bool:
+    """サーバー・プロセスとの接続が切れたことを表す例外かどうか."""
+    if isinstance(e, McpError):
+        return e.error.code == types.CONNECTION_CLOSED
+    return isinstance(e, _SEND_ERRORS)
+
+
+class _Worker:
+    """1つのサーバー・プロセスとそのセッション."""
+
+    def __init__(
+        self,
+        server_params: ServerSpec,
+        message_handler: Optional[Callable[[Any], Awaitable[None]]],
+    ):
+        self.server_params = server_params
+        self.message_handler = message_handler
+        self.session: Optional[ClientSession] = None
+        self.healthy = False
+        self._read: Any = None
+        self.idle_since = time.monotonic()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """サーバー・プロセスを起動し、セッションを初期化する."""
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(ready))
+        await ready
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        # トランスポートと ClientSession は開いたタスクと同じタスクで閉じる必要があるため、
+        # プロセスごとに専用のタスクで持ち続ける
+        try:
+            async with open_transport(self.server_params) as (read, write):
+                async with ClientSession(
+                    read, write, message_handler=self.message_handler
+                ) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._read = read
+                    self.healthy = True
+                    ready.set_result(None)
+                    await self._stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            self.healthy = False
+            if not ready.done():
+                ready.cancel()
+
+    @property
+    def alive(self) -> bool:
+        """セッションが使える状態かどうか.
+
+        呼び出しが失敗する前にプロセスが終了した（接続が切れた）場合も、
+        サーバーからの読み込みストリームの送信側が閉じるので False になる.
+        """
+        return (
+            self.healthy
+            and self._read is not None
+            and self._read.statistics().open_send_streams > 0
+        )
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """セッションを閉じ、サーバー・プロセスを終了させる."""
+        self.healthy = False
+        self._stop.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+
+
+class MCPSessionPool:
+    """複数のMCPサーバー・プロセス（または接続）のセッションを、ツール呼び出しごとに貸し出すプール.
+
+    プロセス数は min_size から max_size の間で、待ちが出れば増やし、
+    アイドルが続けば減らす. 定期的にアイドルのセッションへpingを送り、
+    応答しないものやプロセスが落ちたものは作り直す.
+    """
+
+    def __init__(
+        self,
+        server_params: ServerSpec,
+        min_size: int = 1,
+        max_size: Optional[int] = None,
+        message_handler: Optional[Callable[[Any], Awaitable[None]]] = None,
+        health_interval: float = 30.0,
+        ping_timeout: float = 5.0,
+        idle_timeout: float = 60.0,
+    ):
+        """プールを初期化する（プロセスは start で起動する）.
+
+        Args:
+            server_params: サーバー・プロセスの起動パラメータ、またはSSEサーバーのURL.
+            min_size: 常に起動しておくプロセス数.
+            max_size: プロセス数の上限（Noneの場合は min_size で固定）.
+            message_handler: 各セッションに渡す、サーバーからのメッセージのハンドラ.
+            health_interval: ヘルス・チェックの間隔の秒数.
+            ping_timeout: pingの応答を待つ秒数.
+            idle_timeout: min_size を超えたプロセスを止めるまでのアイドル時間の秒数.
+        """
+        self.server_params = server_params
+        self.min_size = max(1, min_size)
+        self.max_size = max(max_size or self.min_size, self.min_size)
+        self.message_handler = message_handler
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.idle_timeout = idle_timeout
+
+        self._workers: List[_Worker] = []
+        self._idle: List[_Worker] = []
+        self._starting = 0
+        self._cond = asyncio.Condition()
+        self._closed = False
+        self._health_task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self._waits: deque = deque(maxlen=_WAIT_SAMPLES)
+        self._stats = {
+            "leases": 0,
+            "waited": 0,
+            "wait_seconds": 0.0,
+            "restarts": 0,
+            "scale_ups": 0,
+            "scale_downs": 0,
+            "failed_health_checks": 0,
+        }
+
+    async def start(self) -> None:
+        """min_size 個のサーバー・プロセスを並行に起動し、ヘルス・チェックを始める."""
+        workers = await asyncio.gather(*(self._spawn() for _ in range(self.min_size)))
+        async with self._cond:
+            self._idle.extend(workers)
+            self._cond.notify(len(workers))
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _spawn(self) -> _Worker:
+        worker = _Worker(self.server_params, self.message_handler)
+        await worker.start()
+        async with self._cond:
+            self._workers.append(worker)
+        return worker
+
+    async def _acquire(self) -> _Worker:
+        start = time.monotonic()
+        worker = None
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("セッション・プールは閉じられています")
+                if self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive:
+                        break
+                    # アイドルの間にプロセスが落ちていたら、作り直して次を探す
+                    self._run_in_background(self._replace(worker))
+                    worker = None
+                    continue
+                if len(self._workers) + self._starting < self.max_size:
+                    # 空きが無く上限にも達していないので、プロセスを増やす
+                    self._starting += 1
+                    break
+                await self._cond.wait()
+
+        if worker is None:
+            try:
+                worker = await self._spawn()
+                self._stats["scale_ups"] += 1
+            finally:
+                async with self._cond:
+                    self._starting -= 1
+                    self._cond.notify()
+
+        wait = time.monotonic() - start
+        self._waits.append(wait)
+        self._stats["leases"] += 1
+        self._stats["wait_seconds"] += wait
+        if wait > 0.001:
+            self._stats["waited"] += 1
+        return worker
+
+    async def _release(self, worker: _Worker, broken: bool) -> None:
+        if broken or not worker.alive:
+            # 落ちたプロセスは呼び出し元を待たせずに作り直す
+            self._run_in_background(self._replace(worker))
+            return
+        worker.idle_since = time.monotonic()
+        async with self._cond:
+            if worker in self._workers:
+                self._idle.append(worker)
+                self._cond.notify()
+
+    def _run_in_background(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _replace(self, worker: _Worker) -> None:
+        async with self._cond:
+            if worker not in self._workers:
+                return
+            self._workers.remove(worker)
+            self._starting += 1
+        await worker.close()
+        try:
+            if not self._closed:
+                new_worker = await self._spawn()
+                self._stats["restarts"] += 1
+                async with self._cond:
+                    self._idle.append(new_worker)
+        except Exception:
+            # 起動に失敗しても、次の貸し出しで改めてプロセスを増やす
+            pass
+        finally:
+            async with self._cond:
+                self._starting -= 1
+                self._cond.notify()
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[ClientSession]:
+        """セッションを1つ借りる. 空きが無ければ、プロセスを増やすか返却を待つ.
+
+        Yields:
+            借りたセッション（ブロックを抜けるとプールに返る）.
+        """
+        worker = await self._acquire()
+        broken = False
+        try:
+            yield worker.session
+        except BaseException as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            await self._release(worker, broken)
+
+    async def call_tool(
+        self,
+        name: str,
+        arguments: Optional[Dict[str, Any]] = None,
+        read_timeout_seconds: Optional[timedelta] = None,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> types.CallToolResult:
+        """セッションを借りてツールを呼び出す.
+
+        送信前に接続が切れていた場合は、リクエストがサーバーに届いていないので
+        別のセッションで一度だけやり直す.
+
+        Args:
+            name: ツール名.
+            arguments: ツールの引数.
+            read_timeout_seconds: 応答を待つ時間.
+            meta: リクエストの _meta に載せる値（トレースの traceparent など）.
+
+        Raises:
+            McpError: ツールの呼び出しに失敗した場合（接続が切れた場合を含む）.
+        """
+        for attempt in range(2):
+            try:
+                async with self.lease() as session:
+                    if meta is None:
+                        return await session.call_tool(
+                            name, arguments=arguments, read_timeout_seconds=read_timeout_seconds
+                        )
+                    # ClientSession.call_tool は _meta を渡せないため、リクエストを組み立てて送る
+                    request = types.CallToolRequest(
+                        method="tools/call",
+                        params=types.CallToolRequestParams(
+                            name=name, arguments=arguments, _meta=meta
+                        ),
+                    )
+                    return await session.send_request(
+                        types.ClientRequest(request),
+                        types.CallToolResult,
+                        request_read_timeout_seconds=read_timeout_seconds,
+                    )
+            except _SEND_ERRORS:
+                if attempt:
+                    raise McpError(
+                        types.ErrorData(
+                            code=types.CONNECTION_CLOSED,
+                            message="サーバー・プロセスとの接続が切れました",
+                        )
+                    )
+
+    async def list_tools(self) -> types.ListToolsResult:
+        """セッションを借りてツール一覧を取得する."""
+        async with self.lease() as session:
+            return await session.list_tools()
+
+    async def _ping(self, worker: _Worker) -> bool:
+        try:
+            await asyncio.wait_for(worker.session.send_ping(), self.ping_timeout)
+        except Exception:
+            return False
+        return worker.alive
+
+    async def check_health(self) -> None:
+        """アイドルのセッションにpingを送り、応答しないものを作り直し、余分なものを止める.
+
+        セッションは複数のリクエストを並行に扱えるので、ping中もアイドルのまま貸し出せる.
+        """
+        async with self._cond:
+            idle = list(self._idle)
+        results = await asyncio.gather(*(self._ping(worker) for worker in idle))
+
+        now = time.monotonic()
+        for worker, ok in zip(idle, results):
+            if not ok:
+                self._stats["failed_health_checks"] += 1
+                # 貸し出し中なら、返却の時点で作り直される
+                worker.healthy = False
+                async with self._cond:
+                    if worker in self._idle:
+                        self._idle.remove(worker)
+                        self._run_in_background(self._replace(worker))
+                continue
+            async with self._cond:
+                # ping中に貸し出されたものや、最近使われたものは止めない
+                if (
+                    worker not in self._idle
+                    or len(self._workers) <= self.min_size
+                    or now - worker.idle_since <= self.idle_timeout
+                ):
+                    continue
+                self._idle.remove(worker)
+                self._workers.remove(worker)
+            self._stats["scale_downs"] += 1
+            await worker.close()
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    @property
+    def alive(self) -> bool:
+        """プールが閉じられておらず、使えるか起動中のセッションがあるかどうか."""
+        return not self._closed and (
+            any(worker.alive for worker in self._workers) or self._starting > 0
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """プロセス数、貸し出し数、待ち時間などのメトリクスを返す.
+
+        Returns:
+            プロセス数（size、idle、in_use）、累計の回数と、
+            直近の貸し出しの待ち時間の平均・p50・p95・最大（秒）.
+        """
+        waits = sorted(self._waits)
+        stats: Dict[str, Any] = dict(self._stats)
+        stats.update(
+            size=len(self._workers),
+            idle=len(self._idle),
+            in_use=len(self._workers) - len(self._idle),
+            wait_avg=sum(waits) / len(waits) if waits else 0.0,
+            wait_p50=percentile(waits, 0.5),
+            wait_p95=percentile(waits, 0.95),
+            wait_max=waits[-1] if waits else 0.0,
+        )
+        return stats
+
+    async def close(self) -> None:
+        """ヘルス・チェックを止め、すべてのサーバー・プロセスを終了させる."""
+        self._closed = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for task in list(self._background):
+            task.cancel()
+        async with self._cond:
+            workers = list(self._workers)
+            self._workers.clear()
+            self._idle.clear()
+            self._cond.notify_all()
+        await asyncio.gather(*(worker.close() for worker in workers), return_exceptions=True)
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .faq import FaqIndex
+from .kbstore import KnowledgeBaseStore
+from .puretool import canonical_arguments
+
+# 予測したツールの引数の中で、ユーザーのクエリに置き換える値
+QUERY_PLACEHOLDER = "{query}"
+
+# (ツール名, 引数) の呼び出し
+ToolCall = Tuple[str, Dict[str, Any]]
+
+
+def _fill(value: Any, query: str) -> Any:
+    """引数のテンプレートの QUERY_PLACEHOLDER をクエリで置き換える."""
+    if value == QUERY_PLACEHOLDER:
+        return query
+    if isinstance(value, dict):
+        return {k: _fill(v, query) for k, v in value.items()}
+    return value
+
+
+def _template(value: Any, query: str) -> Any:
+    """実際の引数のうち、クエリと同じ文字列を QUERY_PLACEHOLDER にする."""
+    if value == query:
+        return QUERY_PLACEHOLDER
+    if isinstance(value, dict):
+        return {k: _template(v, query) for k, v in value.items()}
+    return value
+
+
+class ToolPredictor:
+    """KBの質問との文字n-gramの類似度から、モデルが最初に呼ぶツールを予測する.
+
+    KBの質問に似たクエリには、これまでKBの質問らしいクエリでモデルが最も多く呼んだ
+    ツールと引数（まだ無ければ default）を予測する. 引数がクエリそのものだった場合は
+    テンプレートとして覚え、次のクエリで置き換える.
+    """
+
+    def __init__(
+        self,
+        kb_path: str,
+        threshold: float = 0.3,
+        default: ToolCall = ("get_knowledge_base", {}),
+    ):
+        """予測器を初期化する.
+
+        Args:
+            kb_path: サーバーと同じ kb.json へのパス.
+            threshold: KBの質問らしいとみなす類似度（文字n-gramのDice係数）の下限.
+            default: まだ学習していない時に予測するツールと引数.
+        """
+        self.store = KnowledgeBaseStore(kb_path)
+        self.threshold = threshold
+        self.default = default
+        # (ツール名, 引数のテンプレート) → KBの質問らしいクエリでモデルが呼んだ回数
+        self.calls: Counter = Counter()
+        self._stats = {"queries": 0, "predictions": 0, "hits": 0, "misses": 0, "skipped": 0}
+
+    def is_kb_query(self, query: str) -> bool:
+        """クエリがKBのいずれかの質問に十分似ているかどうか."""
+        try:
+            # KBのバージョンが変わるとインデックスは作り直される
+            index = self.store.derived("faq", FaqIndex)
+        except (OSError, ValueError):
+            return False
+        hit = index.lookup(query)
+        return hit is not None and hit[1] >= self.threshold
+
+    def predict(self, query: str, allowed: Iterable[str]) -> Optional[ToolCall]:
+        """クエリに対してモデルが最初に呼びそうなツールと引数を返す.
+
+        Args:
+            query: ユーザークエリ.
+            allowed: 先に実行してよいツール名（副作用が無く、今回のリクエストに含めるもの）.
+
+        Returns:
+            (ツール名, 引数). KBの質問らしくないか、予測したツールを実行できなければNone.
+        """
+        self._stats["queries"] += 1
+        if not self.is_kb_query(query):
+            return None
+
+        if self.calls:
+            (name, template), _ = self.calls.most_common(1)[0]
+            arguments = _fill(json.loads(template), query)
+        else:
+            name, arguments = self.default
+        if name not in set(allowed):
+            self._stats["skipped"] += 1
+            return None
+        self._stats["predictions"] += 1
+        return name, arguments
+
+    def record(self, query: str, prediction: Optional[ToolCall], calls: List[ToolCall]) -> bool:
+        """モデルが実際に呼んだツールを記録し、予測が当たったかどうかを返す.
+
+        Args:
+            query: ユーザークエリ.
+            prediction: predict の結果（Noneの場合は学習だけする）.
+            calls: モデルが最初の応答で呼んだツールと引数.
+
+        Returns:
+            予測と同じツールと引数の呼び出しがあったかどうか.
+        """
+        # KBの質問らしいクエリで呼ばれたツールだけを学習する
+        if not self.is_kb_query(query):
+            return False
+        for name, arguments in calls:
+            self.calls[(name, canonical_arguments(_template(arguments, query)))] += 1
+        if prediction is None:
+            return False
+        key = (prediction[0], canonical_arguments(prediction[1]))
+        hit = any((name, canonical_arguments(arguments)) == key for name, arguments in calls)
+        self._stats["hits" if hit else "misses"] += 1
+        return hit
+
+    def stats(self) -> Dict[str, Any]:
+        """クエリ数、予測した回数、当たった回数と割合、外れた回数を返す."""
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["hit_rate"] = self._stats["hits"] / max(1, self._stats["predictions"])
+        return stats
+
+
+class Prefetch:
+    """予測したツール呼び出しを、最初の応答と並行に先に実行したもの."""
+
+    def __init__(self, prediction: ToolCall, task: asyncio.Task):
+        self.prediction = prediction
+        self.task = task
+        self.claimed = False
+
+    def claim(self, name: str, arguments: Dict[str, Any]) -> bool:
+        """モデルの呼び出しが予測と同じなら、先に実行した結果を使う（1回だけ）."""
+        if self.claimed or name != self.prediction[0]:
+            return False
+        if canonical_arguments(arguments) != canonical_arguments(self.prediction[1]):
+            return False
+        self.claimed = True
+        return True
+
+    async def discard(self) -> None:
+        """使わなかった結果を捨てる（まだ実行中なら止め、終わるのを待つ）."""
+        if self.claimed:
+            return
+        self.task.cancel()
+        # 止めたタスクの例外（キャンセルやツールの失敗）は使わないので読み捨てる
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await self.task
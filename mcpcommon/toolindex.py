@@ -0,0 +1,101 @@
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from .kbpage import count_tokens
+from .kbsearch import BM25Index
+
+
+def tool_text(tool: Dict[str, Any]) -> str:
+    """ツールの説明と引数の名前・説明を、検索の対象にするテキストにまとめる."""
+    function = tool["function"]
+    lines = [function.get("description") or ""]
+    for name, schema in ((function.get("parameters") or {}).get("properties") or {}).items():
+        lines.append(f"{name} {schema.get('description', '')}")
+    return "\n".join(lines)
+
+
+class ToolIndex:
+    """ツールの名前と説明に対するBM25の索引. クエリごとに送るツールを選ぶ.
+
+    ツール一覧が変わった時に一度だけ索引を作り、クエリごとに関連する上位k個と
+    固定（pinned）のツールだけを選ぶ. そのため、ツールの数が増えても
+    プロンプトに載せるスキーマの量は一定に収まる.
+    """
+
+    def __init__(self, pinned: Iterable[str] = ()):
+        """索引を初期化する.
+
+        Args:
+            pinned: クエリに関係なく常に送るツール名（サーバーが annotations の
+                pinned で指定したツールも常に送る）.
+        """
+        self.pinned = set(pinned)
+        self.tools: List[Dict[str, Any]] = []
+        self._marked: set = set()
+        self._index: Optional[BM25Index] = None
+        self._tokens: List[int] = []
+        # ツール名 → モデルが呼び出した回数（クエリに一致するツールが足りない時に使う）
+        self.uses: Counter = Counter()
+        self._stats = {"selections": 0, "pruned": 0, "catalog_tokens": 0, "sent_tokens": 0}
+
+    def update(self, tools: List[Dict[str, Any]], pinned: Iterable[str] = ()) -> None:
+        """ツール一覧が変わった時に索引を作り直す.
+
+        Args:
+            tools: OpenAI形式のツールのリスト.
+            pinned: サーバーが pinned と指定したツール名.
+        """
+        self.tools = tools
+        self._marked = set(pinned)
+        self._index = BM25Index(
+            [{"question": tool["function"]["name"], "answer": tool_text(tool)} for tool in tools]
+        )
+        self._tokens = [count_tokens(json.dumps(tool, ensure_ascii=False)) for tool in tools]
+
+    def record_use(self, name: str) -> None:
+        """モデルがツールを呼び出したことを記録する."""
+        self.uses[name] += 1
+
+    def select(self, query: str, k: Optional[int]) -> List[Dict[str, Any]]:
+        """クエリに関連する上位k個のツールと、固定のツールを返す.
+
+        クエリに一致するツールがk個に満たない場合は、よく呼び出されるツールで補う.
+
+        Args:
+            query: ユーザーのクエリ.
+            k: 固定のツール以外に選ぶツールの数（Noneはすべてのツール）.
+
+        Returns:
+            選んだツール（元の一覧の順）.
+        """
+        pinned = {
+            i for i, tool in enumerate(self.tools)
+            if tool["function"]["name"] in self.pinned | self._marked
+        }
+        if k is None or len(self.tools) <= k + len(pinned):
+            chosen = set(range(len(self.tools)))
+        else:
+            ranked = [i for i, _ in self._index.search(query, len(self.tools))]
+            popular = sorted(
+                range(len(self.tools)), key=lambda i: -self.uses[self.tools[i]["function"]["name"]]
+            )
+            chosen = set(pinned)
+            for i in ranked + popular:
+                if len(chosen) >= k + len(pinned):
+                    break
+                chosen.add(i)
+
+        self._stats["selections"] += 1
+        self._stats["pruned"] += len(self.tools) - len(chosen)
+        self._stats["catalog_tokens"] += sum(self._tokens)
+        self._stats["sent_tokens"] += sum(self._tokens[i] for i in chosen)
+        return [self.tools[i] for i in sorted(chosen)]
+
+    def stats(self) -> Dict[str, Any]:
+        """選んだ回数、省いたツールの数、全ツールと送ったツールのスキーマのトークン数（平均）を返す."""
+        stats: Dict[str, Any] = dict(self._stats)
+        selections = max(1, self._stats["selections"])
+        stats["catalog_tokens_avg"] = self._stats["catalog_tokens"] / selections
+        stats["sent_tokens_avg"] = self._stats["sent_tokens"] / selections
+        return stats
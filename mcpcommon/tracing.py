@@ -0,0 +1,300 @@
+import argparse
+import contextvars
+import json
+import secrets
+import threading
+import time
+import weakref
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# フェーズごとに、パーセンタイルの計算に使う直近の件数
+MAX_SAMPLES = 1000
+
+# Prometheusのテキストで出力するパーセンタイル
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 親スパンの (trace_id, span_id)
+SpanContext = Tuple[str, str]
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+# ポート → そのポートの /metrics に出力するエンドポイント（プロセスで1つずつ）
+_endpoints: Dict[int, "_MetricsEndpoint"] = {}
+_endpoints_lock = threading.Lock()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """ソート済みのリストのq分位数（0〜1）を返す."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """W3C Trace Context の traceparent ヘッダーの値から (trace_id, span_id) を取り出す."""
+    if not value:
+        return None
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class Span:
+    """1つのフェーズの処理時間."""
+
+    def __init__(
+        self,
+        name: str,
+        service: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    @property
+    def context(self) -> SpanContext:
+        return self.trace_id, self.span_id
+
+    def traceparent(self) -> str:
+        """他のプロセスに渡す traceparent の値を返す."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.service,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def prometheus_text(durations: Dict[Tuple[str, str], Iterable[float]]) -> str:
+    """フェーズごとの処理時間を、Prometheusのsummary形式のテキストにする.
+
+    Args:
+        durations: (サービス名, フェーズ名) → 処理時間の秒数.
+
+    Returns:
+        p50/p95/p99 と合計、件数を含むテキスト.
+    """
+    lines = [
+        "# HELP mcp_span_duration_seconds Duration of traced request phases.",
+        "# TYPE mcp_span_duration_seconds summary",
+    ]
+    for (service, name), values in sorted(durations.items()):
+        values = sorted(values)
+        labels = f'service="{service}",phase="{name}"'
+        for q in QUANTILES:
+            lines.append(
+                f'mcp_span_duration_seconds{{{labels},quantile="{q}"}} {percentile(values, q):.6f}'
+            )
+        lines.append(f"mcp_span_duration_seconds_sum{{{labels}}} {sum(values):.6f}")
+        lines.append(f"mcp_span_duration_seconds_count{{{labels}}} {len(values)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsEndpoint:
+    """/metrics で、登録されたすべてのトレーサーのスパンをまとめて返すHTTPサーバー."""
+
+    def __init__(self, port: int, host: str):
+        # 閉じずに捨てられたトレーサーは、参照が無くなった時点で外れる
+        self.tracers: "weakref.WeakSet[Tracer]" = weakref.WeakSet()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = endpoint.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+
+    def prometheus_text(self) -> str:
+        durations: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        for tracer in list(self.tracers):
+            for key, values in tracer.durations().items():
+                durations[key].extend(values)
+        return prometheus_text(durations)
+
+
+class Tracer:
+    """フェーズごとのスパンを記録し、JSONLファイルとPrometheus形式のテキストに出力するトレーサー."""
+
+    def __init__(
+        self,
+        service: str,
+        jsonl_path: Optional[str] = None,
+        metrics_port: Optional[int] = None,
+    ):
+        """トレーサーを初期化する.
+
+        Args:
+            service: スパンに記録するサービス名（client、kb-serverなど）.
+            jsonl_path: スパンを1行ずつ追記するJSONLファイルへのパス（Noneは書き出さない）.
+            metrics_port: 指定した場合、このポートの /metrics でPrometheus形式のテキストを返す.
+                同じポートを指定したトレーサーは、プロセスで1つのエンドポイントを共有する.
+        """
+        self.service = service
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], deque] = defaultdict(
+            lambda: deque(maxlen=MAX_SAMPLES)
+        )
+        self._endpoint: Optional[_MetricsEndpoint] = None
+        if metrics_port:
+            self.serve_metrics(metrics_port)
+
+    def start_span(
+        self, name: str, parent: Union[Span, SpanContext, None] = None, **attributes: Any
+    ) -> Span:
+        """スパンを始める（現在のスパンは変えない）. end_span で終える.
+
+        Args:
+            name: フェーズ名.
+            parent: 親スパンか、traceparent から取り出した (trace_id, span_id).
+                Noneの場合は現在のスパンを親にする.
+            attributes: スパンに記録する属性.
+        """
+        if parent is None:
+            parent = _current_span.get()
+        if isinstance(parent, Span):
+            parent = parent.context
+        trace_id, parent_id = parent if parent else (secrets.token_hex(16), None)
+        return Span(name, self.service, trace_id, parent_id, attributes)
+
+    def end_span(self, span: Span, error: Optional[BaseException] = None) -> None:
+        """スパンを終え、処理時間を記録して書き出す."""
+        span.duration = time.perf_counter() - span._start
+        if error is not None:
+            span.status = "error"
+            span.attributes["error"] = f"{type(error).__name__}: {error}"
+        with self._lock:
+            self._samples[(span.service, span.name)].append(span.duration)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    @contextmanager
+    def span(
+        self, name: str, parent: Union[Span, SpanContext, None] = None, **attributes: Any
+    ) -> Iterator[Span]:
+        """ブロックをスパンで囲む. ブロックの中で始めたスパンはこのスパンの子になる.
+
+        Args:
+            name: フェーズ名.
+            parent: 親スパン（start_span と同じ）.
+            attributes: スパンに記録する属性.
+
+        Yields:
+            始めたスパン.
+        """
+        span = self.start_span(name, parent, **attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span, error)
+
+    def durations(self) -> Dict[Tuple[str, str], List[float]]:
+        """(サービス名, フェーズ名) ごとの直近の処理時間を返す."""
+        with self._lock:
+            return {key: list(values) for key, values in self._samples.items()}
+
+    def prometheus_text(self) -> str:
+        """直近のスパンから計算した、フェーズごとのp50/p95/p99をPrometheus形式で返す."""
+        return prometheus_text(self.durations())
+
+    def serve_metrics(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """/metrics でPrometheus形式のテキストを返すHTTPサーバーに、このトレーサーを登録する.
+
+        サーバーはポートごとにプロセスで1つだけ別スレッドで起動し、登録されたすべての
+        トレーサーのスパンをまとめて返す（再接続でクライアントを作り直してもポートは重ならない）.
+        """
+        with _endpoints_lock:
+            endpoint = _endpoints.get(port)
+            if endpoint is None:
+                endpoint = _endpoints[port] = _MetricsEndpoint(port, host)
+            endpoint.tracers.add(self)
+        self._endpoint = endpoint
+        return endpoint.server
+
+    def close(self) -> None:
+        """/metrics のエンドポイントからこのトレーサーを外す（エンドポイントは開いたままにする）."""
+        if self._endpoint is not None:
+            with _endpoints_lock:
+                self._endpoint.tracers.discard(self)
+            self._endpoint = None
+
+
+def instrument_server(mcp: Any, tracer: Tracer) -> None:
+    """FastMCPサーバーのツールの実行をスパンで囲む.
+
+    クライアントがリクエストの _meta に載せた traceparent を親にするため、
+    クライアントとサーバーのスパンは1つのトレースにつながる.
+
+    Args:
+        mcp: FastMCPサーバー.
+        tracer: スパンを記録するトレーサー.
+    """
+    lowlevel = mcp._mcp_server
+
+    async def call_tool(name: str, arguments: Dict[str, Any]) -> Any:
+        meta = lowlevel.request_context.meta
+        traceparent = (meta.model_extra or {}).get("traceparent") if meta else None
+        with tracer.span("tool.execute", parent=parse_traceparent(traceparent), tool=name):
+            return await mcp.call_tool(name, arguments)
+
+    lowlevel.call_tool()(call_tool)
+
+
+def main():
+    """JSONLファイルのスパンを集計し、Prometheus形式で出力するコマンドのメイン・エントリー・ポイント."""
+    parser = argparse.ArgumentParser(description="トレースのJSONLファイルをフェーズごとに集計する")
+    parser.add_argument("jsonl", help="MCP_TRACE_FILE に指定したファイル")
+    args = parser.parse_args()
+
+    durations: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    with open(args.jsonl, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                durations[(span["service"], span["name"])].append(span["duration"])
+    print(prometheus_text(durations), end="")
+
+
+if __name__ == "__main__":
+    main()
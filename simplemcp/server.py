@@ -1,8 +1,13 @@
 
 # uv add dotenv mcp 
+import os
+
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 
+from mcpcommon.puretool import pure_tool
+from mcpcommon.tracing import Tracer, instrument_server
+
 # CMCPサーバーの作成
 mcp = FastMCP(
     name="Calculator",
@@ -10,27 +15,30 @@ mcp = FastMCP(
     port=8050,  # only used for SSE transport (set this to any port)
 )
 
+# ツールの実行時間を記録し、リクエストの _meta の traceparent でクライアントのトレースにつなげる
+instrument_server(mcp, Tracer("calculator", jsonl_path=os.getenv("MCP_TRACE_FILE")))
+
 # シンプルなツールadd 
-@mcp.tool()
+@pure_tool(mcp)
 def add(a: int, b: int) -> int:
     """2つの数字を足す"""
     return a + b
 
 # シンプルなツールmul
-@mcp.tool()
+@pure_tool(mcp)
 def mul(c: int, d: int) ->int:
     "2つの数字を掛け合わせる"
     return c*d
 
 # シンプルなツールcat 
-@mcp.tool()
+@pure_tool(mcp)
 def cat(familyname: str, surname: str) ->str:
     "2つの文字列を連結する"
     return f"{surname} {familyname}"
  
 # Run the server
 if __name__ == "__main__":
-    transport = "studio"
+    transport = "stdio"
     if transport == "stdio":
         print("stdioトランスポートでサーバーを実行")
         mcp.run(transport="stdio")
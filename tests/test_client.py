@@ -0,0 +1,156 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import ErrorData
+from openai.types.chat import ChatCompletionMessageToolCall
+
+from mcpcommon.client import MCPOpenAIClient
+from mcpcommon.deadline import Deadline, DeadlineExceeded
+from mcpcommon.llmrouter import LLMRouter, Provider
+
+
+class Unavailable(Exception):
+    """プロバイダーの一時的なエラー."""
+
+
+class StreamingProvider(Provider):
+    """決めた順に失敗し、その後は断片を delay 秒おきに返すプロバイダー."""
+
+    name = "fake"
+
+    def __init__(self, chunks, failures=0, delay=0.0):
+        super().__init__("model")
+        self.chunks = chunks
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+        self.closed = 0
+
+    async def complete(self, request):
+        raise NotImplementedError
+
+    async def stream(self, request):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise Unavailable()
+        try:
+            for chunk in self.chunks:
+                yield chunk
+                await asyncio.sleep(self.delay)
+        finally:
+            self.closed += 1
+
+    def is_retryable(self, error):
+        return isinstance(error, Unavailable)
+
+
+def make_client(provider):
+    return MCPOpenAIClient(router=LLMRouter([provider]), max_retries=2)
+
+
+async def collect(client, deadline=None):
+    return [chunk async for chunk in client._stream_completion({}, deadline)]
+
+
+def test_stream_is_retried_before_the_first_chunk(monkeypatch):
+    monkeypatch.setattr("mcpcommon.client.backoff_delay", lambda attempt: 0.0)
+    provider = StreamingProvider(["a", "b"], failures=1)
+    assert asyncio.run(collect(make_client(provider))) == ["a", "b"]
+    assert provider.calls == 2
+
+
+def test_stream_checks_the_deadline_between_chunks():
+    provider = StreamingProvider(["a", "b"], delay=1.0)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(collect(make_client(provider), Deadline(0.1)))
+    assert provider.closed == 1
+
+
+def test_first_span_ends_when_the_stream_fails():
+    client = make_client(StreamingProvider([], failures=1))
+    client.max_retries = 0
+
+    async def main():
+        async for _ in client.process_query_stream("hello"):
+            pass
+
+    with pytest.raises(Unavailable):
+        asyncio.run(main())
+    assert len(client.tracer.durations()[("client", "completion.first")]) == 1
+
+
+class FakePool:
+    """ツールごとに決めた秒数だけ待ってから答えるセッション・プール."""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = set(failing)
+        self.calls = []
+
+    async def call_tool(self, name, arguments, read_timeout_seconds=None, meta=None):
+        self.calls.append(name)
+        if name in self.failing:
+            raise RuntimeError("session closed")
+        delay = self.delays.get(name, 0.0)
+        if read_timeout_seconds is not None and delay > read_timeout_seconds.total_seconds():
+            await asyncio.sleep(read_timeout_seconds.total_seconds())
+            raise McpError(ErrorData(code=408, message="Timed out"))
+        await asyncio.sleep(delay)
+        return SimpleNamespace(content=[SimpleNamespace(text=f"{name}:{arguments}")], isError=False)
+
+
+def tool_call(index, name, arguments):
+    if not isinstance(arguments, str):
+        arguments = json.dumps(arguments)
+    return ChatCompletionMessageToolCall.model_validate(
+        {
+            "id": f"call_{index}",
+            "type": "function",
+            "function": {"name": name, "arguments": arguments},
+        }
+    )
+
+
+def make_tool_client(pool, **kwargs):
+    client = MCPOpenAIClient(router=LLMRouter([StreamingProvider([])]), **kwargs)
+    client._routes = {name: (pool, name) for name in ("slow", "fast", "broken", "hang")}
+    return client
+
+
+def test_call_tools_keeps_the_order_of_the_calls():
+    pool = FakePool({"slow": 0.1, "fast": 0.0})
+    client = make_tool_client(pool)
+    calls = [tool_call(0, "slow", {"q": 1}), tool_call(1, "fast", {"q": 2})]
+    messages = asyncio.run(client.call_tools(calls))
+    assert [m["tool_call_id"] for m in messages] == ["call_0", "call_1"]
+    assert messages[0]["content"] == "slow:{'q': 1}"
+    assert pool.calls == ["slow", "fast"]
+
+
+def test_call_tools_isolates_failures_and_timeouts():
+    pool = FakePool({"hang": 10.0}, failing={"broken"})
+    client = make_tool_client(pool, tool_timeout=0.05)
+    calls = [
+        tool_call(0, "broken", {}),
+        tool_call(1, "hang", {}),
+        tool_call(2, "fast", "{not json"),
+        tool_call(3, "missing", {}),
+        tool_call(4, "fast", {}),
+    ]
+    contents = [m["content"] for m in asyncio.run(client.call_tools(calls))]
+    assert "session closed" in contents[0]
+    assert "Timed out" in contents[1]
+    assert "JSON" in contents[2]
+    assert "missing" in contents[3]
+    assert contents[4] == "fast:{}"
+
+
+def test_call_tools_deadline_shortens_the_tool_timeout():
+    client = make_tool_client(FakePool({"hang": 10.0}), tool_timeout=30.0)
+    calls = [tool_call(0, "hang", {}), tool_call(1, "fast", {})]
+    contents = [m["content"] for m in asyncio.run(client.call_tools(calls, Deadline(0.05)))]
+    assert "Timed out" in contents[0]
+    assert contents[1] == "fast:{}"
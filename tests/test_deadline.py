@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from mcpcommon.deadline import Deadline, DeadlineExceeded, backoff_delay
+
+
+def test_unlimited_deadline():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert deadline.phase(0.5).remaining() is None
+    deadline.check()
+
+
+def test_phase_takes_a_share_of_the_remaining_time():
+    deadline = Deadline(10.0)
+    phase = deadline.phase(0.45)
+    assert 4.4 < phase.remaining() <= 4.5
+    assert deadline.phase(1.0).expires <= deadline.expires
+
+
+def test_expired_deadline_raises():
+    deadline = Deadline(expires=time.monotonic() - 1)
+    assert deadline.remaining() == 0.0
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+
+
+def test_wait_raises_when_the_deadline_passes():
+    async def main():
+        with pytest.raises(DeadlineExceeded):
+            await Deadline(0.01).wait(asyncio.sleep(1))
+        assert await Deadline(1.0).wait(asyncio.sleep(0, "done")) == "done"
+
+    asyncio.run(main())
+
+
+def test_wait_passes_through_inner_timeouts():
+    async def inner_timeout():
+        await asyncio.wait_for(asyncio.sleep(1), 0.01)
+
+    async def main():
+        with pytest.raises(TimeoutError) as excinfo:
+            await Deadline(1.0).wait(inner_timeout())
+        assert not isinstance(excinfo.value, DeadlineExceeded)
+        with pytest.raises(TimeoutError) as excinfo:
+            await Deadline().wait(inner_timeout())
+        assert not isinstance(excinfo.value, DeadlineExceeded)
+
+    asyncio.run(main())
+
+
+def test_wait_cancels_the_awaitable_when_the_deadline_passes():
+    async def main():
+        task = asyncio.ensure_future(asyncio.sleep(1))
+        with pytest.raises(DeadlineExceeded):
+            await Deadline(0.01).wait(task)
+        await asyncio.sleep(0)
+        assert task.cancelled()
+
+    asyncio.run(main())
+
+
+def test_backoff_delay_is_capped_and_jittered():
+    for attempt in range(10):
+        delay = backoff_delay(attempt, base=0.5, cap=4.0)
+        assert 0.5 * min(4.0, 0.5 * 2**attempt) <= delay <= 1.5 * min(4.0, 0.5 * 2**attempt)
+
+
+def test_limit_cancels_the_block_when_the_deadline_passes():
+    async def main():
+        async with Deadline(0.05).limit():
+            await asyncio.sleep(1.0)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+
+
+def test_limit_keeps_inner_timeouts():
+    async def main():
+        async with Deadline(10.0).limit():
+            raise asyncio.TimeoutError("tool timeout")
+
+    with pytest.raises(asyncio.TimeoutError, match="tool timeout") as info:
+        asyncio.run(main())
+    assert not isinstance(info.value, DeadlineExceeded)
@@ -0,0 +1,75 @@
+import json
+
+from mcpcommon.faq import (
+    FaqIndex,
+    FaqMatcher,
+    char_ngrams,
+    normalize_question,
+    question_terms,
+)
+
+ENTRIES = [
+    {"question": "What is the vacation policy?", "answer": "20 days."},
+    {"question": "How do I request a software license?", "answer": "File a ticket."},
+    {
+        "question": "What is the vacation policy for new employees in the first year?",
+        "answer": "10 days.",
+    },
+]
+
+
+def test_normalize_question_ignores_case_width_and_punctuation():
+    assert normalize_question("What is the ＶＰＮ?") == normalize_question("what is the vpn")
+
+
+def test_char_ngrams_of_short_text():
+    assert char_ngrams("ab") == {"ab"}
+    assert char_ngrams("") == set()
+    assert char_ngrams("abcd") == {"abc", "bcd"}
+
+
+def test_lookup_exact_and_near_duplicate():
+    index = FaqIndex(ENTRIES)
+    assert index.lookup("what is the vacation policy") == (0, 1.0)
+    idx, score = index.lookup("What's the vacation policy?")
+    assert idx == 0 and 0.8 < score < 1.0
+    assert index.lookup("How can I request a software license?")[0] == 1
+
+
+def test_lookup_unrelated_query():
+    assert FaqIndex(ENTRIES).lookup("こんにちは") is None
+
+
+def test_matcher_answers_only_above_threshold(tmp_path):
+    kb = tmp_path / "kb.json"
+    kb.write_text(json.dumps(ENTRIES), encoding="utf-8")
+    matcher = FaqMatcher(str(kb))
+    assert matcher.match("what is the vacation policy?") == "20 days."
+    assert matcher.match("Tell me about remote work") is None
+    assert matcher.stats == {"hits": 1, "misses": 1}
+
+
+def test_question_terms_ignore_wording_but_keep_negation():
+    assert question_terms("What's the vacation policy?") == question_terms(
+        "What is the vacation policy?"
+    )
+    assert question_terms("Isn't this the vacation policy?") == (
+        frozenset({"vacation", "policy"}),
+        True,
+    )
+    assert question_terms("休暇の方針はありませんか")[1]
+
+
+def test_matcher_rejects_similar_questions_with_another_intent(tmp_path):
+    kb = tmp_path / "kb.json"
+    kb.write_text(json.dumps(ENTRIES), encoding="utf-8")
+    matcher = FaqMatcher(str(kb))
+    # どれも文字n-gramの類似度はしきい値を超える
+    for query in [
+        "Isn't this the vacation policy for new employees in the first year?",
+        "What is not the vacation policy for new employees in the first year?",
+        "What is the vaccination policy for new employees in the first year?",
+    ]:
+        assert FaqIndex(ENTRIES).lookup(query)[1] >= matcher.threshold
+        assert matcher.match(query) is None
+    assert matcher.match("What's the vacation policy?") == "20 days."
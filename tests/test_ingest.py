@@ -0,0 +1,58 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mcpcommon import ingest
+
+
+def run_ingest(tmp_path, monkeypatch, convert):
+    # 変換はDoclingを使わず、同じプロセスのスレッドで行う
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(ingest, "_init_worker", lambda: None)
+    monkeypatch.setattr(ingest, "convert_document", convert)
+    kb = tmp_path / "kb.json"
+    summary = ingest.ingest(str(tmp_path / "docs"), str(kb), str(tmp_path / "cache"))
+    return summary, json.loads(kb.read_text(encoding="utf-8"))
+
+
+def convert(path, source):
+    with open(path, encoding="utf-8") as f:
+        return [{"question": source, "answer": f.read(), "source": source}]
+
+
+def fail(path, source):
+    raise ValueError("broken document")
+
+
+def test_failed_conversion_keeps_the_previous_entries(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.html").write_text("v1", encoding="utf-8")
+    (tmp_path / "kb.json").write_text(
+        json.dumps([{"question": "manual", "answer": "kept"}]), encoding="utf-8"
+    )
+    summary, entries = run_ingest(tmp_path, monkeypatch, convert)
+    assert summary["converted"] == 1
+    assert [entry["answer"] for entry in entries] == ["kept", "v1"]
+
+    (docs / "a.html").write_text("v2", encoding="utf-8")
+    (docs / "b.html").write_text("new", encoding="utf-8")
+    summary, entries = run_ingest(tmp_path, monkeypatch, fail)
+    assert summary["failed"] == 2
+    assert [entry["answer"] for entry in entries] == ["kept", "v1"]
+
+    # 変換できた時点で新しい内容に置き換わる
+    summary, entries = run_ingest(tmp_path, monkeypatch, convert)
+    assert summary["converted"] == 2
+    assert [entry["answer"] for entry in entries] == ["kept", "v2", "new"]
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path):
+    path = tmp_path / "kb.json"
+    path.write_text("[]", encoding="utf-8")
+    with pytest.raises(TypeError):
+        ingest._write_json_atomic(str(path), [object()])
+    assert path.read_text(encoding="utf-8") == "[]"
+    assert os.listdir(tmp_path) == ["kb.json"]
@@ -0,0 +1,60 @@
+import pytest
+
+from mcpcommon.kbpage import make_cursor, paginate, parse_cursor
+
+VERSION = "0123456789abcdef"
+
+
+def test_cursor_round_trip():
+    assert parse_cursor("", VERSION) == 0
+    assert parse_cursor(make_cursor(VERSION, 7), VERSION) == 7
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "0123456789ab.x", "ffffffffffff.3"])
+def test_invalid_or_stale_cursor(cursor):
+    with pytest.raises(ValueError):
+        parse_cursor(cursor, VERSION)
+
+
+def test_pages_cover_every_block_once():
+    blocks = [f"block {i}\n\n" for i in range(10)]
+    pages = []
+    cursor = ""
+    while True:
+        text, cursor = paginate("", blocks, [10] * len(blocks), 16 + 30, cursor, VERSION)
+        pages.append(text)
+        if not cursor:
+            break
+    assert len(pages) == 4
+    assert "[next_cursor:" in pages[0] and "[next_cursor:" not in pages[-1]
+    joined = "".join(pages)
+    assert all(joined.count(block) == 1 for block in blocks)
+
+
+def test_block_larger_than_budget_is_truncated():
+    blocks = ["x" * 400 + "\n\n", "small\n\n"]
+    text, cursor = paginate("", blocks, [100, 2], 16 + 5, "", VERSION)
+    assert text.startswith("x") and len(text) < 400
+    assert parse_cursor(cursor, VERSION) == 1
+
+
+def test_entry_blocks_are_formatted_on_access():
+    from mcpcommon.kbstore import EntryBlocks, entry_token_counts, format_entry
+
+    class Entries(list):
+        reads = 0
+
+        def __getitem__(self, i):
+            Entries.reads += 1
+            return super().__getitem__(i)
+
+    entries = Entries({"question": f"q{i}", "answer": "a" * 40} for i in range(100))
+    blocks = EntryBlocks(entries)
+    counts = entry_token_counts(entries, batch_size=7)
+    assert len(counts) == 100 and counts[5] == counts[6]
+
+    text, cursor = paginate("", blocks, counts, 16 + 3 * counts[0], "", VERSION)
+    # ページに載せる3件だけをフォーマットする
+    assert Entries.reads == 3
+    assert text.startswith(format_entry(1, entries[0]))
+    assert parse_cursor(cursor, VERSION) == 3
@@ -0,0 +1,35 @@
+from mcpcommon.kbsearch import BM25Index, tokenize
+
+ENTRIES = [
+    {"question": "What is the vacation policy?", "answer": "Employees get 20 days of paid vacation."},
+    {"question": "How do I request a software license?", "answer": "File a ticket with IT."},
+    {"question": "有給休暇は何日ですか？", "answer": "年間20日の有給休暇があります。"},
+]
+
+
+def test_tokenize_splits_japanese_into_bigrams():
+    assert tokenize("ＶＰＮ 有給休暇") == ["vpn", "有給", "給休", "休暇"]
+
+
+def test_search_ranks_matching_entry_first():
+    index = BM25Index(ENTRIES)
+    assert index.search("vacation policy")[0][0] == 0
+    assert index.search("software license", k=1) == [(1, index.search("software license")[0][1])]
+    assert index.search("休暇の日数")[0][0] == 2
+
+
+def test_search_without_matching_terms_is_empty():
+    index = BM25Index(ENTRIES)
+    assert index.search("kubernetes") == []
+    assert index.search("vacation", k=0) == []
+
+
+def test_rare_terms_weigh_more_than_common_ones():
+    entries = [
+        {"question": "policy", "answer": "policy vacation"},
+        {"question": "policy", "answer": "policy"},
+        {"question": "policy", "answer": "policy"},
+    ]
+    index = BM25Index(entries)
+    assert index.idf["vacation"] > index.idf["policy"]
+    assert index.search("policy vacation")[0][0] == 0
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from mcpcommon.kbbinary import KBIN_SUFFIX, BinaryKnowledgeBase
+from mcpcommon.kbstore import KnowledgeBaseStore
+
+ENTRIES = [{"question": f"質問{i}", "answer": f"回答{i}"} for i in range(50)]
+
+
+def write_kb(path, entries):
+    path.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+    # mtimeの分解能が粗いファイルシステムでも変更を検出させる
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + len(entries) + 1))
+
+
+def test_json_is_served_from_an_mmap_cache(tmp_path):
+    kb = tmp_path / "kb.json"
+    write_kb(kb, ENTRIES)
+    store = KnowledgeBaseStore(str(kb))
+    entries = store.entries()
+    assert isinstance(entries, BinaryKnowledgeBase)
+    assert list(entries) == ENTRIES
+    assert os.path.exists(str(kb) + KBIN_SUFFIX)
+    assert store.text().count("\nA") == len(ENTRIES)
+
+
+def test_cache_is_rebuilt_when_the_kb_changes(tmp_path):
+    kb = tmp_path / "kb.json"
+    write_kb(kb, ENTRIES)
+    store = KnowledgeBaseStore(str(kb))
+    version = store.version
+    write_kb(kb, ENTRIES[:3])
+    assert store.version != version
+    assert len(store.entries()) == 3
+    # 同じ内容の別のストア（別のプロセスなど）は作り直さずにキャッシュを使う
+    other = KnowledgeBaseStore(str(kb))
+    assert other.version == store.version and len(other.entries()) == 3
+
+
+def test_jsonl_kb(tmp_path):
+    kb = tmp_path / "kb.jsonl"
+    kb.write_text("\n".join(json.dumps(e) for e in ENTRIES[:5]), encoding="utf-8")
+    assert list(KnowledgeBaseStore(str(kb)).entries()) == ENTRIES[:5]
+
+
+def test_invalid_json_leaves_no_partial_cache(tmp_path):
+    kb = tmp_path / "kb.json"
+    kb.write_text('[{"question": "q", "answer": "a"}] trailing', encoding="utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        KnowledgeBaseStore(str(kb)).entries()
+    assert os.listdir(tmp_path) == ["kb.json"]
+
+
+def test_small_text_is_rendered_once_per_version(tmp_path):
+    kb = tmp_path / "kb.json"
+    write_kb(kb, ENTRIES)
+    store = KnowledgeBaseStore(str(kb))
+    assert store.text() is store.text()
+    write_kb(kb, ENTRIES[:3])
+    assert store.text().count("\nA") == 3
+
+
+def test_large_text_is_not_kept(tmp_path):
+    kb = tmp_path / "kb.json"
+    write_kb(kb, ENTRIES)
+    store = KnowledgeBaseStore(str(kb), max_cached_text=100)
+    text = store.text()
+    assert text == store.text() and text is not store.text()
@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+
+from mcpcommon.kbstream import iter_entries, iter_json_array, iter_jsonl, normalize_entry
+
+ITEMS = [{"question": "有給休暇は？", "answer": "20日"}, 12.5, "文字列", [1, 2], None, True, -3]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 16])
+def test_json_array_across_chunk_boundaries(chunk_size):
+    data = json.dumps(ITEMS, ensure_ascii=False, indent=2).encode("utf-8")
+    assert list(iter_json_array(io.BytesIO(data), chunk_size)) == ITEMS
+
+
+def test_empty_array():
+    assert list(iter_json_array(io.BytesIO(b"  [ ] "))) == []
+
+
+@pytest.mark.parametrize("data", [b"", b"{}", b"[1 2]", b"[1,", b'["a"'])
+def test_invalid_json_raises(data):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.BytesIO(data), chunk_size=2))
+
+
+def test_jsonl_skips_blank_lines():
+    data = b'{"question": "q1", "answer": "a1"}\n\n{"question": "q2", "answer": "a2"}\n'
+    assert [item["question"] for item in iter_jsonl(io.BytesIO(data))] == ["q1", "q2"]
+
+
+def test_normalize_entry():
+    assert normalize_entry(1, {"question": "q"}) == {"question": "q", "answer": "Unknown answer"}
+    assert normalize_entry(2, "text") == {"question": "Item 2", "answer": "text"}
+
+
+def test_iter_entries_reads_json_and_jsonl(tmp_path):
+    entries = [{"question": "q1", "answer": "a1"}, {"question": "q2", "answer": "a2"}]
+    kb_json = tmp_path / "kb.json"
+    kb_json.write_text(json.dumps(entries), encoding="utf-8")
+    kb_jsonl = tmp_path / "kb.jsonl"
+    kb_jsonl.write_text("\n".join(json.dumps(e) for e in entries), encoding="utf-8")
+    assert list(iter_entries(str(kb_json))) == entries
+    assert list(iter_entries(str(kb_jsonl))) == entries
+
+
+@pytest.mark.parametrize("data", [b"[1, 2] x", b"[] []", b'[{"question": "q"}]\n,'])
+def test_trailing_data_after_the_array_raises(data):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.BytesIO(data), chunk_size=3))
+
+
+def test_trailing_whitespace_is_allowed():
+    assert list(iter_json_array(io.BytesIO(b"[1, 2]\n  \n"), chunk_size=3)) == [1, 2]
@@ -0,0 +1,21 @@
+from mcpcommon.kbvector import HashingEmbedder, VectorIndex
+
+ENTRIES = [
+    {"question": "What is the vacation policy?", "answer": "20 days."},
+    {"question": "How do I request a software license?", "answer": "File a ticket."},
+]
+
+
+def test_search_before_sync_returns_nothing(tmp_path):
+    index = VectorIndex(str(tmp_path / "lancedb"), HashingEmbedder(dim=32))
+    assert index.search("vacation") == []
+
+
+def test_search_opens_a_table_synced_by_another_index(tmp_path):
+    db_path = str(tmp_path / "lancedb")
+    assert VectorIndex(db_path, HashingEmbedder(dim=32)).sync(ENTRIES) == {
+        "added": 2,
+        "deleted": 0,
+    }
+    results = VectorIndex(db_path, HashingEmbedder(dim=32)).search("vacation policy", k=1)
+    assert [result["answer"] for result in results] == ["20 days."]
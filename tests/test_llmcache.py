@@ -0,0 +1,98 @@
+import json
+import os
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+
+from mcpcommon import llmcache
+from mcpcommon.llmcache import CompletionCache
+
+
+class Clock:
+    """進め方をテストで決める time.time()."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 0.001
+        return self.now
+
+
+def completion(text):
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4.1-nano",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": text},
+                }
+            ],
+        }
+    )
+
+
+def make_cache(tmp_path, monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(llmcache, "time", SimpleNamespace(time=clock))
+    return CompletionCache(str(tmp_path / "cache.sqlite"), **kwargs), clock
+
+
+def test_expired_responses_are_not_returned(tmp_path, monkeypatch):
+    cache, clock = make_cache(tmp_path, monkeypatch, ttl=60)
+    cache.put("a", completion("hi"), 0.5)
+    assert cache.get("a").choices[0].message.content == "hi"
+    clock.now += 61
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_response_is_evicted(tmp_path, monkeypatch):
+    cache, _ = make_cache(tmp_path, monkeypatch, max_entries=2)
+    cache.put("a", completion("a"), 0.1)
+    cache.put("b", completion("b"), 0.1)
+    assert cache.get("a") is not None
+    cache.put("c", completion("c"), 0.1)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and abs(stats["saved_seconds"] - 0.3) < 1e-9
+
+
+def test_key_ignores_key_order_and_unrelated_arguments(tmp_path, monkeypatch):
+    cache, _ = make_cache(tmp_path, monkeypatch)
+    request = {
+        "model": "gpt-4.1-nano",
+        "messages": [
+            {"role": "user", "content": "hi"},
+            ChatCompletionMessage(role="assistant", content="hello"),
+        ],
+        "tool_choice": "auto",
+    }
+    reordered = {
+        "tool_choice": "auto",
+        "messages": [
+            {"content": "hi", "role": "user"},
+            {"content": "hello", "role": "assistant"},
+        ],
+        "model": "gpt-4.1-nano",
+        "stream": True,
+    }
+    assert cache.make_key(request) == cache.make_key(reordered)
+    assert cache.make_key(request) != cache.make_key({**request, "model": "gpt-4.1"})
+
+
+def test_key_changes_with_the_knowledge_base(tmp_path, monkeypatch):
+    kb = tmp_path / "kb.json"
+    kb.write_text(json.dumps([{"question": "q", "answer": "a"}]), encoding="utf-8")
+    cache, _ = make_cache(tmp_path, monkeypatch, kb_path=str(kb))
+    request = {"model": "gpt-4.1-nano", "messages": [{"role": "user", "content": "hi"}]}
+    key = cache.make_key(request)
+    kb.write_text(json.dumps([{"question": "q", "answer": "b"}]), encoding="utf-8")
+    os.utime(kb, ns=(0, os.stat(kb).st_mtime_ns + 1))
+    assert cache.make_key(request) != key
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+
+import pytest
+
+from mcpcommon.llmrouter import CLOSED, HALF_OPEN, OPEN, LLMRouter, Provider
+
+
+class Unavailable(Exception):
+    """プロバイダーの一時的なエラー."""
+
+
+class FakeProvider(Provider):
+    """決めた順に成功・失敗を返すプロバイダー."""
+
+    name = "fake"
+
+    def __init__(self, model, outcomes=(), delay=0.0):
+        super().__init__(model)
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return f"{self.model}:{outcome}"
+
+    def is_retryable(self, error):
+        return isinstance(error, Unavailable)
+
+
+class StreamingProvider(FakeProvider):
+    """応答を1文字ずつの断片で返すプロバイダー."""
+
+    async def stream(self, request):
+        for chunk in await self.complete(request):
+            yield chunk
+
+
+async def collect(stream):
+    return "".join([chunk async for chunk in await stream])
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fails_over_to_the_next_provider():
+    primary = FakeProvider("a", [Unavailable()])
+    router = LLMRouter([primary, FakeProvider("b")])
+    assert run(router.complete({})) == "b:ok"
+    assert router.stats()["fake:a"]["errors"] == 1
+
+
+def test_breaker_opens_after_consecutive_failures():
+    primary = FakeProvider("a", [Unavailable()] * 3)
+    router = LLMRouter([primary, FakeProvider("b")], failure_threshold=3, cooldown=60)
+    for _ in range(3):
+        run(router.complete({}))
+    assert router.backends[0].state == OPEN
+    run(router.complete({}))
+    # 回路が開いている間は送らない
+    assert primary.calls == 3
+
+
+def test_breaker_opens_on_error_rate():
+    primary = FakeProvider("a", [Unavailable(), "ok"] * 5)
+    router = LLMRouter([primary], failure_threshold=100, min_samples=4, max_error_rate=0.5)
+    for _ in range(4):
+        with contextlib.suppress(Unavailable):
+            run(router.complete({}))
+    assert router.backends[0].state == CLOSED
+    # 直近5件のうち3件が失敗
+    with pytest.raises(Unavailable):
+        run(router.complete({}))
+    assert router.backends[0].state == OPEN
+
+
+def test_half_open_probe_closes_or_reopens():
+    primary = FakeProvider("a", [Unavailable(), Unavailable()])
+    router = LLMRouter([primary, FakeProvider("b")], failure_threshold=1, cooldown=0)
+    run(router.complete({}))
+    assert router.backends[0].state == OPEN
+
+    # cooldown が過ぎたら1件だけ試し、失敗すればまた開く
+    assert router._candidates()[0].state == HALF_OPEN
+    run(router.complete({}))
+    assert router.backends[0].state == OPEN
+
+    assert run(router.complete({})) == "a:ok"
+    assert router.backends[0].state == CLOSED
+
+
+def test_non_retryable_error_is_raised_without_tripping():
+    router = LLMRouter([FakeProvider("a", [ValueError("bad request")]), FakeProvider("b")])
+    with pytest.raises(ValueError):
+        run(router.complete({}))
+    assert router.backends[0].stats["errors"] == 0
+
+
+def test_timeout_fails_over():
+    router = LLMRouter([FakeProvider("a", delay=1.0), FakeProvider("b")], timeout=0.01)
+    assert run(router.complete({})) == "b:ok"
+
+
+def test_prefers_the_faster_provider():
+    slow, fast = FakeProvider("slow", delay=0.02), FakeProvider("fast")
+    router = LLMRouter([slow, fast])
+    run(router.complete({}))
+    run(router.complete({}))
+    assert run(router.complete({})) == "fast:ok"
+
+
+def test_all_providers_failing_raises_the_last_error():
+    router = LLMRouter([FakeProvider("a", [Unavailable("a")]), FakeProvider("b", [Unavailable("b")])])
+    with pytest.raises(Unavailable, match="b"):
+        run(router.complete({}))
+
+
+def test_cancelled_probe_lets_the_next_request_probe_again():
+    primary = FakeProvider("a", [Unavailable()])
+    router = LLMRouter([primary, FakeProvider("b")], failure_threshold=1, cooldown=0)
+    run(router.complete({}))
+    primary.delay = 1.0
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(router.complete({}))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    run(cancel_probe())
+    assert router.backends[0].state == HALF_OPEN and not router.backends[0].probing
+    primary.delay = 0.0
+    assert run(router.complete({})) == "a:ok"
+    assert router.backends[0].state == CLOSED
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    router = LLMRouter([StreamingProvider("a", [Unavailable()]), StreamingProvider("b")])
+    assert run(collect(router.stream({}))) == "b:ok"
+    assert router.stats()["fake:a"]["errors"] == 1
+
+
+def test_stream_non_retryable_error_is_raised():
+    router = LLMRouter([StreamingProvider("a", [ValueError("bad request")]), StreamingProvider("b")])
+    with pytest.raises(ValueError):
+        run(collect(router.stream({})))
+
+
+def test_router_classifies_errors_by_its_providers():
+    router = LLMRouter([FakeProvider("a")])
+    assert router.is_retryable(Unavailable())
+    assert not router.is_retryable(ValueError())
+    assert not router.is_rate_limited(Unavailable())
+
+
+def test_provider_must_implement_complete():
+    with pytest.raises(TypeError):
+        Provider("model")
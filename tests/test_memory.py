@@ -0,0 +1,95 @@
+import asyncio
+
+from mcpcommon.memory import ConversationMemory
+
+
+class Summarizer:
+    """呼ばれた引数を記録し、要約にメッセージの本文を書き足す."""
+
+    def __init__(self, delay=0.0, fail=0):
+        self.calls = []
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, summary, messages):
+        self.calls.append((summary, [m["content"] for m in messages]))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("unavailable")
+        return " ".join([summary, *(m["content"] for m in messages)]).strip()
+
+
+def turn_tokens(query="q0", answer="a0"):
+    memory = ConversationMemory()
+
+    async def main():
+        memory.add_turn(query, answer, Summarizer())
+        return memory.tokens()
+
+    return asyncio.run(main())
+
+
+def test_old_turns_are_evicted_into_the_summary():
+    memory = ConversationMemory(max_tokens=2 * turn_tokens())
+    summarize = Summarizer()
+
+    async def main():
+        for i in range(4):
+            memory.add_turn(f"q{i}", f"a{i}", summarize)
+        return await memory.messages()
+
+    messages = asyncio.run(main())
+    assert [m["content"] for m in messages[1:]] == ["q2", "a2", "q3", "a3"]
+    assert messages[0]["role"] == "system" and "q0 a0 q1 a1" in messages[0]["content"]
+    # 続けて押し出された会話は、1回の更新でまとめて書き足す
+    assert memory.stats == {"turns": 4, "evicted_turns": 2, "summary_updates": 1}
+    assert memory.tokens() > 2 * turn_tokens()
+
+
+def test_summary_is_extended_not_rebuilt():
+    memory = ConversationMemory(max_tokens=turn_tokens())
+    summarize = Summarizer(delay=0.01)
+
+    async def main():
+        memory.add_turn("q0", "a0", summarize)
+        memory.add_turn("q1", "a1", summarize)
+        # 要約の更新を始めさせてから、続きの会話を加える
+        await asyncio.sleep(0)
+        memory.add_turn("q2", "a2", summarize)
+        memory.add_turn("q3", "a3", summarize)
+        await memory.messages()
+
+    asyncio.run(main())
+    # 要約の更新中に押し出された会話は、これまでの要約に続けて書き足す
+    assert summarize.calls == [("", ["q0", "a0"]), ("q0 a0", ["q1", "a1", "q2", "a2"])]
+    assert memory.summary == "q0 a0 q1 a1 q2 a2"
+
+
+def test_summary_is_cut_to_summary_tokens():
+    memory = ConversationMemory(max_tokens=0, summary_tokens=3)
+
+    async def main():
+        memory.add_turn("これは長い質問です " * 20, "長い回答 " * 20, Summarizer())
+        await memory.messages()
+
+    asyncio.run(main())
+    assert memory.summary
+    assert len(memory.summary) < len("これは長い質問です " * 20)
+
+
+def test_failed_summary_is_retried_with_the_next_turn():
+    memory = ConversationMemory(max_tokens=turn_tokens())
+    summarize = Summarizer(fail=1)
+
+    async def main():
+        memory.add_turn("q0", "a0", summarize)
+        memory.add_turn("q1", "a1", summarize)
+        await memory.messages()
+        assert memory.summary == ""
+        memory.add_turn("q2", "a2", summarize)
+        await memory.messages()
+
+    asyncio.run(main())
+    assert summarize.calls[-1] == ("", ["q0", "a0", "q1", "a1"])
+    assert memory.summary == "q0 a0 q1 a1"
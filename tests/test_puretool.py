@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+from mcp.server.fastmcp import FastMCP
+
+from mcpcommon import puretool
+from mcpcommon.puretool import TTLCache, ToolResultCache, canonical_arguments, pure_tool
+
+
+class Clock:
+    """進め方をテストで決める time.monotonic()."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(puretool, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_server(ttl=None):
+    mcp = FastMCP("test")
+    calls = []
+
+    @pure_tool(mcp, ttl=ttl, max_entries=2)
+    def lookup(query: str, k: int = 3) -> str:
+        calls.append((query, k))
+        return f"{query}:{k}"
+
+    @mcp.tool()
+    def now() -> str:
+        return "now"
+
+    return mcp, calls
+
+
+def test_canonical_arguments_ignore_key_order():
+    assert canonical_arguments({"b": 1, "a": "é"}) == canonical_arguments({"a": "é", "b": 1})
+    assert canonical_arguments(None) == canonical_arguments({}) == "{}"
+
+
+def test_pure_tool_memoizes_until_the_ttl(monkeypatch):
+    clock = use_clock(monkeypatch)
+    mcp, calls = make_server(ttl=10)
+
+    async def call(arguments):
+        return await mcp.call_tool("lookup", arguments)
+
+    asyncio.run(call({"query": "休暇", "k": 1}))
+    asyncio.run(call({"k": 1, "query": "休暇"}))
+    assert calls == [("休暇", 1)]
+    clock.now = 11
+    asyncio.run(call({"query": "休暇", "k": 1}))
+    assert len(calls) == 2
+
+
+def test_pure_tool_publishes_its_cache_policy():
+    mcp, _ = make_server(ttl=10)
+    tools = {tool.name: tool for tool in asyncio.run(mcp.list_tools())}
+    extra = tools["lookup"].annotations.model_extra
+    assert extra == {"pure": True, "cacheTtl": 10, "cacheMaxEntries": 2}
+    assert tools["lookup"].annotations.readOnlyHint
+    assert tools["now"].annotations is None
+
+
+def test_ttl_cache_evicts_the_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1) and cache.get("c") == (True, 3)
+
+
+def test_client_cache_follows_the_server_policy(monkeypatch):
+    clock = use_clock(monkeypatch)
+    mcp, _ = make_server(ttl=10)
+    tools = asyncio.run(mcp.list_tools())
+    cache = ToolResultCache()
+    cache.update_policies(tools)
+
+    cache.put("lookup", {"query": "q", "k": 1}, "result")
+    cache.put("now", {}, "now")
+    assert cache.get("lookup", {"k": 1, "query": "q"}) == "result"
+    # pure でないツールは保存しない
+    assert cache.get("now", {}) is None
+    clock.now = 11
+    assert cache.get("lookup", {"query": "q", "k": 1}) is None
+    assert cache.stats()["lookup"] == {"hits": 1, "misses": 1, "entries": 0}
+
+
+def test_unchanged_policy_keeps_the_results():
+    mcp, _ = make_server(ttl=10)
+    tools = asyncio.run(mcp.list_tools())
+    cache = ToolResultCache()
+    cache.update_policies(tools)
+    cache.put("lookup", {"query": "q"}, "result")
+    cache.update_policies(tools)
+    assert cache.get("lookup", {"query": "q"}) == "result"
+    cache.update_policies([tool for tool in tools if tool.name != "lookup"])
+    assert cache.get("lookup", {"query": "q"}) is None
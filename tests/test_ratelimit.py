@@ -0,0 +1,127 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from mcpcommon.client import MCPOpenAIClient
+from mcpcommon.llmrouter import LLMRouter, Provider
+from mcpcommon.ratelimit import RateLimiter, TokenBucket, retry_after_seconds
+
+
+class RateLimited(Exception):
+    """Retry-After つきの429."""
+
+    response = SimpleNamespace(headers={"retry-after-ms": "50"})
+
+
+class LimitedProvider(Provider):
+    """最初の limited 回は429を返すプロバイダー."""
+
+    name = "fake"
+
+    def __init__(self, limited):
+        super().__init__("model")
+        self.limited = limited
+        self.calls = 0
+
+    async def complete(self, request):
+        self.calls += 1
+        if self.calls <= self.limited:
+            raise RateLimited()
+        return SimpleNamespace(usage=None)
+
+    def is_retryable(self, error):
+        return isinstance(error, RateLimited)
+
+    def is_rate_limited(self, error):
+        return isinstance(error, RateLimited)
+
+
+def test_bucket_lets_an_oversized_request_through_when_full():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(100) == 0.0
+    bucket.take(60)
+    # 1秒に1トークン補充されるので、半分の速さなら2秒で1トークン
+    assert 0.9 < bucket.wait_time(1) <= 1.0
+    assert 1.9 < bucket.wait_time(1, scale=0.5) <= 2.0
+
+
+def test_waiting_requests_are_served_in_arrival_order():
+    limiter = RateLimiter(rpm=6000)
+    limiter.requests.take(limiter.requests.capacity)
+    order = []
+
+    async def request(i):
+        await limiter.acquire(0)
+        order.append(i)
+
+    async def main():
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.create_task(request(i)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.stats()["requests"] == 5
+
+
+def test_token_limit_waits_for_the_estimated_tokens():
+    limiter = RateLimiter(tpm=6000)
+
+    async def main():
+        await limiter.acquire(6000)
+        start = time.monotonic()
+        await limiter.acquire(10)
+        return time.monotonic() - start
+
+    # 1秒に100トークン補充される
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_rate_limited_pauses_all_requests_and_slows_down():
+    limiter = RateLimiter(rpm=6000, min_scale=0.3)
+    delay = limiter.on_rate_limited(0.1, attempt=0)
+    assert 0.1 <= delay <= 0.125
+    assert limiter.scale == 0.5
+
+    async def main():
+        start = time.monotonic()
+        await limiter.acquire(0)
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.09
+    limiter.on_rate_limited(0.0, attempt=1)
+    assert limiter.scale == 0.3
+    # 成功するたびに少しずつ元の速さに戻す
+    limiter.settle(10, 12)
+    assert abs(limiter.scale - 0.35) < 1e-9
+    limiter.settle(10, None)
+    assert abs(limiter.scale - 0.35) < 1e-9
+    assert limiter.stats()["rate_limited"] == 2
+
+
+def test_retry_after_is_read_from_the_response_headers():
+    def error(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert retry_after_seconds(error({"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(error({"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(error({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+    assert retry_after_seconds(Exception()) is None
+
+
+def test_client_backs_off_through_the_limiter_on_429():
+    provider = LimitedProvider(limited=2)
+    limiter = RateLimiter(rpm=6000)
+    client = MCPOpenAIClient(router=LLMRouter([provider]), rate_limiter=limiter)
+
+    async def main():
+        start = time.monotonic()
+        await client._request_completion({"model": "model", "messages": []})
+        return time.monotonic() - start
+
+    # Retry-After の間はすべてのリクエストを止めてからやり直す
+    assert asyncio.run(main()) >= 0.1
+    assert provider.calls == 3
+    assert limiter.stats()["rate_limited"] == 2
@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import sys
+from datetime import timedelta
+
+from mcp import StdioServerParameters
+
+from mcpcommon.sessionpool import MCPSessionPool
+
+SERVER = '''
+import os
+import time
+
+from mcp.server.fastmcp import FastMCP
+
+mcp = FastMCP("test")
+
+
+@mcp.tool()
+def slow(seconds: float) -> str:
+    time.sleep(seconds)
+    return "done"
+
+
+@mcp.tool()
+def exit() -> str:
+    os._exit(0)
+
+
+mcp.run(transport="stdio")
+'''
+
+
+def make_pool(tmp_path, **kwargs):
+    script = tmp_path / "server.py"
+    script.write_text(SERVER, encoding="utf-8")
+    params = StdioServerParameters(command=sys.executable, args=[str(script)])
+    return MCPSessionPool(params, health_interval=3600, **kwargs)
+
+
+def test_lease_is_not_blocked_by_health_check(tmp_path):
+    async def main():
+        pool = make_pool(tmp_path, min_size=1, max_size=2, ping_timeout=2.0)
+        await pool.start()
+        try:
+            # サーバーがツールを処理している間は、pingの応答も遅れる
+            worker = pool._workers[0]
+            busy = asyncio.create_task(worker.session.call_tool("slow", {"seconds": 0.5}))
+            await asyncio.sleep(0.1)
+            check = asyncio.create_task(pool.check_health())
+            await asyncio.sleep(0.05)
+            async with pool.lease():
+                assert pool.stats()["size"] == 1
+            await asyncio.gather(busy, check)
+            assert pool.stats()["scale_ups"] == 0
+            assert pool.stats()["failed_health_checks"] == 0
+            assert pool.stats()["idle"] == 1
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+def test_exited_process_is_not_reported_alive(tmp_path):
+    async def main():
+        pool = make_pool(tmp_path, min_size=1)
+        await pool.start()
+        try:
+            async with pool.lease() as session:
+                worker = pool._workers[0]
+                with contextlib.suppress(Exception):
+                    await session.call_tool("exit", read_timeout_seconds=timedelta(seconds=0.5))
+                for _ in range(50):
+                    if not worker.alive:
+                        break
+                    await asyncio.sleep(0.05)
+                assert not worker.alive
+            # 返却の時点で作り直され、新しいプロセスで呼び出せる
+            result = await pool.call_tool("slow", {"seconds": 0})
+            assert result.content[0].text == "done"
+            assert pool.alive
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+import asyncio
+import gc
+import json
+
+from mcpcommon.speculate import Prefetch, ToolPredictor
+
+ENTRIES = [
+    {"question": "What is the vacation policy?", "answer": "20 days."},
+    {"question": "How do I request a software license?", "answer": "File a ticket."},
+]
+
+
+def test_predictor_learns_the_query_template(tmp_path):
+    kb = tmp_path / "kb.json"
+    kb.write_text(json.dumps(ENTRIES), encoding="utf-8")
+    predictor = ToolPredictor(str(kb))
+    allowed = {"get_knowledge_base", "search_knowledge_base"}
+
+    query = "What is the vacation policy?"
+    first = predictor.predict(query, allowed)
+    assert first == ("get_knowledge_base", {})
+    assert not predictor.record(query, first, [("search_knowledge_base", {"query": query})])
+
+    query = "How do I request a software license?"
+    second = predictor.predict(query, allowed)
+    assert second == ("search_knowledge_base", {"query": query})
+    assert predictor.record(query, second, [("search_knowledge_base", {"query": query})])
+    assert predictor.predict("hello", allowed) is None
+    assert predictor.predict(query, {"get_knowledge_base"}) is None
+    assert predictor.stats()["hit_rate"] == 0.5
+
+
+def test_claim_only_matching_call_once():
+    async def main():
+        prefetch = Prefetch(("search", {"query": "q"}), asyncio.ensure_future(asyncio.sleep(0)))
+        assert not prefetch.claim("search", {"query": "other"})
+        assert prefetch.claim("search", {"query": "q"})
+        assert not prefetch.claim("search", {"query": "q"})
+        await prefetch.task
+
+    asyncio.run(main())
+
+
+def test_discard_retrieves_the_task_exception():
+    errors = []
+
+    async def fail():
+        raise RuntimeError("pool closed")
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        prefetch = Prefetch(("search", {}), asyncio.ensure_future(fail()))
+        await asyncio.sleep(0)
+        await prefetch.discard()
+        assert prefetch.task.done()
+        del prefetch
+        gc.collect()
+
+    asyncio.run(main())
+    assert errors == []
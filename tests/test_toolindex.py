@@ -0,0 +1,73 @@
+from mcpcommon.toolindex import ToolIndex
+
+
+def tool(name, description, **parameters):
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {key: {"description": value} for key, value in parameters.items()},
+            },
+        },
+    }
+
+
+TOOLS = [
+    tool("get_weather", "Get the weather forecast for a city", city="City name"),
+    tool("search_knowledge_base", "Search the company knowledge base", query="Question"),
+    tool("send_email", "Send an email message", to="Recipient address"),
+    tool("convert_currency", "Convert an amount between currencies", amount="Amount"),
+    tool("get_time", "Get the current time in a timezone", timezone="Timezone"),
+]
+
+
+def names(tools):
+    return [tool["function"]["name"] for tool in tools]
+
+
+def make_index(pinned=(), marked=()):
+    index = ToolIndex(pinned=pinned)
+    index.update(TOOLS, pinned=marked)
+    return index
+
+
+def test_selects_the_most_relevant_tools_in_catalog_order():
+    index = make_index()
+    assert names(index.select("What is the weather forecast in Tokyo?", 1)) == ["get_weather"]
+    selected = names(index.select("Send an email about the weather", 2))
+    assert selected == ["get_weather", "send_email"]
+
+
+def test_pinned_tools_are_always_sent_on_top_of_k():
+    index = make_index(pinned=["search_knowledge_base"], marked=["get_time"])
+    selected = names(index.select("Convert 100 dollars to currency yen", 1))
+    assert selected == ["search_knowledge_base", "convert_currency", "get_time"]
+
+
+def test_popular_tools_fill_unmatched_slots():
+    index = make_index()
+    for _ in range(3):
+        index.record_use("get_time")
+    index.record_use("send_email")
+    selected = names(index.select("weather", 3))
+    assert selected == ["get_weather", "send_email", "get_time"]
+
+
+def test_all_tools_are_sent_when_few_or_unlimited():
+    index = make_index(pinned=["search_knowledge_base"])
+    assert names(index.select("anything", None)) == names(TOOLS)
+    assert names(index.select("anything", 4)) == names(TOOLS)
+    stats = index.stats()
+    assert stats["selections"] == 2 and stats["pruned"] == 0
+    assert stats["sent_tokens_avg"] == stats["catalog_tokens_avg"]
+
+
+def test_stats_count_pruned_tools():
+    index = make_index()
+    index.select("weather", 1)
+    stats = index.stats()
+    assert stats["pruned"] == len(TOOLS) - 1
+    assert stats["sent_tokens_avg"] < stats["catalog_tokens_avg"]
@@ -0,0 +1,32 @@
+import socket
+import urllib.request
+
+from mcpcommon.tracing import Tracer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scrape(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        return response.read().decode("utf-8")
+
+
+def test_tracers_on_one_port_share_the_endpoint():
+    port = free_port()
+    first = Tracer("client", metrics_port=port)
+    # 再接続で作り直したクライアントのトレーサーも、同じポートで作れる
+    second = Tracer("client", metrics_port=port)
+    with first.span("completion.first"):
+        pass
+    with second.span("completion.first"):
+        pass
+    assert 'mcp_span_duration_seconds_count{service="client",phase="completion.first"} 2' in scrape(port)
+
+    first.close()
+    assert 'phase="completion.first"} 1' in scrape(port)
+    second.close()
+    assert "completion.first" not in scrape(port)